@@ -3,16 +3,48 @@ GVM Panel - VPS Management Web Application
 Complete web-based VPS control panel with user and admin interfaces
 """
 
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
+from flask import Flask, Response, g, has_request_context, render_template, request, redirect, url_for, session, jsonify, flash, send_from_directory
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import bindparam, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import joinedload
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.utils import safe_join
 from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
 import subprocess
+import atexit
+import base64
+import hashlib
 import json
+import fcntl
+import math
+import mimetypes
+import pty
+import queue
+import re
+import select
+import signal
+import shutil
+import tempfile
 import shlex
-from datetime import datetime
+import struct
+import termios
+from datetime import datetime, timedelta
+from collections import deque
+from array import array
+from types import SimpleNamespace
+from urllib.parse import urlsplit
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
+from lxd_client import LXDClient, LXDError, LXDConnectionError, find_socket_path
+import instrumentation
 import logging
 import os
+import threading
+import time
+import uuid
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -20,9 +52,142 @@ logger = logging.getLogger('gvm_panel')
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-change-this-in-production'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///gvm_panel.db'
+app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'  # keep the session off cross-site subrequests and form posts
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///gvm_panel.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['HOST_METRICS_INTERVAL'] = 5  # seconds between host samples
+app.config['HOST_METRICS_HISTORY'] = 60  # samples kept in memory
+app.config['PROVISION_WORKERS'] = 2  # concurrent lxc launches per process
+app.config['INVENTORY_INTERVAL'] = 10  # seconds between `lxc list` reconciliations
+app.config['ADMIN_PAGE_SIZE'] = 50  # rows per page in admin tables
+app.config['LXD_SOCKET'] = os.environ.get('LXD_SOCKET', find_socket_path())
+app.config['LXD_STORAGE_POOL'] = 'btrpool'
+# LXD nodes VPS can be placed on; the first one is the default. 'endpoint' is a unix
+# socket path or an https:// URL (remote nodes also take 'cert': (cert_file, key_file)
+# and 'verify'). Any NODE_DEFAULTS key can be overridden per node, and 'warm_pool'
+# replaces WARM_POOL for that node.
+app.config['LXD_NODES'] = {
+    'local': {'endpoint': app.config['LXD_SOCKET']},
+}
+app.config['PLACEMENT_POLICY'] = 'spread'  # 'spread' (most free RAM first) or 'binpack' (fullest node that fits)
+app.config['NODE_REFRESH_INTERVAL'] = 30  # seconds between node capacity refreshes
+app.config['VPS_IMAGE'] = 'ubuntu:22.04'
+# Stopped containers kept ready on each node per 'Plan/Processor' for near-instant creation
+app.config['WARM_POOL'] = {'Starter/Intel': 2, 'Starter/AMD': 1}
+app.config['WARM_POOL_INTERVAL'] = 30  # seconds between pool replenishment checks
+app.config['METRICS_RAW_POINTS'] = 360  # in-memory samples per VPS (1 hour at the inventory interval)
+app.config['METRICS_RETENTION'] = {60: 2 * 86400, 3600: 30 * 86400}  # rollup resolution -> seconds kept
+app.config['STREAM_KEEPALIVE'] = 15  # seconds between SSE keep-alive comments
+app.config['STREAM_QUEUE_SIZE'] = 16  # events buffered per subscriber before old ones are dropped
+app.config['STREAM_MAX_PER_USER'] = 4  # concurrent stats streams per user, across all processes
+# Every open stream or console holds a server thread; keep the two below Gunicorn's --threads
+app.config['STREAM_MAX_PER_PROCESS'] = 24  # concurrent stats streams per worker process
+app.config['STREAM_MAX_DURATION'] = 300  # seconds before a stats stream is ended; EventSource reconnects by itself
+app.config['SETTINGS_CACHE_TTL'] = 5  # seconds between Settings version checks
+app.config['BULK_WORKERS'] = 8  # threads running bulk power operations
+app.config['BULK_MAX_ITEMS'] = 500  # VPS ids accepted per bulk request
+app.config['LXC_HOST_CONCURRENCY'] = 4  # concurrent bulk LXC operations per host
+app.config['TEARDOWN_WORKERS'] = 8  # containers deleted in parallel when removing a user
+app.config['TEARDOWN_MAX_ATTEMPTS'] = 5
+# Seconds a VPS must stay idle before it is suspended, per plan (None: never suspend)
+app.config['IDLE_SUSPEND_AFTER'] = {'Starter': 6 * 3600, 'Basic': 6 * 3600, 'Standard': 12 * 3600, 'Pro': None}
+app.config['IDLE_CPU_PERCENT'] = 2.0  # CPU use (% of one core) below which a container counts as idle
+app.config['IDLE_NETWORK_BYTES'] = 2048  # traffic in bytes/second below which a container counts as idle
+app.config['IDLE_SUSPEND_MODE'] = 'stop'  # 'stop' frees the container's RAM, 'freeze' only pauses it
+app.config['METER_INTERVAL'] = 60  # seconds of running time per usage sample; keep it >= INVENTORY_INTERVAL
+app.config['BILLING_CYCLE'] = None  # seconds of metered usage debited together, e.g. 3600; None: usage isn't billed
+app.config['BILLING_CPU_RATE'] = 0  # credits per CPU-hour, on top of the plan's hourly rate
+app.config['BACKUP_DIR'] = os.environ.get('BACKUP_DIR', '/var/backups/gvm')
+app.config['BACKUP_INTERVAL'] = 86400  # seconds between scheduled backups of each VPS (None: manual only)
+app.config['BACKUP_FULL_EVERY'] = 7  # backups per chain: one full btrfs send, then incrementals
+app.config['BACKUP_RETENTION'] = 14  # backups kept per VPS; older chains are pruned whole
+app.config['BACKUP_WORKERS'] = 4
+app.config['BACKUP_HOST_CONCURRENCY'] = 1  # concurrent backups per LXD node, across all processes
+app.config['BACKUP_CHUNK_SIZE'] = 1024 * 1024  # bytes copied from btrfs send per read
+app.config['BACKUP_TIMEOUT'] = 6 * 3600  # running backups older than this are treated as interrupted
+app.config['SNAPSHOT_LIMIT'] = 5  # manual snapshots per VPS
+app.config['RATE_LIMIT_BACKEND'] = 'sqlite'  # 'sqlite' shares limits across worker processes, 'memory' is per process
+# Token buckets per role and operation class: (burst, seconds to refill the whole burst); None is unlimited
+app.config['RATE_LIMITS'] = {
+    'user': {'power': (10, 60), 'delete': (5, 300), 'create': (3, 600), 'bulk': (2, 60),
+             'snapshot': (5, 300), 'backup': (2, 3600)},
+    'admin': None
+}
+app.config['OPERATION_QUOTAS'] = {'Starter': 1, 'Basic': 2, 'Standard': 2, 'Pro': 4}  # concurrent operations per user and plan
+app.config['OPERATION_LEASE_TTL'] = 300  # seconds before an unreleased operation slot expires
+app.config['LEADER_LEASE_TTL'] = 30  # seconds before another worker process takes over the singleton loops of a dead one
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')  # bearer token required on /metrics when set
+app.config['METRICS_DIR'] = os.environ.get('METRICS_DIR')  # shared by worker processes so /metrics covers all of them; None: only the worker scraped
+app.config['AUDIT_SPILL_DIR'] = os.environ.get('AUDIT_SPILL_DIR', os.path.join(app.instance_path, 'audit-spill'))
+app.config['AUDIT_QUEUE_SIZE'] = 10000  # audit events buffered per process before requests are slowed down
+app.config['AUDIT_BATCH_SIZE'] = 500  # events written per transaction
+app.config['AUDIT_FLUSH_INTERVAL'] = 1.0  # seconds an event may wait in memory before it is written
+app.config['AUDIT_ENQUEUE_TIMEOUT'] = 0.5  # seconds a request waits on a full queue before spilling to disk
+app.config['CONSOLE_COMMAND'] = ['bash', '-l']  # shell started by `lxc exec` for web consoles
+app.config['CONSOLE_SESSIONS_PER_USER'] = 2  # concurrent web consoles per user, across all processes
+app.config['CONSOLE_SESSIONS_PER_VPS'] = 4  # concurrent web consoles per VPS, across all processes
+app.config['CONSOLE_SESSIONS_PER_PROCESS'] = 16  # concurrent web consoles per worker process
+app.config['CONSOLE_IDLE_TIMEOUT'] = 900  # seconds without keyboard input before a console is closed
+app.config['CONSOLE_MAX_DURATION'] = 8 * 3600  # seconds before any console is closed
+app.config['CONSOLE_BUFFER_SIZE'] = 256 * 1024  # output bytes held per console before the shell is paused
+app.config['CONSOLE_BATCH_SIZE'] = 64 * 1024  # most output bytes sent in one WebSocket message
+app.config['CONSOLE_FLUSH_INTERVAL'] = 0.02  # seconds output is collected before it is sent
+app.config['SOCK_SERVER_OPTIONS'] = {'ping_interval': 25, 'max_message_size': 64 * 1024}
+app.config['API_PAGE_SIZE'] = 50  # default rows per /api/v1 page
+app.config['API_MAX_PAGE_SIZE'] = 200
+app.config['ASSET_MAX_AGE'] = 365 * 86400  # seconds browsers cache content-hashed assets from build_assets.py
 db = SQLAlchemy(app)
+sock = Sock(app)
+
+NODE_DEFAULTS = {
+    'storage_pool': app.config['LXD_STORAGE_POOL'],
+    'cpu_allocation_ratio': 4,  # vCPUs sold per host thread
+    'memory_overcommit': 1.0,  # plan RAM sold per byte of host RAM
+    'max_pool_usage': 0.9,  # stop placing on a node once its storage pool is this full
+    'storage_path': None  # local mount of the storage pool for btrfs send; defaults to storage-pools/<pool> beside the socket
+}
+
+# 'price' is charged once at creation, 'hourly' per hour the container runs
+VPS_PLANS = {
+    'Starter': {'ram': '4GB', 'cpu': '1', 'storage': '10GB', 'price': {'Intel': 42, 'AMD': 83},
+                'hourly': {'Intel': 1, 'AMD': 2}},
+    'Basic': {'ram': '8GB', 'cpu': '1', 'storage': '10GB', 'price': {'Intel': 96, 'AMD': 164},
+              'hourly': {'Intel': 2, 'AMD': 3}},
+    'Standard': {'ram': '12GB', 'cpu': '2', 'storage': '10GB', 'price': {'Intel': 192, 'AMD': 320},
+                 'hourly': {'Intel': 4, 'AMD': 6}},
+    'Pro': {'ram': '16GB', 'cpu': '2', 'storage': '10GB', 'price': {'Intel': 220, 'AMD': 340},
+            'hourly': {'Intel': 5, 'AMD': 7}}
+}
+
+# Instrumentation
+metrics_registry = instrumentation.Registry(directory=app.config['METRICS_DIR'])
+http_request_duration = metrics_registry.histogram(
+    'gvm_http_request_duration_seconds', 'Request latency by route', ('endpoint', 'method'))
+http_requests_total = metrics_registry.counter(
+    'gvm_http_requests_total', 'Requests served by route and status code', ('endpoint', 'method', 'status'))
+http_requests_in_flight = metrics_registry.gauge('gvm_http_requests_in_flight', 'Requests being served, including open streams')
+http_requests_in_flight.set(0)
+db_queries_per_request = metrics_registry.histogram(
+    'gvm_db_queries_per_request', 'SQL statements executed per request', ('endpoint',),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 250))
+db_queries_total = metrics_registry.counter('gvm_db_queries_total', 'SQL statements executed')
+lxc_command_duration = metrics_registry.histogram(
+    'gvm_lxc_command_duration_seconds', 'LXC operation duration by subcommand', ('command', 'transport'))
+lxc_command_failures = metrics_registry.counter(
+    'gvm_lxc_command_failures_total', 'Failed LXC operations, timeouts included', ('command', 'transport'))
+lxc_command_timeouts = metrics_registry.counter(
+    'gvm_lxc_command_timeouts_total', 'LXC operations that timed out', ('command', 'transport'))
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    db_queries_total.inc()
+    if has_request_context():
+        g.db_queries = g.get('db_queries', 0) + 1
+
+def lxc_subcommand(command):
+    """Metric label for an lxc command line, e.g. 'lxc config set ...' -> 'config'"""
+    parts = command.split()
+    return parts[1] if len(parts) > 1 and parts[0] == 'lxc' else parts[0] if parts else 'unknown'
 
 # Database Models
 class Settings(db.Model):
@@ -31,6 +196,7 @@ class Settings(db.Model):
     logo_url = db.Column(db.String(500), default='https://cdn.discordapp.com/attachments/1417915306227142746/1430629663645892820/IMG_20251020_132544.jpg')
     background_url = db.Column(db.String(500), default='')
     welcome_text = db.Column(db.String(500), default='Welcome to GVM Panel')
+    version = db.Column(db.Integer, default=1, server_default='1', nullable=False)  # bumped on every change
     
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -40,25 +206,225 @@ class User(db.Model):
     role = db.Column(db.String(20), default='user')  # 'admin' or 'user'
     credits = db.Column(db.Integer, default=0)
     theme = db.Column(db.String(10), default='dark')  # 'dark' or 'light'
+    status = db.Column(db.String(20), default='active', server_default='active', nullable=False)  # 'active' or 'deleting'
+    rate_limit_overrides = db.Column(db.Text)  # JSON {operation: [burst, seconds] or null, 'concurrent': n} set by admins
+    unbilled_usage = db.Column(db.Float, default=0, server_default='0', nullable=False)  # credits owed but not yet debited
+    version = db.Column(db.Integer, default=1, server_default='1', nullable=False)  # bumped on every change, feeds API ETags
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     vps_instances = db.relationship('VPS', backref='owner', lazy=True, cascade='all, delete-orphan')
 
 class VPS(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     container_name = db.Column(db.String(100), unique=True, nullable=False)
     plan = db.Column(db.String(50), default='Custom')
     ram = db.Column(db.String(20))
     cpu = db.Column(db.String(20))
     storage = db.Column(db.String(20))
     processor = db.Column(db.String(20), default='Intel')
-    status = db.Column(db.String(20), default='stopped')
+    status = db.Column(db.String(20), default='stopped', index=True)  # 'running', 'stopped', 'suspended', 'provisioning' or 'deleting'
+    host = db.Column(db.String(50), default='local', server_default='local', nullable=False, index=True)  # LXD node
+    suspended_at = db.Column(db.DateTime)  # when the idle scheduler last suspended it
+    version = db.Column(db.Integer, default=1, server_default='1', nullable=False)  # bumped on every change, feeds API ETags
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    metrics = db.relationship('VPSMetric', backref='vps', lazy='dynamic', cascade='all, delete-orphan')
+
+class VPSMetric(db.Model):
+    """CPU and memory rollup for one VPS over one 1-minute or 1-hour bucket"""
+    __table_args__ = (db.UniqueConstraint('vps_id', 'resolution', 'bucket_start'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    vps_id = db.Column(db.Integer, db.ForeignKey('vps.id'), nullable=False)
+    resolution = db.Column(db.Integer, nullable=False)  # bucket length in seconds: 60 or 3600
+    bucket_start = db.Column(db.Integer, nullable=False)  # unix timestamp
+    cpu_avg = db.Column(db.Float, default=0)  # percent of one core
+    cpu_max = db.Column(db.Float, default=0)
+    memory_avg = db.Column(db.Float, default=0)  # MB
+    memory_max = db.Column(db.Float, default=0)
+    samples = db.Column(db.Integer, default=0)
+
+class ProvisionJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    vps_id = db.Column(db.Integer, db.ForeignKey('vps.id', ondelete='SET NULL'))
+    container_name = db.Column(db.String(100), nullable=False)
+    memory_limit = db.Column(db.String(20), nullable=False)  # LXD limits.memory, e.g. '4096MB'
+    cpu_limit = db.Column(db.String(20), nullable=False)  # LXD limits.cpu
+    cost = db.Column(db.Integer, default=0)
+    reservation_id = db.Column(db.Integer, db.ForeignKey('credit_transaction.id'))
+    status = db.Column(db.String(20), default='queued')  # 'queued', 'running', 'completed' or 'failed'
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'vps_id': self.vps_id,
+            'container_name': self.container_name,
+            'status': self.status,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class WarmContainer(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    container_name = db.Column(db.String(100), unique=True, nullable=False)
+    pool_key = db.Column(db.String(50), nullable=False, index=True)  # 'Plan/Processor'
+    host = db.Column(db.String(50), default='local', server_default='local', nullable=False)
+    status = db.Column(db.String(20), default='creating', index=True)  # 'creating' or 'ready'
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class CreditTransaction(db.Model):
+    """Append-only ledger of every change to User.credits"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    amount = db.Column(db.Integer, nullable=False)  # signed change applied to User.credits
+    kind = db.Column(db.String(20), nullable=False)  # 'reserve', 'capture', 'refund', 'usage', 'admin_add' or 'admin_remove'
+    reservation_id = db.Column(db.Integer, db.ForeignKey('credit_transaction.id'), unique=True)  # set on capture/refund
+    reference = db.Column(db.String(100))  # e.g. 'vps:vps-3-2' or 'cycle:1700000000'
+    actor_id = db.Column(db.Integer)  # admin who made a manual adjustment
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Counter(db.Model):
+    """Named monotonic counters used for race-free name allocation"""
+    name = db.Column(db.String(100), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+
+class TeardownTask(db.Model):
+    """Deletion of one container on behalf of a user being removed"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)  # kept after the user row is purged
+    vps_id = db.Column(db.Integer)
+    container_name = db.Column(db.String(100), nullable=False)
+    host = db.Column(db.String(50), default='local', server_default='local', nullable=False)
+    status = db.Column(db.String(20), default='pending', index=True)  # 'pending', 'running', 'done' or 'failed'
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+
+class Backup(db.Model):
+    """A btrfs send stream of one VPS snapshot, full or incremental on its parent"""
+    id = db.Column(db.Integer, primary_key=True)
+    vps_id = db.Column(db.Integer, db.ForeignKey('vps.id'), nullable=False, index=True)
+    container_name = db.Column(db.String(100), nullable=False)
+    host = db.Column(db.String(50), default='local', server_default='local', nullable=False)
+    snapshot_name = db.Column(db.String(100), nullable=False)
+    parent_id = db.Column(db.Integer, db.ForeignKey('backup.id'))  # None for a full send
+    chain_position = db.Column(db.Integer, default=0)  # 0 for the full send, then 1, 2, ... for incrementals
+    kind = db.Column(db.String(20), default='manual')  # 'manual' or 'scheduled'
+    status = db.Column(db.String(20), default='queued', index=True)  # 'queued', 'running', 'done' or 'failed'
+    path = db.Column(db.String(255))
+    size_bytes = db.Column(db.BigInteger, default=0)
+    checksum = db.Column(db.String(64))  # sha256 of the stream
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    # At most one queued or running backup per VPS
+    __table_args__ = (db.Index('ix_backup_active_vps', 'vps_id', unique=True,
+                               sqlite_where=db.text("status IN ('queued', 'running')")),)
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'snapshot': self.snapshot_name,
+            'type': 'incremental' if self.parent_id else 'full',
+            'kind': self.kind,
+            'status': self.status,
+            'size_bytes': self.size_bytes,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class RateLimitBucket(db.Model):
+    """Shared token bucket for one user and operation class"""
+    key = db.Column(db.String(120), primary_key=True)
+    tokens = db.Column(db.Float, nullable=False)
+    updated_at = db.Column(db.Float, nullable=False)  # unix time of the last refill
+
+class OperationLease(db.Model):
+    """An operation in progress, counted against a concurrent-operation quota"""
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(120), nullable=False, index=True)
+    expires_at = db.Column(db.Float, nullable=False)
+    action = db.Column(db.String(20))  # what the holder is doing, e.g. 'stop' for a container lock
+
+class SharedState(db.Model):
+    """What the leader process's background loops saw, for the other worker processes"""
+    key = db.Column(db.String(120), primary_key=True)  # 'inventory:<node>' or 'capacity'
+    data = db.Column(db.Text, nullable=False)  # JSON
+    updated_at = db.Column(db.Float, nullable=False)  # unix time of the observation
+
+class AuditEvent(db.Model):
+    """Append-only record of who did what to which user or VPS"""
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.String(32), unique=True, nullable=False)  # uuid4 hex, makes spill replays idempotent
+    created_at = db.Column(db.DateTime, nullable=False, index=True)
+    action = db.Column(db.String(40), nullable=False)  # e.g. 'vps.stop', 'credits.add', 'user.delete'
+    # No foreign keys: events outlive the users and VPS they mention
+    actor_id = db.Column(db.Integer, index=True)  # who did it; None for the panel itself
+    user_id = db.Column(db.Integer, index=True)  # user affected (the owner, for VPS actions)
+    vps_id = db.Column(db.Integer, index=True)
+    target = db.Column(db.String(100), index=True)  # container name or username at the time of the event
+    ip = db.Column(db.String(45))
+    details = db.Column(db.Text)  # JSON
+
+class UsageSample(db.Model):
+    """A metering interval in which a VPS's container was seen running"""
+    __table_args__ = (db.UniqueConstraint('vps_id', 'slot'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign keys: usage of a VPS deleted mid-cycle is still billed
+    vps_id = db.Column(db.Integer, nullable=False)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    container_name = db.Column(db.String(100), nullable=False)
+    slot = db.Column(db.Integer, nullable=False, index=True)  # unix time the interval starts
+    cpu_usage = db.Column(db.BigInteger, default=0)  # cumulative LXD CPU time in nanoseconds when sampled
+    rate = db.Column(db.Float, default=0)  # the plan's credits per hour at the time
+
+class UsageRecord(db.Model):
+    """Metered usage of one VPS in one billing cycle and what it cost"""
+    __table_args__ = (db.UniqueConstraint('cycle_start', 'vps_id'),)
+    
+    id = db.Column(db.Integer, primary_key=True)
+    cycle_start = db.Column(db.Integer, nullable=False, index=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    vps_id = db.Column(db.Integer, nullable=False)
+    container_name = db.Column(db.String(100), nullable=False)
+    running_seconds = db.Column(db.Integer, default=0)
+    cpu_seconds = db.Column(db.Float, default=0)
+    cost = db.Column(db.Float, default=0)  # credits, before rounding to whole credits per user
+
+class BillingCycle(db.Model):
+    """A billed period; inserted in the same transaction that debits its usage"""
+    start = db.Column(db.Integer, primary_key=True)  # unix time
+    end = db.Column(db.Integer, nullable=False)
+    users = db.Column(db.Integer, default=0)
+    vps = db.Column(db.Integer, default=0)
+    debited = db.Column(db.Integer, default=0)  # whole credits taken from users
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+@event.listens_for(User, 'before_update')
+@event.listens_for(VPS, 'before_update')
+def bump_row_version(mapper, connection, target):
+    """Increment the row version in the same UPDATE as any ORM change; Core updates bump it themselves"""
+    if db.object_session(target).is_modified(target, include_collections=False):
+        target.version = type(target).version + 1
+
 # Helper Functions
 def execute_lxc_sync(command, timeout=120):
     """Execute LXC command synchronously"""
+    subcommand = lxc_subcommand(command)
+    started = time.perf_counter()
     try:
         cmd = shlex.split(command)
         result = subprocess.run(
@@ -71,80 +437,2906 @@ def execute_lxc_sync(command, timeout=120):
         if result.returncode != 0:
             error = result.stderr.strip() if result.stderr else "Command failed"
             logger.error(f"LXC Error: {command} - {error}")
+            lxc_command_failures.inc(subcommand, 'cli')
             return False, error
         return True, result.stdout.strip() if result.stdout else True
     except subprocess.TimeoutExpired:
         logger.error(f"LXC command timed out: {command}")
+        lxc_command_failures.inc(subcommand, 'cli')
+        lxc_command_timeouts.inc(subcommand, 'cli')
         return False, f"Command timed out after {timeout} seconds"
     except Exception as e:
         logger.error(f"LXC Error: {command} - {str(e)}")
+        lxc_command_failures.inc(subcommand, 'cli')
         return False, str(e)
+    finally:
+        lxc_command_duration.observe(time.perf_counter() - started, subcommand, 'cli')
+
+class StatsBroadcaster:
+    """Fans out sampler updates to every subscribed stats stream.
+
+    The samplers publish each update once; subscribers get it through a small
+    bounded queue, so N viewers cost one sample and a slow browser only loses
+    its own oldest updates. At most `max_subscribers` streams are served at once.
+    """
+
+    def __init__(self, queue_size=16, max_subscribers=None):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.subscribers = set()
+        self._lock = threading.Lock()
+
+    def subscribe(self):
+        """Return a new subscriber queue, or None when max_subscribers are already subscribed"""
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self._lock:
+            if self.max_subscribers is not None and len(self.subscribers) >= self.max_subscribers:
+                return None
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, event, data):
+        with self._lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            while True:
+                try:
+                    subscriber.put_nowait((event, data))
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+
+stats_broadcaster = StatsBroadcaster(queue_size=app.config['STREAM_QUEUE_SIZE'],
+                                     max_subscribers=app.config['STREAM_MAX_PER_PROCESS'])
+
+class HostMetricsSampler:
+    """Background sampler for host CPU, RAM and disk usage.
+
+    Reads /proc/stat, /proc/meminfo and statvfs directly on a fixed interval
+    and keeps a small ring buffer of recent samples, so page renders only read
+    the latest cached value instead of forking shell pipelines.
+    """
+
+    def __init__(self, interval=5, history=60, disk_path='/'):
+        self.interval = interval
+        self.disk_path = disk_path
+        self.samples = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._prev_cpu = None
+
+    def _read_cpu_usage(self):
+        with open('/proc/stat') as f:
+            fields = [int(v) for v in f.readline().split()[1:]]
+        idle = fields[3] + (fields[4] if len(fields) > 4 else 0)  # idle + iowait
+        total = sum(fields[:8])  # guest time is already counted in user/nice
+        prev = self._prev_cpu
+        self._prev_cpu = (idle, total)
+        if prev is None:
+            # First reading: average since boot
+            idle_delta, total_delta = idle, total
+        else:
+            idle_delta, total_delta = idle - prev[0], total - prev[1]
+        if total_delta <= 0:
+            return 0.0
+        return 100.0 * (total_delta - idle_delta) / total_delta
+
+    def _read_ram_usage(self):
+        meminfo = {}
+        with open('/proc/meminfo') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                meminfo[key] = int(value.split()[0])
+        total = meminfo.get('MemTotal', 0)
+        available = meminfo.get('MemAvailable', meminfo.get('MemFree', 0))
+        if not total:
+            return 0.0
+        return 100.0 * (total - available) / total
+
+    def _read_disk_usage(self):
+        st = os.statvfs(self.disk_path)
+        used = (st.f_blocks - st.f_bfree) * st.f_frsize
+        usable = used + st.f_bavail * st.f_frsize
+        if not usable:
+            return 0.0
+        return 100.0 * used / usable
+
+    def sample(self):
+        """Take one sample and append it to the ring buffer"""
+        sample = {'timestamp': time.time()}
+        for key, reader in (('cpu', self._read_cpu_usage),
+                            ('ram', self._read_ram_usage),
+                            ('disk', self._read_disk_usage)):
+            try:
+                sample[key] = round(reader(), 2)
+            except Exception as e:
+                logger.error(f"Error sampling host {key}: {e}")
+                sample[key] = 0
+        with self._lock:
+            self.samples.append(sample)
+        stats_broadcaster.publish('host', sample)
+        return sample
+
+    def latest(self):
+        """Return the most recent sample, sampling inline if none exists yet"""
+        with self._lock:
+            if self.samples:
+                return self.samples[-1]
+        return self.sample()
+
+    def history(self):
+        """Return a copy of the buffered samples, oldest first"""
+        with self._lock:
+            return list(self.samples)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Start the sampling thread if it is not already running in this process"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='host-metrics-sampler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+host_sampler = HostMetricsSampler(
+    interval=app.config['HOST_METRICS_INTERVAL'],
+    history=app.config['HOST_METRICS_HISTORY']
+)
+
+def get_system_resources():
+    """Get system CPU, RAM, and Disk usage from the background sampler"""
+    host_sampler.start()
+    sample = host_sampler.latest()
+    return {'cpu': sample['cpu'], 'ram': sample['ram'], 'disk': sample['disk']}
+
+def make_lxd_client(options):
+    endpoint = options.get('endpoint')
+    if endpoint and endpoint.startswith('https://'):
+        return LXDClient(url=endpoint, cert=options.get('cert'), verify=options.get('verify', True))
+    return LXDClient(endpoint)
+
+lxd_nodes = {name: make_lxd_client(options) for name, options in app.config['LXD_NODES'].items()}
+DEFAULT_NODE = next(iter(lxd_nodes))
+
+def node_option(host, key):
+    """Look up a per-node setting, falling back to NODE_DEFAULTS"""
+    options = app.config['LXD_NODES'].get(host or DEFAULT_NODE, {})
+    return options.get(key, NODE_DEFAULTS[key])
+
+def cli_target(container_name, host=None):
+    """Container reference for the lxc CLI; other nodes are addressed as lxc remotes"""
+    if host in (None, DEFAULT_NODE):
+        return container_name
+    return f"{host}:{container_name}"
+
+def lxc_call(cli_command, rest_call, host=None):
+    """Run an LXD operation on a node through the REST API, falling back to the lxc CLI.
+
+    `rest_call` receives the node's LXDClient. Returns (success, output) like
+    execute_lxc_sync.
+    """
+    client = lxd_nodes.get(host or DEFAULT_NODE)
+    if client is None:
+        return False, f"Unknown LXD node: {host}"
+    if client.available():
+        subcommand = lxc_subcommand(cli_command)
+        started = time.perf_counter()
+        try:
+            return True, rest_call(client)
+        except LXDConnectionError as e:
+            logger.warning(f"LXD node {host or DEFAULT_NODE} unavailable, falling back to lxc CLI: {e}")
+            lxc_command_failures.inc(subcommand, 'api')
+        except LXDError as e:
+            logger.error(f"LXD Error: {cli_command} - {e}")
+            lxc_command_failures.inc(subcommand, 'api')
+            if e.status_code == 408:
+                lxc_command_timeouts.inc(subcommand, 'api')
+            return False, str(e)
+        except Exception as e:
+            logger.error(f"LXD Error: {cli_command} - {str(e)}")
+            lxc_command_failures.inc(subcommand, 'api')
+            return False, str(e)
+        finally:
+            lxc_command_duration.observe(time.perf_counter() - started, subcommand, 'api')
+    return execute_lxc_sync(cli_command)
+
+class ContainerBusy(Exception):
+    """A conflicting operation is already running on the container"""
+
+    def __init__(self, container_name, action):
+        super().__init__(f"{container_name} is busy with a {action} operation, try again shortly")
+        self.action = action
+
+class ContainerOperations:
+    """Per-container coordinator for state-changing LXC operations.
+
+    An operation holds the container's OperationLease, so a conflicting one
+    (start during a delete) raises ContainerBusy right away instead of
+    queuing behind it, whichever worker process it arrives at. Identical
+    concurrent requests within a process (a double-clicked start button)
+    share one in-flight execution and its result; one arriving at another
+    process while the operation runs gets ContainerBusy too, as the result
+    can't be shared across processes.
+    """
+
+    def __init__(self, lease_ttl=300):
+        self.lease_ttl = lease_ttl
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def lease_key(container_name, host=None):
+        return f"container:{host or DEFAULT_NODE}/{container_name}"
+
+    def run(self, container_name, action, operation, host=None):
+        key = (host or DEFAULT_NODE, container_name)
+        with self._lock:
+            current = self._inflight.get(key)
+            if current is None:
+                current = SimpleNamespace(action=action, done=threading.Event(), result=None, error=None)
+                self._inflight[key] = current
+                leader = True
+            elif current.action == action:
+                leader = False
+            else:
+                raise ContainerBusy(container_name, current.action)
+        
+        if not leader:
+            current.done.wait()
+            if current.error:
+                raise current.error
+            return current.result
+        
+        lease = None
+        try:
+            # Bulk and background callers run outside a request
+            with app.app_context():
+                lease = rate_limiter.acquire(self.lease_key(container_name, host), 1, ttl=self.lease_ttl,
+                                             action=action)
+                if lease is None:
+                    holder = rate_limiter.holder(self.lease_key(container_name, host))
+                    current.error = ContainerBusy(container_name, holder or action)
+                    raise current.error
+            current.result = operation()
+        except ContainerBusy:
+            raise
+        except Exception as e:
+            current.result = (False, str(e))
+        finally:
+            if lease is not None:
+                with app.app_context():
+                    rate_limiter.release(lease)
+            with self._lock:
+                del self._inflight[key]
+            current.done.set()
+        return current.result
+
+    def busy(self, container_name, host=None):
+        """Action in flight on a container in any process, or None"""
+        current = self._inflight.get((host or DEFAULT_NODE, container_name))
+        if current:
+            return current.action
+        with app.app_context():
+            return rate_limiter.holder(self.lease_key(container_name, host))
+
+
+def lxc_launch(container_name, memory_limit, cpu_limit, start=True, host=None):
+    """Create a container with the given resource limits, starting it unless start=False"""
+    image = app.config['VPS_IMAGE']
+    storage_pool = node_option(host, 'storage_pool')
+    verb = 'launch' if start else 'init'
+    return lxc_call(
+        f"lxc {verb} {image} {cli_target(container_name, host)} --config limits.memory={memory_limit} --config limits.cpu={cpu_limit} -s {storage_pool}",
+        lambda client: client.create_instance(container_name, image,
+                                              config={'limits.memory': memory_limit, 'limits.cpu': cpu_limit},
+                                              storage_pool=storage_pool, start=start),
+        host
+    )
+
+def lxc_rename(container_name, new_name, host=None):
+    """Rename a stopped container"""
+    return lxc_call(f"lxc move {cli_target(container_name, host)} {cli_target(new_name, host)}",
+                    lambda client: client.rename_instance(container_name, new_name), host)
+
+def lxc_set_limits(container_name, memory_limit, cpu_limit, host=None):
+    """Set a container's memory and CPU limits"""
+    return lxc_call(f"lxc config set {cli_target(container_name, host)} limits.memory={memory_limit} limits.cpu={cpu_limit}",
+                    lambda client: client.update_config(container_name, {'limits.memory': memory_limit,
+                                                                         'limits.cpu': cpu_limit}), host)
+
+def lxc_power(container_name, action, host=None):
+    """Start, stop or restart a container; raises ContainerBusy on a conflicting operation"""
+    return container_ops.run(container_name, action, lambda: lxc_call(
+        f"lxc {action} {cli_target(container_name, host)}",
+        lambda client: client.change_state(container_name, action), host), host)
+
+def lxc_delete(container_name, host=None):
+    """Force-delete a container; raises ContainerBusy on a conflicting operation"""
+    return container_ops.run(container_name, 'delete', lambda: lxc_call(
+        f"lxc delete {cli_target(container_name, host)} --force",
+        lambda client: client.delete_instance(container_name, force=True), host), host)
+
+def lxc_snapshot(container_name, snapshot, host=None):
+    """Take a stateless snapshot of a container"""
+    return lxc_call(f"lxc snapshot {cli_target(container_name, host)} {snapshot}",
+                    lambda client: client.create_snapshot(container_name, snapshot), host)
+
+def lxc_restore(container_name, snapshot, host=None):
+    """Roll a container back to a snapshot; raises ContainerBusy on a conflicting operation"""
+    return container_ops.run(container_name, 'restore', lambda: lxc_call(
+        f"lxc restore {cli_target(container_name, host)} {snapshot}",
+        lambda client: client.restore_snapshot(container_name, snapshot), host), host)
+
+def lxc_delete_snapshot(container_name, snapshot, host=None):
+    return lxc_call(f"lxc delete {cli_target(container_name, host)}/{snapshot}",
+                    lambda client: client.delete_snapshot(container_name, snapshot), host)
+
+def lxc_snapshots(container_name, host=None):
+    """List a container's snapshots as [{'name', 'created_at'}], oldest first"""
+    remote = '' if host in (None, DEFAULT_NODE) else f"{host}:"
+    success, output = lxc_call(f"lxc query {remote}/1.0/instances/{container_name}/snapshots?recursion=1",
+                               lambda client: client.list_snapshots(container_name), host)
+    if not success:
+        return False, output
+    if isinstance(output, str):
+        try:
+            output = json.loads(output) if output else []
+        except ValueError as e:
+            logger.error(f"Error parsing snapshot list: {e}")
+            return False, str(e)
+    snapshots = [{'name': snapshot['name'].rpartition('/')[2], 'created_at': snapshot.get('created_at')}
+                 for snapshot in output]
+    return True, sorted(snapshots, key=lambda snapshot: snapshot['created_at'] or '')
+
+def lxc_list(host=None):
+    """List every container on a node in `lxc list --format json` shape"""
+    remote = '' if host in (None, DEFAULT_NODE) else f" {host}:"
+    success, output = lxc_call(f"lxc list{remote} --format json", lambda client: client.list_instances(), host)
+    if success and isinstance(output, str):
+        try:
+            output = json.loads(output) if output else []
+        except ValueError as e:
+            logger.error(f"Error parsing lxc list output: {e}")
+            return False, str(e)
+    return success, output
+
+class SettingsCache:
+    """Process-level cache of the panel Settings row.
+
+    The cached copy is re-validated against Settings.version at most every
+    `ttl` seconds, so a change saved by one worker reaches the others quickly
+    without a full row load on every request.
+    """
+
+    def __init__(self, ttl=5):
+        self.ttl = ttl
+        self._value = None
+        self._version = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+
+    def get(self):
+        now = time.monotonic()
+        value = self._value
+        if value is not None and now - self._checked_at < self.ttl:
+            return value
+        
+        version = db.session.query(Settings.version).order_by(Settings.id).limit(1).scalar()
+        with self._lock:
+            if self._value is None or version != self._version:
+                settings = Settings.query.order_by(Settings.id).first()
+                if not settings:
+                    settings = Settings()
+                    db.session.add(settings)
+                    db.session.commit()
+                self._value = SimpleNamespace(**{column.name: getattr(settings, column.name)
+                                                 for column in Settings.__table__.columns})
+                self._version = settings.version
+            self._checked_at = now
+            return self._value
+
+    def invalidate(self):
+        with self._lock:
+            self._value = None
+
+settings_cache = SettingsCache(ttl=app.config['SETTINGS_CACHE_TTL'])
+
+def get_settings():
+    """Return the cached panel settings (read-only)"""
+    return settings_cache.get()
+
+class RateLimiter:
+    """Token buckets and concurrent-operation quotas.
+
+    With backend='sqlite' buckets and operation leases live in the database,
+    so limits hold across worker processes: a bucket is drawn down with one
+    conditional UPDATE, and leases are counted inside the transaction that
+    inserts them. backend='memory' keeps both in this process only.
+    """
+
+    def __init__(self, backend='sqlite', lease_ttl=300):
+        self.backend = backend
+        self.lease_ttl = lease_ttl
+        self._buckets = {}
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, per, cost=1):
+        """Take `cost` tokens; returns 0 on success or the seconds until they are available"""
+        rate = capacity / per
+        now = time.time()
+        if self.backend == 'memory':
+            with self._lock:
+                tokens, updated_at = self._buckets.get(key, (capacity, now))
+                tokens = min(capacity, tokens + (now - updated_at) * rate)
+                if tokens >= cost:
+                    self._buckets[key] = (tokens - cost, now)
+                    return 0
+                self._buckets[key] = (tokens, now)
+            return (cost - tokens) / rate
+        
+        refilled = db.func.min(capacity, RateLimitBucket.tokens + (now - RateLimitBucket.updated_at) * rate)
+        with db.engine.begin() as conn:
+            conn.execute(sqlite_insert(RateLimitBucket)
+                         .values(key=key, tokens=capacity, updated_at=now)
+                         .on_conflict_do_nothing())
+            taken = conn.execute(
+                db.update(RateLimitBucket)
+                .where(RateLimitBucket.key == key, refilled >= cost)
+                .values(tokens=refilled - cost, updated_at=now)
+            ).rowcount == 1
+            if taken:
+                return 0
+            tokens = conn.execute(db.select(refilled).where(RateLimitBucket.key == key)).scalar()
+        return (cost - tokens) / rate
+
+    def acquire(self, key, limit, ttl=None, action=None):
+        """Reserve one of `limit` concurrent slots for `ttl` seconds; returns a lease to release, or None"""
+        if self.backend == 'memory':
+            with self._lock:
+                if self._leases.get(key, 0) >= limit:
+                    return None
+                self._leases[key] = self._leases.get(key, 0) + 1
+            return key
+        
+        now = time.time()
+        with db.engine.connect() as conn:
+            conn.execute(db.delete(OperationLease).where(OperationLease.expires_at < now))
+            lease_id = conn.execute(
+                db.insert(OperationLease).values(key=key, expires_at=now + (ttl or self.lease_ttl), action=action)
+            ).inserted_primary_key[0]
+            active = conn.execute(
+                db.select(db.func.count(OperationLease.id)).where(OperationLease.key == key)
+            ).scalar()
+            if active > limit:
+                conn.rollback()
+                return None
+            conn.commit()
+        return lease_id
+
+    def renew(self, lease, ttl, action=None):
+        """Push back the expiry of a lease held by a long-running operation; False if it was lost.
+
+        SQLite reuses the ids of deleted rows, so once a lease has expired its id
+        may belong to someone else's; pass the `action` it was acquired with to
+        make sure it is still this one.
+        """
+        if self.backend == 'memory':
+            return True
+        query = db.update(OperationLease).where(OperationLease.id == lease)
+        if action is not None:
+            query = query.where(OperationLease.action == action)
+        with db.engine.begin() as conn:
+            return conn.execute(query.values(expires_at=time.time() + ttl)).rowcount == 1
+
+    def held(self, key):
+        """Whether any unexpired lease exists for `key`"""
+        if self.backend == 'memory':
+            with self._lock:
+                return self._leases.get(key, 0) > 0
+        return db.session.execute(
+            db.select(OperationLease.id).where(OperationLease.key == key, OperationLease.expires_at >= time.time()).limit(1)
+        ).first() is not None
+
+    def holder(self, key):
+        """Action recorded by an unexpired lease for `key`, or None; the memory backend doesn't record one"""
+        if self.backend == 'memory':
+            return None
+        with db.engine.connect() as conn:
+            return conn.execute(
+                db.select(OperationLease.action)
+                .where(OperationLease.key == key, OperationLease.expires_at >= time.time()).limit(1)
+            ).scalar()
+
+    def release(self, lease):
+        if self.backend == 'memory':
+            with self._lock:
+                self._leases[lease] -= 1
+            return
+        with db.engine.begin() as conn:
+            conn.execute(db.delete(OperationLease).where(OperationLease.id == lease))
+
+rate_limiter = RateLimiter(backend=app.config['RATE_LIMIT_BACKEND'], lease_ttl=app.config['OPERATION_LEASE_TTL'])
+# An LXC operation takes at most the API wait plus the CLI fallback's timeout (about 250 s), under the TTL
+container_ops = ContainerOperations(lease_ttl=app.config['OPERATION_LEASE_TTL'])
+
+class Leadership:
+    """Elects the one worker process that runs the singleton background loops.
+
+    Polling LXD, reconciling VPS.status, suspending idle VPS, metering and
+    billing usage, probing node capacity and refilling warm pools only need
+    doing once. Every process starts those threads, but only the holder of the
+    'leader' lease does the work; it publishes what it saw in SharedState and
+    the other processes read that instead of asking LXD themselves. A thread
+    renews the lease every third of its TTL, so if the leader dies another
+    process takes over once the lease expires. With RATE_LIMIT_BACKEND='memory'
+    leases are per process, so every process leads.
+    """
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self._lease = None
+        self._token = None
+        self._pid = None
+        self._expires_at = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def is_leader(self):
+        # A lease inherited through fork() belongs to the parent
+        return self._lease is not None and self._pid == os.getpid() and time.time() < self._expires_at
+
+    def elect(self):
+        """Renew the lease if this process holds it, else try to take it; returns whether it leads"""
+        with self._lock:
+            now = time.time()
+            if self._lease is not None and self._pid == os.getpid():
+                if rate_limiter.renew(self._lease, self.ttl, action=self._token):
+                    self._expires_at = now + self.ttl
+                    return True
+                logger.warning(f"Process {os.getpid()} lost the leader lease")
+            self._token = uuid.uuid4().hex[:20]
+            self._lease = rate_limiter.acquire('leader', 1, ttl=self.ttl, action=self._token)
+            self._pid = os.getpid()
+            if self._lease is None:
+                return False
+            self._expires_at = now + self.ttl
+            logger.info(f"Process {os.getpid()} now runs the singleton background loops")
+            return True
+
+    def publish(self, states, updated_at):
+        """Store {key: JSON-serializable data} observed at `updated_at` for the other processes"""
+        statement = sqlite_insert(SharedState)
+        with db.engine.begin() as conn:
+            conn.execute(
+                statement.on_conflict_do_update(index_elements=['key'], set_={
+                    'data': statement.excluded.data, 'updated_at': statement.excluded.updated_at
+                }),
+                [{'key': key, 'data': json.dumps(data), 'updated_at': updated_at} for key, data in states.items()]
+            )
+
+    def read(self, keys, newer_than=None):
+        """Published {key: (data, updated_at)}, or {} unless one of them is newer than `newer_than`"""
+        with db.engine.connect() as conn:
+            latest = conn.execute(
+                db.select(db.func.max(SharedState.updated_at)).where(SharedState.key.in_(keys))
+            ).scalar()
+            if latest is None or (newer_than is not None and latest <= newer_than):
+                return {}
+            return {key: (json.loads(data), updated_at) for key, data, updated_at in conn.execute(
+                db.select(SharedState.key, SharedState.data, SharedState.updated_at).where(SharedState.key.in_(keys))
+            )}
+
+    def _run(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                with app.app_context():
+                    self.elect()
+            except Exception as e:
+                logger.error(f"Error renewing the leader lease: {e}")
+
+    def start(self):
+        """Hold the first election now, then keep renewing or contending in a thread"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='leader-election', daemon=True)
+            self._thread.start()
+        self.elect()
+
+    def stop(self):
+        """Give up the lease so another process takes over without waiting for it to expire"""
+        self._stop.set()
+        with self._lock:
+            # An expired lease's id may already have been given to another process
+            if self.is_leader():
+                with app.app_context():
+                    rate_limiter.release(self._lease)
+            self._lease = None
+
+leadership = Leadership(ttl=app.config['LEADER_LEASE_TTL'])
+atexit.register(leadership.stop)
+
+def rate_limit_overrides(user):
+    try:
+        return json.loads(user.rate_limit_overrides) if user.rate_limit_overrides else {}
+    except ValueError:
+        return {}
+
+def rate_limit_for(user, operation):
+    """(burst, seconds) bucket for a user and operation class, or None if unlimited"""
+    overrides = rate_limit_overrides(user)
+    if operation in overrides:
+        return tuple(overrides[operation]) if overrides[operation] else None
+    role_limits = app.config['RATE_LIMITS'].get(user.role)
+    if role_limits is None:
+        return None
+    return role_limits.get(operation)
+
+def operation_quota(user, plan):
+    """Concurrent operations a user may run on VPS of `plan`, or None if unlimited"""
+    overrides = rate_limit_overrides(user)
+    if 'concurrent' in overrides:
+        return overrides['concurrent']
+    if app.config['RATE_LIMITS'].get(user.role) is None:
+        return None
+    return app.config['OPERATION_QUOTAS'].get(plan)
+
+def too_many_requests(message, retry_after):
+    """429 response with Retry-After; browser form posts get it as a page showing the message"""
+    retry_after = max(1, math.ceil(retry_after))
+    headers = {'Retry-After': str(retry_after)}
+    if not request.path.startswith('/api/') and request.accept_mimetypes.best != 'application/json':
+        flash(f'{message}. Try again in {retry_after} seconds.', 'warning')
+        return render_template('too_many_requests.html', user=g.get('user'), settings=get_settings(),
+                               retry_after=retry_after,
+                               back_url=request.referrer or url_for('dashboard')), 429, headers
+    return jsonify({'success': False, 'message': message, 'retry_after': retry_after}), 429, headers
+
+def reserve_credits(user_id, amount, reference=None):
+    """Atomically take `amount` credits if the user has them.
+
+    Returns the pending 'reserve' ledger entry, or None if credits are
+    insufficient. The caller commits, then settles it with settle_reservation().
+    """
+    result = db.session.execute(
+        db.update(User)
+        .where(User.id == user_id, User.credits >= amount)
+        .values(credits=User.credits - amount, version=User.version + 1)
+    )
+    if result.rowcount != 1:
+        return None
+    reservation = CreditTransaction(user_id=user_id, amount=-amount, kind='reserve', reference=reference)
+    db.session.add(reservation)
+    db.session.flush()
+    return reservation
+
+def settle_reservation(reservation_id, capture):
+    """Capture a reservation, or refund it to the user; each reservation settles once.
+
+    Returns False if it was already settled. The caller commits.
+    """
+    reservation = db.session.get(CreditTransaction, reservation_id)
+    if reservation is None or reservation.kind != 'reserve':
+        return False
+    if CreditTransaction.query.filter_by(reservation_id=reservation_id).first():
+        return False
+    
+    amount = 0 if capture else -reservation.amount
+    db.session.add(CreditTransaction(user_id=reservation.user_id, amount=amount,
+                                     kind='capture' if capture else 'refund',
+                                     reservation_id=reservation_id, reference=reservation.reference))
+    db.session.flush()  # the unique reservation_id rejects a concurrent second settlement here
+    if amount:
+        db.session.execute(
+            db.update(User).where(User.id == reservation.user_id)
+            .values(credits=User.credits + amount, version=User.version + 1)
+        )
+    return True
+
+def adjust_credits(user_id, amount, kind, actor_id=None, reference=None):
+    """Apply a manual credit change, never taking the balance below zero.
+
+    Returns the change actually applied. The caller commits.
+    """
+    while True:
+        current = db.session.query(User.credits).filter_by(id=user_id).scalar()
+        if current is None:
+            return 0
+        new_balance = max(0, current + amount)
+        # Compare-and-set so a concurrent change forces a retry instead of being overwritten
+        result = db.session.execute(
+            db.update(User)
+            .where(User.id == user_id, User.credits == current)
+            .values(credits=new_balance, version=User.version + 1)
+        )
+        if result.rowcount == 1:
+            break
+    
+    applied = new_balance - current
+    if applied:
+        db.session.add(CreditTransaction(user_id=user_id, amount=applied, kind=kind,
+                                         actor_id=actor_id, reference=reference))
+    return applied
+
+def next_container_name(user_id):
+    """Allocate the next unused vps-<user>-<n> container name"""
+    key = f"vps-{user_id}"
+    if db.session.get(Counter, key) is None:
+        # Start after any names already in use, e.g. from before counters existed
+        names = db.session.query(VPS.container_name).filter_by(user_id=user_id).all()
+        suffixes = [int(name.rpartition('-')[2]) for (name,) in names if name.rpartition('-')[2].isdigit()]
+        db.session.execute(
+            sqlite_insert(Counter).values(name=key, value=max(suffixes, default=0)).on_conflict_do_nothing()
+        )
+    db.session.execute(db.update(Counter).where(Counter.name == key).values(value=Counter.value + 1))
+    value = db.session.query(Counter.value).filter_by(name=key).scalar()
+    return f"{key}-{value}"
+
+def check_vps_access(vps, user):
+    """Return (message, status_code) if `user` may not act on `vps`, else None"""
+    if vps.user_id != user.id and user.role != 'admin':
+        return 'Access denied', 403
+    if vps.status == 'provisioning':
+        return 'VPS is still being provisioned', 409
+    if vps.status == 'deleting':
+        return 'VPS is being deleted', 409
+    return None
+
+def keyset_paginate(query, column, page_size):
+    """Paginate a query by a unique, ascending column using ?after= / ?before= cursors.
+
+    Returns (items, prev_cursor, next_cursor); cursors are None at either end.
+    """
+    after = request.args.get('after', type=int)
+    before = request.args.get('before', type=int)
+    
+    if before is not None:
+        rows = query.filter(column < before).order_by(column.desc()).limit(page_size + 1).all()
+        has_more = len(rows) > page_size
+        rows = list(reversed(rows[:page_size]))
+        has_prev, has_next = has_more, True
+    else:
+        if after is not None:
+            query = query.filter(column > after)
+        rows = query.order_by(column.asc()).limit(page_size + 1).all()
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_prev = after is not None
+    
+    if not rows:
+        return rows, None, None
+    
+    def cursor(row):
+        item = row[0] if hasattr(row, '_fields') else row
+        return getattr(item, column.key)
+    
+    prev_cursor = cursor(rows[0]) if has_prev else None
+    next_cursor = cursor(rows[-1]) if has_next else None
+    return rows, prev_cursor, next_cursor
+
+# LXC state -> VPS.status; other states (Frozen, Error, ...) are left alone
+LXC_STATUS_MAP = {'Running': 'running', 'Stopped': 'stopped'}
+
+def parse_container_state(container):
+    """Extract the stats we display from one `lxc list --format json` entry"""
+    state = container.get('state') or {}
+    
+    # Get memory usage
+    memory = state.get('memory', {})
+    memory_usage = memory.get('usage', 0) / (1024 * 1024)  # Convert to MB
+    
+    # Get CPU usage
+    cpu = state.get('cpu', {})
+    cpu_usage = cpu.get('usage', 0)
+    
+    # Total traffic on every interface but loopback
+    network_bytes = 0
+    for interface in (state.get('network') or {}).values():
+        if interface.get('type') != 'loopback':
+            counters = interface.get('counters', {})
+            network_bytes += counters.get('bytes_received', 0) + counters.get('bytes_sent', 0)
+    
+    return {
+        'memory_mb': round(memory_usage, 2),
+        'cpu_seconds': cpu_usage,
+        'network_bytes': network_bytes,
+        'status': state.get('status', container.get('status', 'Unknown'))
+    }
+
+class MetricSeries:
+    """Fixed-size ring buffer of (timestamp, cpu %, memory MB) samples for one container"""
+
+    def __init__(self, size):
+        self.size = size
+        self.timestamps = array('d', [0.0] * size)
+        self.cpu = array('d', [0.0] * size)
+        self.memory = array('d', [0.0] * size)
+        self.count = 0
+        self.last_usage = None
+        self.last_timestamp = None
+
+    def append(self, timestamp, cpu_usage, memory_mb):
+        """Add a sample and return the CPU percentage derived from the usage delta"""
+        cpu_percent = 0.0
+        if self.last_usage is not None and timestamp > self.last_timestamp and cpu_usage >= self.last_usage:
+            # LXD reports cumulative CPU time in nanoseconds
+            cpu_percent = (cpu_usage - self.last_usage) / ((timestamp - self.last_timestamp) * 1e9) * 100
+        self.last_usage = cpu_usage
+        self.last_timestamp = timestamp
+        
+        i = self.count % self.size
+        self.timestamps[i] = timestamp
+        self.cpu[i] = cpu_percent
+        self.memory[i] = memory_mb
+        self.count += 1
+        return round(cpu_percent, 2)
+
+    def points(self, since=0):
+        """Return buffered samples newer than `since`, oldest first"""
+        n = min(self.count, self.size)
+        start = self.count - n
+        result = []
+        for j in range(start, self.count):
+            i = j % self.size
+            if self.timestamps[i] > since:
+                result.append((self.timestamps[i], self.cpu[i], self.memory[i]))
+        return result
+
+class MetricsStore:
+    """Per-VPS time series: raw samples in memory, 1m/1h rollups in SQLite.
+
+    Raw samples come from the container inventory, so collecting them costs no
+    extra lxc calls. Rollup rows are written with INSERT OR IGNORE, so several
+    worker processes flushing the same bucket don't duplicate rows.
+    """
+
+    def __init__(self, raw_points=360, retention=None):
+        self.raw_points = raw_points
+        self.retention = retention or {}
+        self.series = {}
+        self._lock = threading.Lock()
+        now = time.time()
+        self.minute_flushed = int(now // 60) * 60
+        self.hour_flushed = int(now // 3600) * 3600
+
+    def record(self, containers, timestamp):
+        """Append one sample per running container; sets 'cpu_percent' on each stats dict"""
+        with self._lock:
+            for name, stats in containers.items():
+                if stats.get('status') != 'Running':
+                    self.series.pop(name, None)
+                    continue
+                series = self.series.get(name)
+                if series is None:
+                    series = self.series[name] = MetricSeries(self.raw_points)
+                stats['cpu_percent'] = series.append(timestamp, stats.get('cpu_seconds') or 0,
+                                                     stats.get('memory_mb') or 0)
+            for name in set(self.series) - set(containers):
+                del self.series[name]
+
+    def raw_points_for(self, container_name, since=0):
+        with self._lock:
+            series = self.series.get(container_name)
+            return series.points(since) if series else []
+
+    def _upsert(self, rows):
+        if rows:
+            db.session.execute(sqlite_insert(VPSMetric).on_conflict_do_nothing(), rows)
+
+    def flush(self, now=None):
+        """Write completed minute and hour buckets and prune expired rollups"""
+        now = now or time.time()
+        minute_end = int(now // 60) * 60
+        hour_end = int(now // 3600) * 3600
+        if minute_end <= self.minute_flushed:
+            return
+        
+        vps_ids = dict(db.session.execute(db.select(VPS.container_name, VPS.id)).all())
+        rows = []
+        with self._lock:
+            for name, series in self.series.items():
+                if name not in vps_ids:
+                    continue
+                buckets = {}
+                for timestamp, cpu, memory in series.points():
+                    # A sample taken exactly on a minute boundary belongs to the minute it starts
+                    if not self.minute_flushed <= timestamp < minute_end:
+                        continue
+                    buckets.setdefault(int(timestamp // 60) * 60, []).append((cpu, memory))
+                for bucket_start, values in buckets.items():
+                    cpus = [v[0] for v in values]
+                    memories = [v[1] for v in values]
+                    rows.append({
+                        'vps_id': vps_ids[name], 'resolution': 60, 'bucket_start': bucket_start,
+                        'cpu_avg': round(sum(cpus) / len(cpus), 2), 'cpu_max': round(max(cpus), 2),
+                        'memory_avg': round(sum(memories) / len(memories), 2),
+                        'memory_max': round(max(memories), 2), 'samples': len(values)
+                    })
+        self._upsert(rows)
+        self.minute_flushed = minute_end
+        
+        if hour_end > self.hour_flushed:
+            weight = db.func.sum(VPSMetric.samples)
+            hourly = db.session.execute(
+                db.select(
+                    VPSMetric.vps_id,
+                    (VPSMetric.bucket_start - VPSMetric.bucket_start % 3600).label('hour'),
+                    db.func.sum(VPSMetric.cpu_avg * VPSMetric.samples) / weight,
+                    db.func.max(VPSMetric.cpu_max),
+                    db.func.sum(VPSMetric.memory_avg * VPSMetric.samples) / weight,
+                    db.func.max(VPSMetric.memory_max),
+                    weight
+                )
+                .where(VPSMetric.resolution == 60,
+                       VPSMetric.bucket_start >= self.hour_flushed,
+                       VPSMetric.bucket_start < hour_end)
+                .group_by(VPSMetric.vps_id, 'hour')
+            ).all()
+            self._upsert([{
+                'vps_id': vps_id, 'resolution': 3600, 'bucket_start': hour,
+                'cpu_avg': round(cpu_avg or 0, 2), 'cpu_max': cpu_max,
+                'memory_avg': round(memory_avg or 0, 2), 'memory_max': memory_max, 'samples': samples
+            } for vps_id, hour, cpu_avg, cpu_max, memory_avg, memory_max, samples in hourly])
+            self.hour_flushed = hour_end
+        
+        for resolution, keep in self.retention.items():
+            VPSMetric.query.filter(VPSMetric.resolution == resolution,
+                                   VPSMetric.bucket_start < now - keep).delete(synchronize_session=False)
+        db.session.commit()
+
+    def history(self, vps, seconds):
+        """Return (resolution, points) covering the last `seconds` for a VPS"""
+        now = time.time()
+        since = now - seconds
+        if seconds <= 3600:
+            points = self.raw_points_for(vps.container_name, since)
+            return 0, [{'t': int(t), 'cpu': round(c, 2), 'memory_mb': round(m, 2)} for t, c, m in points]
+        
+        resolution = 60 if seconds <= self.retention.get(60, 0) else 3600
+        rows = (vps.metrics
+                .filter(VPSMetric.resolution == resolution, VPSMetric.bucket_start >= since)
+                .order_by(VPSMetric.bucket_start)
+                .all())
+        return resolution, [{'t': row.bucket_start, 'cpu': row.cpu_avg, 'cpu_max': row.cpu_max,
+                             'memory_mb': row.memory_avg, 'memory_max': row.memory_max} for row in rows]
+
+metrics_store = MetricsStore(raw_points=app.config['METRICS_RAW_POINTS'],
+                             retention=app.config['METRICS_RETENTION'])
+
+class ContainerInventory:
+    """Cached snapshot of every container on the host.
+
+    In the leader process a background thread runs a single `lxc list --format
+    json` per node on an interval, keeps a map of container name -> stats,
+    publishes it in SharedState and bulk updates drifted VPS.status rows in one
+    transaction. The other processes' threads load the published snapshot.
+    """
+
+    def __init__(self, interval=10):
+        self.interval = interval
+        self.containers = {}
+        self.updated_at = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """Reload the snapshot from every node; returns False if all listings failed"""
+        with self._refresh_lock:
+            containers = {}
+            refreshed = []
+            for host in lxd_nodes:
+                success, listing = lxc_list(host)
+                if not success:
+                    # Keep the last known state of an unreachable node
+                    containers.update({name: dict(stats, stale=True) for name, stats in self.containers.items()
+                                       if stats.get('host') == host})
+                    continue
+                refreshed.append(host)
+                for container in listing:
+                    if container.get('name'):
+                        stats = parse_container_state(container)
+                        stats['host'] = host
+                        containers[container['name']] = stats
+            if not refreshed:
+                return False
+            updated_at = time.time()
+            self._apply(containers, updated_at)
+            if leadership.is_leader():
+                leadership.publish({f"inventory:{host}": {name: stats for name, stats in containers.items()
+                                                         if stats['host'] == host}
+                                    for host in refreshed}, updated_at)
+            return True
+
+    def load(self):
+        """Take the snapshot the leader published; returns False if it has nothing newer"""
+        with self._refresh_lock:
+            published = leadership.read([f"inventory:{host}" for host in lxd_nodes], newer_than=self.updated_at)
+            if not published:
+                return False
+            updated_at = max(published_at for _, published_at in published.values())
+            containers = {}
+            for listing, published_at in published.values():
+                # A node left out of the leader's last pass was unreachable, as in refresh()
+                stale = published_at < updated_at
+                containers.update({name: dict(stats, stale=True) if stale else stats
+                                   for name, stats in listing.items()})
+            self._apply(containers, updated_at)
+            return True
+
+    def _apply(self, containers, updated_at):
+        self.updated_at = updated_at
+        metrics_store.record(containers, updated_at)
+        # Followers keep idle clocks too, so a process taking over leadership can suspend at once
+        idle_suspender.observe(containers, updated_at)
+        # Swap in a new dict so readers never see a partial snapshot
+        self.containers = containers
+        stats_broadcaster.publish('containers', containers)
+
+    def get(self, container_name):
+        if self.updated_at is None and not self.load():
+            self.refresh()
+        return self.containers.get(container_name)
+
+    def set_status(self, container_name, lxc_status):
+        """Record a state change we caused so views don't wait for the next refresh"""
+        containers = dict(self.containers)
+        stats = dict(containers.get(container_name) or {'memory_mb': 0, 'cpu_seconds': 0})
+        stats['status'] = lxc_status
+        containers[container_name] = stats
+        self.containers = containers
+
+    def discard(self, container_name):
+        containers = dict(self.containers)
+        containers.pop(container_name, None)
+        self.containers = containers
+
+    def reconcile(self):
+        """Bulk update VPS.status rows that drifted from the container state"""
+        containers = self.containers
+        updates = []
+        rows = db.session.execute(
+            db.select(VPS.id, VPS.container_name, VPS.status)
+            .where(VPS.status.in_(list(LXC_STATUS_MAP.values()) + ['suspended']))
+        ).all()
+        for vps_id, container_name, status in rows:
+            stats = containers.get(container_name)
+            if not stats:
+                continue
+            actual = LXC_STATUS_MAP.get(stats['status'])
+            if status == 'suspended' and actual != 'running':
+                # Suspended containers are expected to be stopped or frozen
+                continue
+            if actual and actual != status:
+                updates.append({'vps_id': vps_id, 'new_status': actual})
+        if updates:
+            vps_table = VPS.__table__  # Core executemany; ORM bulk updates can't take expressions
+            db.session.execute(
+                db.update(vps_table).where(vps_table.c.id == bindparam('vps_id'))
+                .values(status=bindparam('new_status'), version=vps_table.c.version + 1),
+                updates
+            )
+            db.session.commit()
+            logger.info(f"Reconciled status of {len(updates)} VPS")
+        return len(updates)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with app.app_context():
+                    if not leadership.is_leader():
+                        self.load()
+                    elif self.refresh():
+                        self.reconcile()
+                        metrics_store.flush()
+                        idle_suspender.suspend_idle()
+                        usage_meter.sample(self.containers, self.updated_at)
+            except Exception as e:
+                logger.error(f"Error reconciling container inventory: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Start the reconciler thread if it is not already running in this process"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='container-inventory', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+container_inventory = ContainerInventory(interval=app.config['INVENTORY_INTERVAL'])
+
+class IdleSuspender:
+    """Suspends VPS whose containers stay idle past their plan's threshold.
+
+    Fed by every inventory refresh: a running container is idle while both its
+    CPU use and network traffic stay under the configured rates, and any
+    activity resets its idle clock. Only the leader process suspends, and it
+    still claims each VPS with a conditional UPDATE so a request stopping or
+    starting it at the same time wins cleanly; starting it through the normal
+    start API resumes it.
+    """
+
+    def __init__(self, thresholds, cpu_percent=2.0, network_bytes=2048, mode='stop'):
+        self.thresholds = thresholds
+        self.cpu_percent = cpu_percent
+        self.network_bytes = network_bytes
+        self.mode = mode
+        self.idle_since = {}
+        self._last = {}
+
+    def observe(self, containers, timestamp):
+        """Update idle clocks from a fresh inventory snapshot"""
+        idle_since = {}
+        last = {}
+        for name, stats in containers.items():
+            if stats['status'] != 'Running' or stats.get('stale'):
+                continue
+            sample = (timestamp, stats['cpu_seconds'], stats.get('network_bytes', 0))
+            last[name] = sample
+            previous = self._last.get(name)
+            if previous is None or timestamp <= previous[0]:
+                continue
+            elapsed = timestamp - previous[0]
+            # LXD reports cumulative CPU time in nanoseconds
+            cpu_percent = max(0, sample[1] - previous[1]) / (elapsed * 1e9) * 100
+            network_rate = max(0, sample[2] - previous[2]) / elapsed
+            if cpu_percent < self.cpu_percent and network_rate < self.network_bytes:
+                idle_since[name] = self.idle_since.get(name, previous[0])
+        self._last = last
+        self.idle_since = idle_since
+
+    def suspend_idle(self):
+        """Suspend every running VPS that has been idle longer than its plan allows"""
+        now = time.time()
+        idle_since = self.idle_since
+        if not idle_since:
+            return 0
+        rows = db.session.execute(
+            db.select(VPS.id, VPS.container_name, VPS.plan, VPS.host)
+            .where(VPS.status == 'running', VPS.container_name.in_(list(idle_since)))
+        ).all()
+        
+        action, lxc_status = ('freeze', 'Frozen') if self.mode == 'freeze' else ('stop', 'Stopped')
+        suspended = 0
+        for vps_id, container_name, plan, host in rows:
+            threshold = self.thresholds.get(plan)
+            if not threshold or now - idle_since[container_name] < threshold:
+                continue
+            if container_ops.busy(container_name, host):
+                continue
+            # Typing in a web console barely registers as CPU use, so a VPS with one open is never idle
+            if rate_limiter.held(f"console:{container_name}"):
+                continue
+            claimed = db.session.execute(
+                db.update(VPS)
+                .where(VPS.id == vps_id, VPS.status == 'running')
+                .values(status='suspended', suspended_at=datetime.utcnow(), version=VPS.version + 1)
+            ).rowcount == 1
+            db.session.commit()
+            if not claimed:
+                continue
+            
+            try:
+                success, output = lxc_power(container_name, action, host)
+            except ContainerBusy as e:
+                success, output = False, str(e)
+            if success:
+                container_inventory.set_status(container_name, lxc_status)
+                self.idle_since.pop(container_name, None)
+                suspended += 1
+                logger.info(f"Suspended idle VPS {container_name} ({action})")
+                audit_log.record('vps.suspend', vps_id=vps_id, target=container_name, mode=action)
+            else:
+                db.session.execute(
+                    db.update(VPS)
+                    .where(VPS.id == vps_id, VPS.status == 'suspended')
+                    .values(status='running', suspended_at=None, version=VPS.version + 1)
+                )
+                db.session.commit()
+                logger.error(f"Error suspending idle VPS {container_name}: {output}")
+        return suspended
+
+    def status(self):
+        """Suspended VPS count and the plan RAM their stopped containers released"""
+        containers = container_inventory.containers
+        suspended = db.session.execute(
+            db.select(VPS.container_name, VPS.ram).where(VPS.status == 'suspended')
+        ).all()
+        reclaimed_mb = sum(int(ram.replace('GB', '')) * 1024 for name, ram in suspended
+                           if ram and (containers.get(name) or {}).get('status') == 'Stopped')
+        return {
+            'mode': self.mode,
+            'suspended': len(suspended),
+            'reclaimed_ram_mb': reclaimed_mb,
+            'idle': len(self.idle_since),
+            'thresholds': self.thresholds
+        }
+
+def start_action(container_name):
+    """LXC action that brings a container up: frozen (suspended) ones are unfrozen"""
+    stats = container_inventory.containers.get(container_name) or {}
+    return 'unfreeze' if stats.get('status') == 'Frozen' else 'start'
+
+idle_suspender = IdleSuspender(app.config['IDLE_SUSPEND_AFTER'],
+                               cpu_percent=app.config['IDLE_CPU_PERCENT'],
+                               network_bytes=app.config['IDLE_NETWORK_BYTES'],
+                               mode=app.config['IDLE_SUSPEND_MODE'])
+
+class UsageMeter:
+    """Meters VPS running time and CPU use and bills it in periodic cycles.
+
+    Fed by the leader process's inventory refreshes: each running container
+    gets one UsageSample per `interval`, inserted with INSERT OR IGNORE so a
+    new leader resampling a slot doesn't count it twice. Once a cycle has
+    ended, the leader claims it by inserting its BillingCycle row and,
+    in that same transaction, turns the cycle's samples into UsageRecords
+    and debits every user. Fractions of a credit, and usage a user couldn't
+    pay for, are carried in User.unbilled_usage. Users left without credits
+    have their running VPS stopped.
+    """
+
+    def __init__(self, plans, interval=60, cycle=3600, cpu_rate=0, poll_interval=60):
+        self.plans = plans
+        self.interval = interval
+        self.cycle = cycle
+        self.cpu_rate = cpu_rate
+        self.poll_interval = poll_interval
+        self._sampled = {}  # container name -> last slot this process sampled it in
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return bool(self.cycle)
+
+    def rate(self, plan, processor):
+        """Credits per running hour for a plan and processor"""
+        return ((self.plans.get(plan) or {}).get('hourly') or {}).get(processor, 0)
+
+    def sample(self, containers, timestamp):
+        """Record the running containers not yet sampled in the current interval"""
+        if not self.enabled:
+            return 0
+        slot = int(timestamp // self.interval) * self.interval
+        running = {name: stats.get('cpu_seconds') or 0 for name, stats in containers.items()
+                   if stats.get('status') == 'Running' and not stats.get('stale')}
+        names = [name for name in running if self._sampled.get(name) != slot]
+        if not names:
+            return 0
+        rows = db.session.execute(
+            db.select(VPS.id, VPS.user_id, VPS.container_name, VPS.plan, VPS.processor)
+            .where(VPS.container_name.in_(names))
+        ).all()
+        samples = [{'vps_id': vps_id, 'user_id': user_id, 'container_name': name, 'slot': slot,
+                    'cpu_usage': int(running[name]), 'rate': self.rate(plan, processor)}
+                   for vps_id, user_id, name, plan, processor in rows]
+        if samples:
+            db.session.execute(sqlite_insert(UsageSample).on_conflict_do_nothing(), samples)
+            db.session.commit()
+        # Containers without a VPS row (the warm pool) are skipped until the next interval too
+        self._sampled = {name: slot for name in running}
+        return len(samples)
+
+    def due_cycles(self, now=None):
+        """Start times of the ended cycles that haven't been billed, oldest first"""
+        now = now or time.time()
+        last = db.session.query(db.func.max(BillingCycle.start)).scalar()
+        if last is None:
+            oldest = db.session.query(db.func.min(UsageSample.slot)).scalar()
+            if oldest is None:
+                return []
+            first = oldest // self.cycle * self.cycle
+        else:
+            first = last + self.cycle
+        # Wait one interval past the end for samples from every process to land
+        return list(range(first, int(now - self.interval - self.cycle) + 1, self.cycle))
+
+    def _usage(self, conn, start, end):
+        """UsageRecord rows for every VPS sampled in [start, end)"""
+        samples = conn.execute(
+            db.select(UsageSample.vps_id, UsageSample.user_id, UsageSample.container_name,
+                      UsageSample.slot, UsageSample.cpu_usage, UsageSample.rate)
+            # The sample just before the cycle gives the CPU counter its first interval starts from
+            .where(UsageSample.slot >= start - self.interval, UsageSample.slot < end)
+            .order_by(UsageSample.vps_id, UsageSample.slot)
+        ).all()
+        usage = {}
+        last_cpu = {}
+        for vps_id, user_id, container_name, slot, cpu_usage, rate in samples:
+            previous = last_cpu.get(vps_id)
+            last_cpu[vps_id] = cpu_usage
+            if slot < start:
+                continue
+            record = usage.setdefault(vps_id, {
+                'cycle_start': start, 'vps_id': vps_id, 'user_id': user_id, 'container_name': container_name,
+                'running_seconds': 0, 'cpu_seconds': 0.0, 'cost': 0.0
+            })
+            record['running_seconds'] += self.interval
+            record['cost'] += rate * self.interval / 3600
+            if previous is not None:
+                # The counter restarts from zero when the container does
+                record['cpu_seconds'] += (cpu_usage - previous if cpu_usage >= previous else cpu_usage) / 1e9
+        for record in usage.values():
+            record['cost'] = round(record['cost'] + record['cpu_seconds'] / 3600 * self.cpu_rate, 6)
+            record['cpu_seconds'] = round(record['cpu_seconds'], 3)
+        return list(usage.values())
+
+    def bill_cycle(self, start):
+        """Bill one cycle for every user in a single transaction.
+
+        Returns the ids of users it left without credits, or None if another
+        process had already billed the cycle.
+        """
+        end = start + self.cycle
+        with db.engine.begin() as conn:
+            # Claiming the cycle is the first write, so SQLite's write lock keeps balances still until commit
+            claimed = conn.execute(
+                sqlite_insert(BillingCycle).values(start=start, end=end, created_at=datetime.utcnow())
+                .on_conflict_do_nothing()
+            ).rowcount == 1
+            if not claimed:
+                return None
+
+            usage = self._usage(conn, start, end)
+            owed = {}
+            for record in usage:
+                owed[record['user_id']] = owed.get(record['user_id'], 0) + record['cost']
+
+            balances, ledger, unfunded = [], [], []
+            # Users still owing whole credits from earlier cycles are collected from too
+            users = conn.execute(
+                db.select(User.id, User.credits, User.unbilled_usage)
+                .where(db.or_(User.id.in_(list(owed)), User.unbilled_usage >= 1))
+            ).all()
+            for user_id, credits, carried in users:
+                credits = credits or 0
+                total = (carried or 0) + owed.get(user_id, 0)
+                debit = min(int(total), credits)
+                if not debit and user_id not in owed:
+                    continue
+                balances.append({'user_id': user_id, 'debit': debit, 'carry': round(total - debit, 6)})
+                if debit:
+                    ledger.append({'user_id': user_id, 'amount': -debit, 'kind': 'usage',
+                                   'reference': f"cycle:{start}", 'created_at': datetime.utcnow()})
+                if credits - debit <= 0 and owed.get(user_id, 0) > 0:
+                    unfunded.append(user_id)
+
+            if usage:
+                conn.execute(db.insert(UsageRecord), usage)
+            if balances:
+                user_table = User.__table__
+                conn.execute(
+                    db.update(user_table).where(user_table.c.id == bindparam('user_id'))
+                    .values(credits=user_table.c.credits - bindparam('debit'), unbilled_usage=bindparam('carry'),
+                            version=user_table.c.version + 1),
+                    balances
+                )
+            if ledger:
+                conn.execute(db.insert(CreditTransaction), ledger)
+            debited = sum(balance['debit'] for balance in balances)
+            conn.execute(db.update(BillingCycle).where(BillingCycle.start == start)
+                         .values(users=len(balances), vps=len(usage), debited=debited))
+            # Keep the last sample of the cycle; the next cycle's CPU delta starts from it
+            conn.execute(db.delete(UsageSample).where(UsageSample.slot < end - self.interval))
+
+        billing_credits_debited.inc(amount=debited)
+        logger.info(f"Billed usage of {len(usage)} VPS for cycle {start}: {debited} credits from {len(balances)} users")
+        return unfunded
+
+    def stop_unfunded(self, user_ids):
+        """Stop the running VPS of users without credits; admins are exempt"""
+        rows = db.session.execute(
+            db.select(VPS.id, VPS.user_id, VPS.container_name, VPS.host)
+            .join(User, VPS.user_id == User.id)
+            .where(VPS.user_id.in_(user_ids), VPS.status == 'running', User.role != 'admin', User.credits <= 0)
+        ).all()
+        stopped = 0
+        for vps_id, user_id, container_name, host in rows:
+            claimed = db.session.execute(
+                db.update(VPS).where(VPS.id == vps_id, VPS.status == 'running')
+                .values(status='stopped', version=VPS.version + 1)
+            ).rowcount == 1
+            db.session.commit()
+            if not claimed:
+                continue
+            
+            try:
+                success, output = lxc_power(container_name, 'stop', host)
+            except ContainerBusy as e:
+                success, output = False, str(e)
+            if success:
+                container_inventory.set_status(container_name, 'Stopped')
+                stopped += 1
+                billing_vps_stopped.inc()
+                logger.info(f"Stopped {container_name}: user {user_id} is out of credits")
+                audit_log.record('vps.stop', user_id=user_id, vps_id=vps_id, target=container_name, reason='credits')
+            else:
+                db.session.execute(
+                    db.update(VPS).where(VPS.id == vps_id, VPS.status == 'stopped')
+                    .values(status='running', version=VPS.version + 1)
+                )
+                db.session.commit()
+                logger.error(f"Error stopping {container_name} of user {user_id} out of credits: {output}")
+        return stopped
+
+    def bill(self, now=None):
+        """Bill every due cycle; returns the number billed by this process"""
+        billed = 0
+        for start in self.due_cycles(now):
+            unfunded = self.bill_cycle(start)
+            if unfunded is None:
+                continue
+            billed += 1
+            if unfunded:
+                self.stop_unfunded(unfunded)
+        return billed
+
+    def report(self, user_id, since, until=None):
+        """Billed usage per VPS since a unix time, plus the current cycle's usage so far"""
+        query = (db.select(UsageRecord.vps_id, UsageRecord.container_name,
+                           db.func.sum(UsageRecord.running_seconds), db.func.sum(UsageRecord.cpu_seconds),
+                           db.func.sum(UsageRecord.cost))
+                 .where(UsageRecord.user_id == user_id, UsageRecord.cycle_start >= since)
+                 .group_by(UsageRecord.vps_id, UsageRecord.container_name)
+                 .order_by(UsageRecord.vps_id))
+        if until:
+            query = query.where(UsageRecord.cycle_start < until)
+        vps = [{'vps_id': vps_id, 'container_name': container_name,
+                'running_hours': round((seconds or 0) / 3600, 2), 'cpu_hours': round((cpu or 0) / 3600, 3),
+                'cost': round(cost or 0, 2)}
+               for vps_id, container_name, seconds, cpu, cost in db.session.execute(query)]
+        
+        billed_until = db.session.query(db.func.max(BillingCycle.end)).scalar() or 0
+        pending = db.session.execute(
+            db.select(db.func.count(UsageSample.id), db.func.sum(UsageSample.rate))
+            .where(UsageSample.user_id == user_id, UsageSample.slot >= billed_until)
+        ).one()
+        return {
+            'since': since,
+            'until': until,
+            'vps': vps,
+            'total_cost': round(sum(item['cost'] for item in vps), 2),
+            'current_cycle': {
+                'running_hours': round(pending[0] * self.interval / 3600, 2),
+                'estimated_cost': round((pending[1] or 0) * self.interval / 3600, 2)
+            }
+        }
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with app.app_context():
+                    if leadership.is_leader():
+                        self.bill()
+            except Exception as e:
+                logger.error(f"Error billing usage: {e}")
+            self._stop.wait(self.poll_interval)
+
+    def start(self):
+        """Start the billing thread if it is not already running in this process"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='usage-billing', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+usage_meter = UsageMeter(VPS_PLANS, interval=app.config['METER_INTERVAL'], cycle=app.config['BILLING_CYCLE'],
+                         cpu_rate=app.config['BILLING_CPU_RATE'])
+
+billing_credits_debited = metrics_registry.counter('gvm_billing_credits_debited_total',
+                                                   'Credits debited for metered VPS usage')
+billing_vps_stopped = metrics_registry.counter('gvm_billing_vps_stopped_total',
+                                               'VPS stopped because their owner ran out of credits')
+
+def out_of_credits(user):
+    """Whether usage billing keeps `user` from starting VPS"""
+    return usage_meter.enabled and user.role != 'admin' and (user.credits or 0) <= 0
+
+def get_vps_stats(container_name):
+    """Get individual VPS statistics from the cached container inventory"""
+    container_inventory.start()
+    return container_inventory.get(container_name)
+
+def plan_limits(plan):
+    """Return the (limits.memory, limits.cpu) LXD values for a plan"""
+    specs = VPS_PLANS[plan]
+    ram_mb = int(specs['ram'].replace('GB', '')) * 1024
+    return f"{ram_mb}MB", specs['cpu']
+
+class NodeScheduler:
+    """Chooses the LXD node a new VPS is placed on.
+
+    A background thread in the leader process caches each node's memory, CPU
+    threads and storage pool usage and publishes it in SharedState, where the
+    other processes load it; what is already sold on a node comes from the VPS table.
+    Nodes whose API cannot be reached are skipped. Nodes without a REST
+    socket (CLI only) have unknown capacity and are always eligible.
+    """
+
+    def __init__(self, policy='spread', interval=30):
+        self.policy = policy
+        self.interval = interval
+        self.nodes = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _probe(self, host, client):
+        if not client.available():
+            return {'online': True, 'capacity_known': False}
+        try:
+            resources = client.resources() or {}
+            pool = client.storage_pool_resources(node_option(host, 'storage_pool')) or {}
+        except LXDError as e:
+            logger.error(f"Error reading resources of LXD node {host}: {e}")
+            return {'online': False, 'capacity_known': False}
+        memory = resources.get('memory', {})
+        space = pool.get('space', {})
+        return {
+            'online': True,
+            'capacity_known': True,
+            'memory_mb': memory.get('total', 0) // (1024 * 1024),
+            'memory_used_mb': memory.get('used', 0) // (1024 * 1024),
+            'cpu_threads': resources.get('cpu', {}).get('total', 0),
+            'pool_usage': space['used'] / space['total'] if space.get('total') else 0
+        }
+
+    def refresh(self):
+        with self._refresh_lock:
+            self.nodes = {host: dict(self._probe(host, client), updated_at=time.time())
+                          for host, client in lxd_nodes.items()}
+            if self.nodes and leadership.is_leader():
+                leadership.publish({'capacity': self.nodes}, self.updated_at)
+
+    def load(self):
+        """Take the capacity the leader published; returns False if it has nothing newer"""
+        published = leadership.read(['capacity'], newer_than=self.updated_at)
+        if not published:
+            return False
+        nodes, _ = published['capacity']
+        self.nodes = {host: node for host, node in nodes.items() if host in lxd_nodes}
+        return True
+
+    def allocations(self):
+        """RAM (MB) and vCPUs already sold on each node"""
+        allocated = {host: {'memory_mb': 0, 'cpus': 0} for host in lxd_nodes}
+        rows = db.session.execute(
+            db.select(VPS.host, VPS.ram, VPS.cpu, db.func.count(VPS.id))
+            .where(VPS.status != 'deleting')
+            .group_by(VPS.host, VPS.ram, VPS.cpu)
+        ).all()
+        for host, ram, cpu, count in rows:
+            if host in allocated:
+                allocated[host]['memory_mb'] += int(ram.replace('GB', '')) * 1024 * count
+                allocated[host]['cpus'] += int(cpu) * count
+        return allocated
+
+    def _headroom(self, host, node, allocated, memory_mb, cpus):
+        """Plan RAM still sellable on a node after this VPS, or None if it does not fit"""
+        if not node.get('capacity_known'):
+            return 0
+        memory_capacity = node['memory_mb'] * node_option(host, 'memory_overcommit')
+        cpu_capacity = node['cpu_threads'] * node_option(host, 'cpu_allocation_ratio')
+        if allocated['memory_mb'] + memory_mb > memory_capacity:
+            return None
+        if allocated['cpus'] + cpus > cpu_capacity:
+            return None
+        if node['pool_usage'] >= node_option(host, 'max_pool_usage'):
+            return None
+        return memory_capacity - allocated['memory_mb'] - memory_mb
+
+    def place(self, plan):
+        """Return the node to create a VPS of `plan` on, or None if no node has room"""
+        if self.updated_at is None and not self.load():
+            self.refresh()
+        specs = VPS_PLANS[plan]
+        memory_mb = int(specs['ram'].replace('GB', '')) * 1024
+        cpus = int(specs['cpu'])
+        allocated = self.allocations()
+
+        candidates = []
+        for host, node in self.nodes.items():
+            if not node.get('online') or host not in allocated:
+                continue
+            headroom = self._headroom(host, node, allocated[host], memory_mb, cpus)
+            if headroom is not None:
+                candidates.append((headroom, host))
+        if not candidates:
+            return None
+        if self.policy == 'binpack':
+            return min(candidates)[1]
+        return max(candidates)[1]
+
+    @property
+    def updated_at(self):
+        return min((node['updated_at'] for node in self.nodes.values()), default=None)
+
+    def status(self):
+        """Per-node capacity and allocation for the admin API"""
+        allocated = self.allocations()
+        return {host: dict(node, allocated=allocated.get(host)) for host, node in self.nodes.items()}
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                with app.app_context():
+                    if leadership.is_leader():
+                        self.refresh()
+                    else:
+                        self.load()
+            except Exception as e:
+                logger.error(f"Error refreshing LXD node capacity: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Start the capacity refresh thread if it is not already running in this process"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='node-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+node_scheduler = NodeScheduler(policy=app.config['PLACEMENT_POLICY'],
+                               interval=app.config['NODE_REFRESH_INTERVAL'])
+
+class WarmPool:
+    """Keeps pre-created, stopped containers ready per node and plan/processor.
+
+    Handing one out only needs a rename, a limits update and a start, instead
+    of a full image unpack. Every node keeps its own pool, sized by `targets`
+    unless the node sets 'warm_pool' in LXD_NODES, so a VPS placed on any node
+    can be served from that node. Containers are claimed with a conditional
+    DELETE so two workers can never hand out the same one. Only the leader
+    process refills pools, so a claim in another process is made up for on
+    the leader's next pass.
+    """
+
+    def __init__(self, targets, interval=30):
+        self.targets = targets
+        self.interval = interval
+        self.hits = {}
+        self.misses = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def node_targets(self, host):
+        """Ready containers wanted per 'Plan/Processor' on a node"""
+        return app.config['LXD_NODES'].get(host, {}).get('warm_pool', self.targets)
+
+    def claim(self, plan, processor, host=None):
+        """Take a ready container for the plan on `host`, or return None on a pool miss"""
+        host = host or DEFAULT_NODE
+        pool_key = f"{plan}/{processor}"
+        candidates = db.session.execute(
+            db.select(WarmContainer.id, WarmContainer.container_name)
+            .where(WarmContainer.pool_key == pool_key, WarmContainer.status == 'ready',
+                   WarmContainer.host == host)
+            .order_by(WarmContainer.id)
+            .limit(5)
+        ).all()
+        for warm_id, container_name in candidates:
+            result = db.session.execute(
+                db.delete(WarmContainer)
+                .where(WarmContainer.id == warm_id, WarmContainer.status == 'ready')
+            )
+            db.session.commit()
+            if result.rowcount == 1:
+                self._count(self.hits, host, pool_key)
+                self._wake.set()
+                return container_name
+        self._count(self.misses, host, pool_key)
+        if pool_key in self.node_targets(host):
+            self._wake.set()
+        return None
+
+    def _count(self, counter, host, pool_key):
+        with self._lock:
+            counter[host, pool_key] = counter.get((host, pool_key), 0) + 1
+
+    def status(self):
+        """Target, ready count, hits and misses per node and pool"""
+        counts = {
+            (host, pool_key): count for host, pool_key, count in db.session.execute(
+                db.select(WarmContainer.host, WarmContainer.pool_key, db.func.count(WarmContainer.id))
+                .where(WarmContainer.status == 'ready')
+                .group_by(WarmContainer.host, WarmContainer.pool_key)
+            )
+        }
+        with self._lock:
+            keys = {(host, pool_key) for host in lxd_nodes for pool_key in self.node_targets(host)}
+            keys |= set(counts) | set(self.hits) | set(self.misses)
+            nodes = {}
+            for host, pool_key in sorted(keys):
+                nodes.setdefault(host, {})[pool_key] = {
+                    'target': self.node_targets(host).get(pool_key, 0),
+                    'ready': counts.get((host, pool_key), 0),
+                    'hits': self.hits.get((host, pool_key), 0),
+                    'misses': self.misses.get((host, pool_key), 0)
+                }
+            return nodes
+
+    def replenish(self):
+        """Create containers for every node's pools that are below their target size"""
+        for host in lxd_nodes:
+            if node_scheduler.nodes.get(host, {}).get('online') is False:
+                continue
+            for pool_key, target in self.node_targets(host).items():
+                if not self._replenish_pool(host, pool_key, target):
+                    break
+
+    def _replenish_pool(self, host, pool_key, target):
+        """Fill one pool on one node; returns False if the node failed to create a container"""
+        plan, _, processor = pool_key.partition('/')
+        if plan not in VPS_PLANS:
+            logger.error(f"Warm pool configured for unknown plan: {pool_key}")
+            return True
+        memory_limit, cpu_limit = plan_limits(plan)
+        
+        while WarmContainer.query.filter_by(host=host, pool_key=pool_key).count() < target:
+            warm = WarmContainer(container_name=f"pool-{uuid.uuid4().hex[:12]}", pool_key=pool_key, host=host)
+            db.session.add(warm)
+            db.session.commit()
+            
+            success, output = lxc_launch(warm.container_name, memory_limit, cpu_limit, start=False, host=host)
+            if not success:
+                logger.error(f"Failed to create warm container for {pool_key} on {host}: {output}")
+                db.session.delete(warm)
+                db.session.commit()
+                return False
+            warm.status = 'ready'
+            db.session.commit()
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                with app.app_context():
+                    if leadership.is_leader():
+                        self.replenish()
+            except Exception as e:
+                logger.error(f"Error replenishing warm pool: {e}")
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self):
+        """Start the replenishment thread if any node has a pool to keep filled"""
+        if not any(self.node_targets(host) for host in lxd_nodes):
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='warm-pool', daemon=True)
+            self._thread.start()
+
+warm_pool = WarmPool(app.config['WARM_POOL'], interval=app.config['WARM_POOL_INTERVAL'])
+
+def provision_container(container_name, plan, processor, host=None):
+    """Bring up a container for a plan on `host`, from the warm pool when possible"""
+    memory_limit, cpu_limit = plan_limits(plan)
+    
+    pooled = warm_pool.claim(plan, processor, host)
+    if pooled:
+        for step in (lambda: lxc_rename(pooled, container_name, host),
+                     lambda: lxc_set_limits(container_name, memory_limit, cpu_limit, host),
+                     lambda: lxc_power(container_name, 'start', host)):
+            success, output = step()
+            if not success:
+                break
+        else:
+            return True, output
+        logger.error(f"Warm container {pooled} could not be handed out, launching instead: {output}")
+        lxc_delete(container_name, host)
+        lxc_delete(pooled, host)
+    
+    return lxc_launch(container_name, memory_limit, cpu_limit, host=host)
+
+class ProvisionQueue:
+    """Runs persisted ProvisionJob rows on a bounded worker pool.
+
+    Jobs are claimed with a conditional UPDATE so that a job is only ever run
+    once, even when several worker processes recover the same queued rows.
+    """
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Create the worker pool and pick up queued jobs, once per process"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='vps-provision')
+                self._executor.submit(self._recover)
+            return self._executor
+
+    def submit(self, job_id):
+        self.start().submit(self._run, job_id)
+
+    def _recover(self):
+        """Requeue jobs left in the queue by a previous process"""
+        with app.app_context():
+            job_ids = [job.id for job in ProvisionJob.query.filter_by(status='queued').all()]
+        for job_id in job_ids:
+            self._executor.submit(self._run, job_id)
+
+    def _claim(self, job_id):
+        result = db.session.execute(
+            db.update(ProvisionJob)
+            .where(ProvisionJob.id == job_id, ProvisionJob.status == 'queued')
+            .values(status='running', started_at=datetime.utcnow())
+        )
+        db.session.commit()
+        return result.rowcount == 1
+
+    def _run(self, job_id):
+        with app.app_context():
+            try:
+                if not self._claim(job_id):
+                    return
+                job = ProvisionJob.query.get(job_id)
+                vps = VPS.query.get(job.vps_id) if job.vps_id else None
+                if vps:
+                    success, output = provision_container(job.container_name, vps.plan, vps.processor, vps.host)
+                else:
+                    success, output = False, 'VPS was removed before it could be provisioned'
+                self._finish(job, success, output)
+            except Exception as e:
+                logger.error(f"Provision job {job_id} crashed: {e}")
+                db.session.rollback()
+                job = ProvisionJob.query.get(job_id)
+                if job and job.status == 'running':
+                    self._finish(job, False, str(e))
+            finally:
+                db.session.remove()
+
+    def _finish(self, job, success, output):
+        vps = VPS.query.get(job.vps_id) if job.vps_id else None
+
+        if job.reservation_id:
+            settle_reservation(job.reservation_id, capture=success)
+
+        if success:
+            if vps:
+                vps.status = 'running'
+            job.status = 'completed'
+            container_inventory.set_status(job.container_name, 'Running')
+        else:
+            if vps:
+                db.session.delete(vps)
+            job.vps_id = None
+            job.status = 'failed'
+            job.error = output if isinstance(output, str) else 'Command failed'
+
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        logger.info(f"Provision job {job.id} for {job.container_name} {job.status}")
+
+provision_queue = ProvisionQueue(max_workers=app.config['PROVISION_WORKERS'])
+
+# VPS.status and LXC state after each power action
+POWER_ACTIONS = {'start': ('running', 'Running'), 'stop': ('stopped', 'Stopped'), 'restart': ('running', 'Running')}
+
+class BulkExecutor:
+    """Runs bulk power operations on a bounded pool, limited per LXD host"""
+
+    def __init__(self, max_workers=8, per_host=4):
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self._executor = None
+        self._host_slots = {}
+        self._lock = threading.Lock()
+
+    def _slots(self, host):
+        with self._lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='vps-bulk')
+            return self._host_slots[host]
+
+    def _run(self, host, container_name, action):
+        if action == 'start':
+            action = start_action(container_name)
+        with self._slots(host):
+            return lxc_power(container_name, action, host)
+
+    def map(self, action, items):
+        """Run `action` on each (key, container_name, host); returns {key: (success, output)}"""
+        for _, _, host in items:
+            self._slots(host)
+        futures = {key: self._executor.submit(self._run, host, container_name, action)
+                   for key, container_name, host in items}
+        results = {}
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                results[key] = (False, e)
+        return results
+
+bulk_executor = BulkExecutor(max_workers=app.config['BULK_WORKERS'],
+                             per_host=app.config['LXC_HOST_CONCURRENCY'])
+
+def container_missing(output):
+    """True if an LXC error says the container does not exist"""
+    return isinstance(output, str) and 'not found' in output.lower()
+
+class TeardownQueue:
+    """Deletes the containers of removed users in parallel, with retries.
+
+    Each VPS row is purged once its container is confirmed gone, and the user
+    row once none of its VPS remain.
+    """
+
+    def __init__(self, max_workers=8, max_attempts=5):
+        self.max_workers = max_workers
+        self.max_attempts = max_attempts
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Create the worker pool and pick up unfinished tasks, once per process"""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='vps-teardown')
+                self._executor.submit(self._recover)
+            return self._executor
+
+    def submit(self, task_id):
+        self.start().submit(self._run, task_id)
+
+    def _recover(self):
+        with app.app_context():
+            task_ids = [task.id for task in TeardownTask.query.filter_by(status='pending').all()]
+        for task_id in task_ids:
+            self._executor.submit(self._run, task_id)
+
+    def _run(self, task_id):
+        with app.app_context():
+            try:
+                claimed = db.session.execute(
+                    db.update(TeardownTask)
+                    .where(TeardownTask.id == task_id, TeardownTask.status == 'pending')
+                    .values(status='running')
+                ).rowcount == 1
+                db.session.commit()
+                if not claimed:
+                    return
+                
+                task = db.session.get(TeardownTask, task_id)
+                while True:
+                    try:
+                        success, output = lxc_delete(task.container_name, task.host)
+                    except ContainerBusy as e:
+                        # Let the running operation finish, then try again
+                        success, output = False, str(e)
+                    task.attempts += 1
+                    if success or container_missing(output):
+                        self._finish(task)
+                        break
+                    task.last_error = output if isinstance(output, str) else 'Command failed'
+                    if task.attempts >= self.max_attempts:
+                        task.status = 'failed'
+                        task.finished_at = datetime.utcnow()
+                        db.session.commit()
+                        logger.error(f"Giving up deleting {task.container_name}: {task.last_error}")
+                        break
+                    db.session.commit()
+                    time.sleep(min(2 ** task.attempts, 30))
+                
+                self.purge_users()
+            except Exception as e:
+                logger.error(f"Teardown task {task_id} crashed: {e}")
+                db.session.rollback()
+            finally:
+                db.session.remove()
+
+    def _finish(self, task):
+        if task.vps_id:
+            backup_queue.purge(task.vps_id)
+            VPS.query.filter_by(id=task.vps_id).delete()
+        task.status = 'done'
+        task.finished_at = datetime.utcnow()
+        db.session.commit()
+        container_inventory.discard(task.container_name)
+
+    def purge_users(self):
+        """Delete users marked for removal that have no VPS left.
+
+        Teardown tasks of one user finish in parallel, so several threads can
+        get here for the same user; each row is removed by a guarded DELETE,
+        which only one of them matches.
+        """
+        purgeable = (User.status == 'deleting', ~User.vps_instances.any())
+        candidates = db.session.query(User.id, User.username).filter(*purgeable).all()
+        for user_id, username in candidates:
+            purged = (User.query.filter(User.id == user_id, *purgeable)
+                      .delete(synchronize_session='fetch'))
+            if purged:
+                logger.info(f"Purged user {username}")
+        if candidates:
+            db.session.commit()
+
+    def enqueue_user(self, user):
+        """Mark a user and their VPS for deletion and queue a task per container"""
+        user.status = 'deleting'
+        tasks = []
+        for vps in user.vps_instances:
+            vps.status = 'deleting'
+            task = TeardownTask.query.filter(TeardownTask.vps_id == vps.id,
+                                             TeardownTask.status.in_(['pending', 'running', 'failed'])).first()
+            if task is None:
+                task = TeardownTask(user_id=user.id, vps_id=vps.id, container_name=vps.container_name,
+                                    host=vps.host)
+                db.session.add(task)
+            elif task.status == 'failed':
+                # Retry tasks that gave up earlier
+                task.status = 'pending'
+                task.attempts = 0
+            tasks.append(task)
+        db.session.commit()
+        
+        for task in tasks:
+            if task.status == 'pending':
+                self.submit(task.id)
+        if not tasks:
+            self.purge_users()
+        return tasks
+
+teardown_queue = TeardownQueue(max_workers=app.config['TEARDOWN_WORKERS'],
+                               max_attempts=app.config['TEARDOWN_MAX_ATTEMPTS'])
+
+SNAPSHOT_NAME = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_-]{0,62}$')
+
+def backup_storage_path(host):
+    """Local mount of a node's storage pool, or None if it is not on this host"""
+    path = node_option(host, 'storage_path')
+    if path:
+        return path
+    endpoint = app.config['LXD_NODES'].get(host or DEFAULT_NODE, {}).get('endpoint') or find_socket_path()
+    if endpoint.startswith('https://'):
+        return None
+    return os.path.join(os.path.dirname(endpoint), 'storage-pools', node_option(host, 'storage_pool'))
+
+def snapshot_path(host, container_name, snapshot):
+    """Read-only btrfs subvolume LXD keeps a container snapshot in"""
+    storage = backup_storage_path(host)
+    return os.path.join(storage, 'containers-snapshots', container_name, snapshot) if storage else None
+
+class BackupQueue:
+    """Backs up VPS as btrfs send streams of LXD snapshots.
+
+    Backups are rows in the backup table. A dispatcher thread claims queued
+    rows with a conditional UPDATE that also counts the backups already
+    running on the same node, which caps backup I/O per node across every
+    worker process. Each backup snapshots the container and copies `btrfs
+    send` output (incremental on the previous backup's snapshot) to a file
+    in fixed-size chunks.
+    """
+
+    def __init__(self, backup_dir, max_workers=4, per_host=1, interval=None, full_every=7, retention=14,
+                 chunk_size=1024 * 1024, timeout=6 * 3600, poll_interval=5):
+        self.backup_dir = backup_dir
+        self.max_workers = max_workers
+        self.per_host = per_host
+        self.interval = interval
+        self.full_every = full_every
+        self.retention = retention
+        self.chunk_size = chunk_size
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._executor = None
+        self._last_schedule = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def enqueue(self, vps, kind='manual'):
+        """Queue a backup of `vps`; returns False if one is already queued or running"""
+        result = db.session.execute(
+            sqlite_insert(Backup)
+            .values(vps_id=vps.id, container_name=vps.container_name, host=vps.host, kind=kind, status='queued',
+                    snapshot_name=f"backup-{datetime.utcnow():%Y%m%d-%H%M%S}", created_at=datetime.utcnow())
+            .on_conflict_do_nothing()
+        )
+        db.session.commit()
+        self._wake.set()
+        return result.rowcount == 1
+
+    def first_backup_at(self, vps):
+        """When a VPS that has never been backed up is due: an interval after it was created,
+        plus a fixed per-VPS offset so VPS created together are not backed up together"""
+        offset = int(hashlib.sha1(str(vps.id).encode()).hexdigest(), 16) % self.interval
+        return vps.created_at + timedelta(seconds=self.interval + offset)
+
+    def schedule(self):
+        """Queue scheduled backups for VPS whose last backup is older than the interval"""
+        now = datetime.utcnow()
+        recent = db.select(Backup.vps_id).where(Backup.created_at > now - timedelta(seconds=self.interval))
+        candidates = VPS.query.filter(VPS.status.in_(['running', 'stopped', 'suspended']), VPS.id.not_in(recent)).all()
+        backed_up = set(db.session.execute(
+            db.select(Backup.vps_id).where(Backup.vps_id.in_([vps.id for vps in candidates])).distinct()
+        ).scalars())
+        due = [vps for vps in candidates if vps.id in backed_up or self.first_backup_at(vps) <= now]
+        return sum(1 for vps in due if self.enqueue(vps, kind='scheduled'))
+
+    def dispatch(self):
+        """Claim queued backups while their node has a free backup slot"""
+        now = datetime.utcnow()
+        db.session.execute(
+            db.update(Backup)
+            .where(Backup.status == 'running', Backup.started_at < now - timedelta(seconds=self.timeout))
+            .values(status='failed', error='Backup was interrupted', finished_at=now)
+        )
+        db.session.commit()
+        
+        queued = db.session.execute(
+            db.select(Backup.id, Backup.host).where(Backup.status == 'queued').order_by(Backup.id)
+        ).all()
+        for backup_id, host in queued:
+            running = (db.select(db.func.count(Backup.id))
+                       .where(Backup.host == host, Backup.status == 'running')
+                       .scalar_subquery())
+            claimed = db.session.execute(
+                db.update(Backup)
+                .where(Backup.id == backup_id, Backup.status == 'queued', running < self.per_host)
+                .values(status='running', started_at=datetime.utcnow())
+                .execution_options(synchronize_session=False)
+            ).rowcount == 1
+            db.session.commit()
+            if claimed:
+                self._executor.submit(self._run, backup_id)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            with app.app_context():
+                try:
+                    if self.interval and time.time() - self._last_schedule >= 60:
+                        self._last_schedule = time.time()
+                        self.schedule()
+                    self.dispatch()
+                except Exception as e:
+                    logger.error(f"Error dispatching backups: {e}")
+                    db.session.rollback()
+                finally:
+                    db.session.remove()
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+
+    def _parent(self, backup):
+        """Previous backup to send incrementally against, if its chain is not full yet"""
+        previous = (Backup.query
+                    .filter(Backup.vps_id == backup.vps_id, Backup.status == 'done', Backup.id < backup.id)
+                    .order_by(Backup.id.desc()).first())
+        if previous is None or previous.chain_position + 1 >= self.full_every:
+            return previous, None
+        if not os.path.isdir(snapshot_path(backup.host, backup.container_name, previous.snapshot_name)):
+            return previous, None
+        return previous, previous
+
+    def _send(self, command, path):
+        """Stream `btrfs send` output to `path` in chunks; returns (size, sha256)"""
+        digest = hashlib.sha256()
+        size = 0
+        partial = f"{path}.partial"
+        with open(partial, 'wb') as out, tempfile.TemporaryFile() as stderr:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr)
+            try:
+                for chunk in iter(lambda: process.stdout.read(self.chunk_size), b''):
+                    out.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+            finally:
+                process.stdout.close()
+                returncode = process.wait()
+            if returncode != 0:
+                stderr.seek(0)
+                error = stderr.read().decode(errors='replace').strip() or 'btrfs send failed'
+                os.remove(partial)
+                raise RuntimeError(error)
+        os.replace(partial, path)
+        return size, digest.hexdigest()
+
+    def _run(self, backup_id):
+        with app.app_context():
+            backup = None
+            snapshot_taken = False
+            try:
+                backup = db.session.get(Backup, backup_id)
+                if backup is None:
+                    return
+                source = snapshot_path(backup.host, backup.container_name, backup.snapshot_name)
+                if source is None:
+                    raise RuntimeError(f"The storage pool of node {backup.host} is not mounted on this host")
+                
+                success, output = lxc_snapshot(backup.container_name, backup.snapshot_name, backup.host)
+                if not success:
+                    raise RuntimeError(output)
+                snapshot_taken = True
+                
+                previous, parent = self._parent(backup)
+                command = ['btrfs', 'send']
+                if parent:
+                    command += ['-p', snapshot_path(backup.host, backup.container_name, parent.snapshot_name)]
+                command.append(source)
+                if shutil.which('ionice'):
+                    command = ['ionice', '-c', '3'] + command
+                
+                directory = os.path.join(self.backup_dir, backup.container_name)
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, f"{backup.snapshot_name}.btrfs")
+                size, checksum = self._send(command, path)
+                
+                backup.status = 'done'
+                backup.path = path
+                backup.size_bytes = size
+                backup.checksum = checksum
+                backup.parent_id = parent.id if parent else None
+                backup.chain_position = parent.chain_position + 1 if parent else 0
+                backup.finished_at = datetime.utcnow()
+                db.session.commit()
+                logger.info(f"Backed up {backup.container_name} to {path} ({size} bytes)")
+                
+                # Only the newest snapshot is needed as the next parent
+                if previous:
+                    lxc_delete_snapshot(previous.container_name, previous.snapshot_name, previous.host)
+                self.prune(backup.vps_id)
+            except Exception as e:
+                logger.error(f"Backup {backup_id} failed: {e}")
+                db.session.rollback()
+                if backup is not None:
+                    if snapshot_taken:
+                        lxc_delete_snapshot(backup.container_name, backup.snapshot_name, backup.host)
+                    db.session.execute(
+                        db.update(Backup).where(Backup.id == backup_id)
+                        .values(status='failed', error=str(e), finished_at=datetime.utcnow())
+                    )
+                    db.session.commit()
+            finally:
+                db.session.remove()
+                self._wake.set()
+
+    def _remove(self, backups):
+        for backup in backups:
+            if backup.path and os.path.exists(backup.path):
+                os.remove(backup.path)
+            db.session.delete(backup)
+        db.session.commit()
+
+    def prune(self, vps_id):
+        """Delete backups beyond the retention count, whole chains at a time"""
+        backups = (Backup.query
+                   .filter(Backup.vps_id == vps_id, Backup.status.in_(['done', 'failed']))
+                   .order_by(Backup.id.desc()).all())
+        kept = 0
+        for index, backup in enumerate(backups):
+            if backup.status == 'done':
+                kept += 1
+            # Cut only at the start of a chain, so every kept incremental keeps its parents
+            if kept >= self.retention and backup.status == 'done' and backup.chain_position == 0:
+                self._remove(backups[index + 1:])
+                return len(backups) - index - 1
+        return 0
+
+    def purge(self, vps_id):
+        """Delete every backup of a VPS that is being removed"""
+        self._remove(Backup.query.filter_by(vps_id=vps_id).all())
+
+    def start(self):
+        """Start the dispatcher thread and worker pool once per process"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='vps-backup')
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name='backup-dispatcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+backup_queue = BackupQueue(app.config['BACKUP_DIR'],
+                           max_workers=app.config['BACKUP_WORKERS'],
+                           per_host=app.config['BACKUP_HOST_CONCURRENCY'],
+                           interval=app.config['BACKUP_INTERVAL'],
+                           full_every=app.config['BACKUP_FULL_EVERY'],
+                           retention=app.config['BACKUP_RETENTION'],
+                           chunk_size=app.config['BACKUP_CHUNK_SIZE'],
+                           timeout=app.config['BACKUP_TIMEOUT'])
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class AuditLog:
+    """Audit events written in batches by a background thread, off the request path.
+
+    record() only queues the event. When the bounded queue stays full the
+    caller is slowed by up to `enqueue_timeout` and the event is then appended
+    to this process's spill file; batches the database rejects are spilled too.
+    Spill files, including those left by exited worker processes, are replayed
+    once writes succeed again, and event ids keep replays from duplicating rows.
+    A clean exit flushes the queue; events still in memory when a process is
+    killed outright are lost.
+    """
 
-def get_system_resources():
-    """Get system CPU, RAM, and Disk usage"""
-    try:
-        # CPU Usage
-        cpu_cmd = "top -bn1 | grep 'Cpu(s)' | awk '{print $2}' | cut -d'%' -f1"
-        cpu_result = subprocess.run(cpu_cmd, shell=True, capture_output=True, text=True)
-        cpu_usage = float(cpu_result.stdout.strip()) if cpu_result.stdout.strip() else 0.0
-        
-        # RAM Usage
-        ram_cmd = "free -m | awk 'NR==2{printf \"%.2f\", $3*100/$2 }'"
-        ram_result = subprocess.run(ram_cmd, shell=True, capture_output=True, text=True)
-        ram_usage = float(ram_result.stdout.strip()) if ram_result.stdout.strip() else 0.0
-        
-        # Disk Usage
-        disk_cmd = "df -h / | awk 'NR==2{print $5}' | sed 's/%//'"
-        disk_result = subprocess.run(disk_cmd, shell=True, capture_output=True, text=True)
-        disk_usage = float(disk_result.stdout.strip()) if disk_result.stdout.strip() else 0.0
-        
-        return {
-            'cpu': round(cpu_usage, 2),
-            'ram': round(ram_usage, 2),
-            'disk': round(disk_usage, 2)
+    REPLAY_INTERVAL = 30  # seconds between spill directory scans
+
+    def __init__(self, spill_dir, queue_size=10000, batch_size=500, flush_interval=1.0, enqueue_timeout=0.5):
+        self.spill_dir = spill_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._next_replay = 0
+
+    def record(self, action, vps=None, user_id=None, vps_id=None, target=None, actor_id=None, **details):
+        """Queue an event; the actor defaults to the logged-in user and the subject to the VPS owner"""
+        if actor_id is None and has_request_context():
+            actor = g.get('user')
+            actor_id = actor.id if actor else None
+        event = {
+            'event_id': uuid.uuid4().hex,
+            'created_at': datetime.utcnow(),
+            'action': action,
+            'actor_id': actor_id,
+            'user_id': user_id if user_id is not None else (vps.user_id if vps else None),
+            'vps_id': vps.id if vps else vps_id,
+            'target': target or (vps.container_name if vps else None),
+            'ip': request.remote_addr if has_request_context() else None,
+            'details': json.dumps(details, default=str) if details else None
         }
-    except Exception as e:
-        logger.error(f"Error getting system resources: {e}")
-        return {'cpu': 0, 'ram': 0, 'disk': 0}
+        self.start()
+        try:
+            self._queue.put(event, timeout=self.enqueue_timeout)
+        except queue.Full:
+            audit_events_spilled.inc()
+            self._spill([event])
 
-def get_vps_stats(container_name):
-    """Get individual VPS statistics"""
-    try:
-        # Check if container exists
-        check_cmd = f"lxc list {container_name} --format json"
-        success, output = execute_lxc_sync(check_cmd)
-        if not success:
-            return None
-        
-        containers = json.loads(output)
-        if not containers:
-            return None
-            
-        container = containers[0]
-        state = container.get('state', {})
-        
-        # Get memory usage
-        memory = state.get('memory', {})
-        memory_usage = memory.get('usage', 0) / (1024 * 1024)  # Convert to MB
-        
-        # Get CPU usage
-        cpu = state.get('cpu', {})
-        cpu_usage = cpu.get('usage', 0)
+    def _spill_path(self):
+        return os.path.join(self.spill_dir, f"{os.getpid()}-spill.jsonl")
+
+    def _spill(self, events):
+        """Append events to this process's spill file and fsync it"""
+        lines = ''.join(json.dumps(event, default=str) + '\n' for event in events)
+        try:
+            with self._spill_lock:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                with open(self._spill_path(), 'a') as f:
+                    f.write(lines)
+                    f.flush()
+                    os.fsync(f.fileno())
+        except OSError as e:
+            logger.error(f"Audit events lost, cannot write spill file: {e}: {lines}")
+
+    def _write(self, events):
+        with db.engine.begin() as conn:
+            conn.execute(sqlite_insert(AuditEvent).on_conflict_do_nothing(), events)
+        audit_events_written.inc(amount=len(events))
+
+    def _flush(self, events):
+        try:
+            self._write(events)
+            return True
+        except Exception as e:
+            logger.error(f"Error writing {len(events)} audit events, spilling them: {e}")
+            audit_events_spilled.inc(amount=len(events))
+            self._spill(events)
+            return False
+
+    def _claim_spill_files(self):
+        """Rename spill files of this process and of exited ones to replay files owned by this process"""
+        try:
+            names = sorted(os.listdir(self.spill_dir))
+        except FileNotFoundError:
+            return []
+        own_pid = os.getpid()
+        claimed = []
+        for name in names:
+            match = re.match(r'^(\d+)-(spill|replay-\w+)\.jsonl$', name)
+            if not match:
+                continue
+            pid = int(match.group(1))
+            path = os.path.join(self.spill_dir, name)
+            if pid == own_pid and match.group(2) != 'spill':
+                claimed.append(path)
+                continue
+            if pid != own_pid and pid_alive(pid):
+                continue
+            replay_path = os.path.join(self.spill_dir, f"{own_pid}-replay-{uuid.uuid4().hex}.jsonl")
+            try:
+                with self._spill_lock:
+                    os.rename(path, replay_path)
+            except FileNotFoundError:
+                continue  # another process adopted it first
+            claimed.append(replay_path)
+        return claimed
+
+    def replay(self):
+        """Write spilled events back to the database; returns how many were replayed"""
+        replayed = 0
+        for path in self._claim_spill_files():
+            events = []
+            try:
+                with open(path) as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        event = json.loads(line)
+                        event['created_at'] = datetime.fromisoformat(event['created_at'])
+                        events.append(event)
+                        if len(events) >= self.batch_size:
+                            self._write(events)
+                            replayed += len(events)
+                            events = []
+                if events:
+                    self._write(events)
+                    replayed += len(events)
+                os.remove(path)
+            except Exception as e:
+                logger.error(f"Error replaying audit spill file {path}: {e}")
+                break
+        if replayed:
+            logger.info(f"Replayed {replayed} spilled audit events")
+        return replayed
+
+    def _next_batch(self):
+        events = []
+        try:
+            events.append(self._queue.get(timeout=self.flush_interval))
+        except queue.Empty:
+            return events
+        while len(events) < self.batch_size:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def _run(self):
+        with app.app_context():
+            while True:
+                events = self._next_batch()
+                if events:
+                    self._flush(events)
+                    continue
+                if self._stop.is_set():
+                    return
+                if time.time() >= self._next_replay:
+                    self._next_replay = time.time() + self.REPLAY_INTERVAL
+                    self.replay()
+
+    def start(self):
+        """Start the writer thread once per process"""
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        """Flush queued events and stop the writer; whatever is left is spilled"""
+        self._stop.set()
+        if self._thread and self._pid == os.getpid():
+            self._thread.join(timeout)
+        leftover = []
+        while True:
+            try:
+                leftover.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if leftover:
+            self._spill(leftover)
+
+    def depth(self):
+        return self._queue.qsize()
+
+audit_log = AuditLog(app.config['AUDIT_SPILL_DIR'],
+                     queue_size=app.config['AUDIT_QUEUE_SIZE'],
+                     batch_size=app.config['AUDIT_BATCH_SIZE'],
+                     flush_interval=app.config['AUDIT_FLUSH_INTERVAL'],
+                     enqueue_timeout=app.config['AUDIT_ENQUEUE_TIMEOUT'])
+atexit.register(audit_log.stop)
+
+audit_events_written = metrics_registry.counter('gvm_audit_events_written_total', 'Audit events inserted into the database')
+audit_events_spilled = metrics_registry.counter('gvm_audit_events_spilled_total',
+                                                'Audit events written to the spill file instead of the database')
+metrics_registry.gauge('gvm_audit_queue_depth', 'Audit events waiting for the writer thread',
+                       collect=lambda: {(): audit_log.depth()})
+
+class ConsoleSession:
+    """A shell inside a container from `lxc exec`, attached to a PTY.
+
+    A reader thread moves PTY output into a buffer and stops reading once it
+    holds `buffer_size` bytes, so output nobody consumes (a slow browser, or
+    `yes`) blocks the shell inside the container rather than growing server
+    memory. drain() hands buffered output to the WebSocket in batches and lets
+    the reader continue.
+    """
+
+    def __init__(self, user_id, vps_id, container_name, host, command, buffer_size, cols=80, rows=24):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.vps_id = vps_id
+        self.container_name = container_name
+        self.buffer_size = buffer_size
+        self.started_at = self.last_input = time.time()
+        self.leases = []
+        self.closed = False
+        self.eof = False
+        self.close_reason = None
+        self._buffer = bytearray()
+        self._pending_input = bytearray()
+        self._cond = threading.Condition()
         
-        return {
-            'memory_mb': round(memory_usage, 2),
-            'cpu_seconds': cpu_usage,
-            'status': state.get('status', 'Unknown')
-        }
-    except Exception as e:
-        logger.error(f"Error getting VPS stats: {e}")
-        return None
+        master_fd, slave_fd = pty.openpty()
+        try:
+            self._set_size(master_fd, cols, rows)
+            # setsid -c makes the PTY on stdin the controlling terminal of a new session, so resizes
+            # reach the shell. The child is not a process group leader, so setsid execs lxc without
+            # forking and process.pid leads the session that close() signals.
+            cli_command = ['setsid', '-c', 'lxc', 'exec', cli_target(container_name, host),
+                           '--env', 'TERM=xterm-256color', '--']
+            self.process = subprocess.Popen(cli_command + command, stdin=slave_fd, stdout=slave_fd, stderr=slave_fd)
+        except Exception:
+            os.close(master_fd)
+            raise
+        finally:
+            os.close(slave_fd)
+        os.set_blocking(master_fd, False)
+        self.master_fd = master_fd
+        self._reader = threading.Thread(target=self._read_loop, name=f"console-{container_name}", daemon=True)
+        self._reader.start()
+
+    @staticmethod
+    def _set_size(fd, cols, rows):
+        fcntl.ioctl(fd, termios.TIOCSWINSZ, struct.pack('HHHH', rows, cols, 0, 0))
+
+    def resize(self, cols, rows):
+        if not self.closed:
+            self._set_size(self.master_fd, max(1, min(cols, 1000)), max(1, min(rows, 1000)))
+
+    def _read_loop(self):
+        try:
+            while True:
+                with self._cond:
+                    while len(self._buffer) >= self.buffer_size and not self.closed:
+                        self._cond.wait()  # flow control: the PTY fills up and the shell blocks on write
+                    if self.closed:
+                        return
+                readable, _, _ = select.select([self.master_fd], [], [], 1.0)
+                if not readable:
+                    continue
+                try:
+                    data = os.read(self.master_fd, 65536)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    data = b''  # EIO once the shell has exited
+                with self._cond:
+                    if not data:
+                        return
+                    self._buffer += data
+                    self._cond.notify_all()
+        finally:
+            with self._cond:
+                self.eof = True
+                self._cond.notify_all()
+
+    def drain(self, max_bytes):
+        """Take up to `max_bytes` of buffered output"""
+        with self._cond:
+            data = bytes(self._buffer[:max_bytes])
+            del self._buffer[:max_bytes]
+            if data:
+                self._cond.notify_all()
+            return data
+
+    def write(self, data):
+        """Queue keyboard input; input beyond `buffer_size` that the shell isn't reading is dropped"""
+        self.last_input = time.time()
+        room = self.buffer_size - len(self._pending_input)
+        self._pending_input += data[:max(0, room)]
+        self.flush_input()
+
+    def flush_input(self):
+        if not self._pending_input or self.closed or self.eof:
+            return
+        try:
+            written = os.write(self.master_fd, self._pending_input)
+        except (BlockingIOError, OSError):
+            return
+        del self._pending_input[:written]
+
+    def close(self, reason):
+        """Hang up the shell, wait for the reader to finish and release the PTY"""
+        with self._cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.close_reason = reason
+            self._cond.notify_all()
+        for sig in (signal.SIGHUP, signal.SIGKILL):
+            try:
+                os.killpg(self.process.pid, sig)
+            except ProcessLookupError:
+                break
+            try:
+                self.process.wait(timeout=5)
+                break
+            except subprocess.TimeoutExpired:
+                continue
+        self._reader.join(timeout=5)
+        os.close(self.master_fd)
+
+class ConsoleManager:
+    """Open web console sessions of this process, with session limits and idle reaping.
+
+    The per-user and per-VPS limits are OperationLeases, so they hold across
+    worker processes; `max_sessions` caps this process alone, since every
+    session holds one of its threads. The reaper thread renews the leases of
+    live sessions and closes sessions that are idle or have run too long.
+    """
+
+    REAP_INTERVAL = 15  # seconds; leases are kept alive for a few intervals
+
+    def __init__(self, command, per_user=2, per_vps=4, max_sessions=16, idle_timeout=900, max_duration=8 * 3600,
+                 buffer_size=256 * 1024):
+        self.command = command
+        self.per_user = per_user
+        self.per_vps = per_vps
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_duration = max_duration
+        self.buffer_size = buffer_size
+        self.sessions = {}
+        self._opening = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _acquire(self, user_id, container_name):
+        ttl = self.REAP_INTERVAL * 4
+        user_lease = rate_limiter.acquire(f"{user_id}:console", self.per_user, ttl=ttl)
+        if user_lease is None:
+            return None, f"You already have {self.per_user} console sessions open"
+        vps_lease = rate_limiter.acquire(f"console:{container_name}", self.per_vps, ttl=ttl)
+        if vps_lease is None:
+            rate_limiter.release(user_lease)
+            return None, f"This VPS already has {self.per_vps} console sessions open"
+        return [user_lease, vps_lease], None
+
+    def open(self, user_id, vps_id, container_name, host, cols=80, rows=24):
+        """Start a session; returns (session, None) or (None, message) when a session limit is reached"""
+        with self._lock:
+            if len(self.sessions) + self._opening >= self.max_sessions:
+                return None, 'Too many consoles are open on the server, try again shortly'
+            self._opening += 1
+        try:
+            leases, message = self._acquire(user_id, container_name)
+            if leases is None:
+                return None, message
+            try:
+                session = ConsoleSession(user_id, vps_id, container_name, host, self.command, self.buffer_size,
+                                         cols, rows)
+            except Exception:
+                for lease in leases:
+                    rate_limiter.release(lease)
+                raise
+            session.leases = leases
+            with self._lock:
+                self.sessions[session.id] = session
+        finally:
+            with self._lock:
+                self._opening -= 1
+        self.start()
+        return session, None
+
+    def close(self, session, reason):
+        session.close(reason)
+        with self._lock:
+            if self.sessions.pop(session.id, None) is None:
+                return
+        for lease in session.leases:
+            rate_limiter.release(lease)
+
+    def reap(self):
+        """Close idle and expired sessions and renew the leases of the rest"""
+        now = time.time()
+        with self._lock:
+            sessions = list(self.sessions.values())
+        reaped = 0
+        for console in sessions:
+            if now - console.last_input > self.idle_timeout:
+                self.close(console, 'idle')
+                reaped += 1
+            elif now - console.started_at > self.max_duration:
+                self.close(console, 'expired')
+                reaped += 1
+            else:
+                for lease in console.leases:
+                    rate_limiter.renew(lease, self.REAP_INTERVAL * 4)
+        return reaped
+
+    def _run(self):
+        while True:
+            time.sleep(self.REAP_INTERVAL)
+            try:
+                with app.app_context():
+                    self.reap()
+            except Exception as e:
+                logger.error(f"Error reaping console sessions: {e}")
+
+    def start(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='console-reaper', daemon=True)
+            self._thread.start()
+
+console_manager = ConsoleManager(app.config['CONSOLE_COMMAND'],
+                                 per_user=app.config['CONSOLE_SESSIONS_PER_USER'],
+                                 per_vps=app.config['CONSOLE_SESSIONS_PER_VPS'],
+                                 max_sessions=app.config['CONSOLE_SESSIONS_PER_PROCESS'],
+                                 idle_timeout=app.config['CONSOLE_IDLE_TIMEOUT'],
+                                 max_duration=app.config['CONSOLE_MAX_DURATION'],
+                                 buffer_size=app.config['CONSOLE_BUFFER_SIZE'])
+metrics_registry.gauge('gvm_console_sessions', 'Open web console sessions',
+                       collect=lambda: {(): len(console_manager.sessions)})
+
+def executor_stats(executor, max_workers):
+    """(max workers, live threads, queued tasks) of a worker pool that may not exist yet"""
+    if executor is None:
+        return max_workers, 0, 0
+    return max_workers, len(executor._threads), executor._work_queue.qsize()
+
+def worker_pool_stats():
+    return {
+        'provision': executor_stats(provision_queue._executor, provision_queue.max_workers),
+        'bulk': executor_stats(bulk_executor._executor, bulk_executor.max_workers),
+        'teardown': executor_stats(teardown_queue._executor, teardown_queue.max_workers),
+        'backup': executor_stats(backup_queue._executor, backup_queue.max_workers),
+    }
+
+def host_sampler_lag():
+    """Seconds the host sampler is behind its schedule"""
+    samples = host_sampler.history()
+    if not samples:
+        return {}
+    return {(): round(max(0.0, time.time() - samples[-1]['timestamp'] - host_sampler.interval), 3)}
+
+metrics_registry.gauge('gvm_host_sampler_lag_seconds', 'Delay of the host sampler beyond its interval',
+                       collect=host_sampler_lag)
+metrics_registry.gauge('gvm_background_leader', 'Whether this worker process runs the singleton background loops',
+                       collect=lambda: {(): int(leadership.is_leader())})
+metrics_registry.gauge('gvm_inventory_age_seconds', 'Age of the cached container inventory',
+                       collect=lambda: {(): round(time.time() - container_inventory.updated_at, 3)}
+                       if container_inventory.updated_at else {})
+
+def worker_pool_gauge(index):
+    return lambda: {(pool,): stats[index] for pool, stats in worker_pool_stats().items()}
+
+metrics_registry.gauge('gvm_worker_pool_max_workers', 'Configured threads per worker pool', ('pool',),
+                       collect=worker_pool_gauge(0))
+metrics_registry.gauge('gvm_worker_pool_threads', 'Threads started per worker pool', ('pool',),
+                       collect=worker_pool_gauge(1))
+metrics_registry.gauge('gvm_worker_pool_queued', 'Tasks waiting for a free worker; non-zero means the pool is saturated',
+                       ('pool',), collect=worker_pool_gauge(2))
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.db_queries = 0
+    http_requests_in_flight.inc()
+
+@app.after_request
+def record_response_status(response):
+    g.response_status = response.status_code
+    return response
+
+@app.teardown_request
+def record_request_metrics(exc):
+    if 'request_started' not in g:
+        return
+    endpoint = request.endpoint or 'unmatched'
+    status = 500 if exc is not None else g.get('response_status', 500)
+    http_requests_in_flight.dec()
+    http_request_duration.observe(time.perf_counter() - g.request_started, endpoint, request.method)
+    http_requests_total.inc(endpoint, request.method, str(status))
+    db_queries_per_request.observe(g.db_queries, endpoint)
+
+_workers_pid = None
+
+@app.before_request
+def start_background_workers():
+    """Start this process's background threads on its first request"""
+    global _workers_pid
+    if _workers_pid == os.getpid():
+        return
+    _workers_pid = os.getpid()
+    metrics_registry.start()
+    leadership.start()
+    host_sampler.start()
+    container_inventory.start()
+    provision_queue.start()
+    teardown_queue.start()
+    warm_pool.start()
+    node_scheduler.start()
+    backup_queue.start()
+    audit_log.start()
+    usage_meter.start()
+
+@app.before_request
+def load_current_user():
+    """Load the logged-in User once per request into g.user"""
+    g.user = None
+    if 'user_id' in session and request.endpoint not in ('static', 'asset'):
+        user = db.session.get(User, session['user_id'])
+        if user and user.status == 'active':
+            g.user = user
 
 # Decorators
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        if g.user is None:
+            session.clear()
             flash('Please login to access this page', 'warning')
             return redirect(url_for('login'))
         return f(*args, **kwargs)
@@ -153,25 +3345,120 @@ def login_required(f):
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
+        if g.user is None:
+            session.clear()
             flash('Please login to access this page', 'warning')
             return redirect(url_for('login'))
         
-        user = User.query.get(session['user_id'])
-        if not user or user.role != 'admin':
+        if g.user.role != 'admin':
             flash('Admin access required', 'danger')
             return redirect(url_for('dashboard'))
         return f(*args, **kwargs)
     return decorated_function
 
+def rate_limited(operation):
+    """Apply the user's token bucket and per-plan operation quota to POST requests"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != 'POST':
+                return f(*args, **kwargs)
+            user = g.user
+            
+            limit = rate_limit_for(user, operation)
+            if limit:
+                retry_after = rate_limiter.take(f"{user.id}:{operation}", *limit)
+                if retry_after:
+                    return too_many_requests(f'Too many {operation} requests', retry_after)
+            
+            if operation == 'create':
+                # Launches run in the background, so VPS still provisioning count against the quota
+                plan = request.form.get('plan')
+                quota = operation_quota(user, plan)
+                if quota is not None:
+                    provisioning = VPS.query.filter_by(user_id=user.id, plan=plan, status='provisioning').count()
+                    if provisioning >= quota:
+                        return too_many_requests(f'Only {quota} {plan} VPS can be provisioned at a time', 30)
+                return f(*args, **kwargs)
+            
+            vps = db.session.get(VPS, kwargs['vps_id']) if 'vps_id' in kwargs else None
+            quota = operation_quota(user, vps.plan) if vps else None
+            if quota is None:
+                return f(*args, **kwargs)
+            lease = rate_limiter.acquire(f"{user.id}:{vps.plan}", quota)
+            if lease is None:
+                return too_many_requests(f'Only {quota} operations on {vps.plan} VPS can run at a time', 5)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                rate_limiter.release(lease)
+        return decorated_function
+    return decorator
+
+# Static assets
+ASSET_DIR = os.path.join(app.static_folder, 'dist')
+ASSET_ENCODINGS = [('br', '.br'), ('gzip', '.gz')]  # preferred first
+
+def load_asset_manifest():
+    """Source path -> content-hashed path written by build_assets.py; empty when assets aren't built"""
+    try:
+        with open(os.path.join(ASSET_DIR, 'manifest.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.error(f"Cannot read asset manifest, serving unhashed static files: {e}")
+        return {}
+
+asset_manifest = load_asset_manifest()
+
+def load_cdn_integrity():
+    """CDN URL -> subresource integrity hash pinned by build_assets.py; empty when assets aren't built"""
+    try:
+        with open(os.path.join(ASSET_DIR, 'integrity.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.error(f"Cannot read CDN integrity hashes, loading CDN files unchecked: {e}")
+        return {}
+
+cdn_integrity_hashes = load_cdn_integrity()
+
+@app.template_global()
+def cdn_integrity(url):
+    """Value for a CDN tag's integrity attribute; an empty one is not checked by browsers"""
+    return cdn_integrity_hashes.get(url, '')
+
+@app.url_defaults
+def hashed_static_url(endpoint, values):
+    """Point url_for('static', filename=...) at the built, content-hashed copy when there is one"""
+    if endpoint == 'static' and values.get('filename') in asset_manifest:
+        values['filename'] = f"dist/{asset_manifest[values['filename']]}"
+
+@app.route('/static/dist/<path:filename>')
+def asset(filename):
+    """Serve a hashed asset, precompressed when the client accepts it, cached forever"""
+    mimetype = mimetypes.guess_type(filename)[0]
+    response = None
+    for encoding, suffix in ASSET_ENCODINGS:
+        path = safe_join(ASSET_DIR, filename + suffix)
+        if request.accept_encodings[encoding] and path and os.path.isfile(path):
+            # send_file hands the open file to the server's wsgi.file_wrapper (sendfile under gunicorn)
+            response = send_from_directory(ASSET_DIR, filename + suffix, mimetype=mimetype,
+                                           max_age=app.config['ASSET_MAX_AGE'])
+            response.content_encoding = encoding
+            break
+    if response is None:
+        response = send_from_directory(ASSET_DIR, filename, mimetype=mimetype, max_age=app.config['ASSET_MAX_AGE'])
+    response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
+
 # Routes
 @app.route('/')
 def index():
-    settings = Settings.query.first()
-    if not settings:
-        settings = Settings()
-        db.session.add(settings)
-        db.session.commit()
+    settings = get_settings()
     return render_template('index.html', settings=settings)
 
 @app.route('/register', methods=['GET', 'POST'])
@@ -214,7 +3501,7 @@ def register():
         flash('Registration successful! Please login.', 'success')
         return redirect(url_for('login'))
     
-    settings = Settings.query.first()
+    settings = get_settings()
     return render_template('register.html', settings=settings)
 
 @app.route('/login', methods=['GET', 'POST'])
@@ -225,16 +3512,18 @@ def login():
         
         user = User.query.filter_by(username=username).first()
         
-        if user and check_password_hash(user.password, password):
+        if user and user.status == 'active' and check_password_hash(user.password, password):
             session['user_id'] = user.id
             session['username'] = user.username
             session['role'] = user.role
+            audit_log.record('auth.login', user_id=user.id, actor_id=user.id, target=user.username)
             flash(f'Welcome back, {user.username}!', 'success')
             return redirect(url_for('dashboard'))
         else:
+            audit_log.record('auth.login_failed', user_id=user.id if user else None, target=(username or '')[:100])
             flash('Invalid username or password', 'danger')
     
-    settings = Settings.query.first()
+    settings = get_settings()
     return render_template('login.html', settings=settings)
 
 @app.route('/logout')
@@ -246,28 +3535,35 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    user = User.query.get(session['user_id'])
+    user = g.user
     vps_list = VPS.query.filter_by(user_id=user.id).all()
+    pending_jobs = ProvisionJob.query.filter(
+        ProvisionJob.user_id == user.id,
+        ProvisionJob.status.in_(['queued', 'running'])
+    ).all()
     system_resources = get_system_resources()
-    settings = Settings.query.first()
+    settings = get_settings()
     
     return render_template('dashboard.html', 
                          user=user, 
                          vps_list=vps_list,
                          system_resources=system_resources,
+                         pending_jobs=pending_jobs,
+                         vps_stats=container_inventory.containers,
                          settings=settings)
 
 @app.route('/profile')
 @login_required
 def profile():
-    user = User.query.get(session['user_id'])
-    settings = Settings.query.first()
-    return render_template('profile.html', user=user, settings=settings)
+    user = g.user
+    settings = get_settings()
+    usage = usage_meter.report(user.id, int(time.time()) - 30 * 86400) if usage_meter.enabled else None
+    return render_template('profile.html', user=user, settings=settings, usage=usage)
 
 @app.route('/update-profile', methods=['POST'])
 @login_required
 def update_profile():
-    user = User.query.get(session['user_id'])
+    user = g.user
     
     email = request.form.get('email')
     theme = request.form.get('theme')
@@ -290,7 +3586,7 @@ def update_profile():
 @app.route('/change-password', methods=['POST'])
 @login_required
 def change_password():
-    user = User.query.get(session['user_id'])
+    user = g.user
     
     current_password = request.form.get('current_password')
     new_password = request.form.get('new_password')
@@ -306,6 +3602,7 @@ def change_password():
     
     user.password = generate_password_hash(new_password)
     db.session.commit()
+    audit_log.record('user.password_change', user_id=user.id, target=user.username)
     
     flash('Password changed successfully', 'success')
     return redirect(url_for('profile'))
@@ -313,16 +3610,11 @@ def change_password():
 # VPS Management Routes
 @app.route('/vps/create', methods=['GET', 'POST'])
 @login_required
+@rate_limited('create')
 def create_vps():
-    user = User.query.get(session['user_id'])
-    settings = Settings.query.first()
-    
-    plans = {
-        'Starter': {'ram': '4GB', 'cpu': '1', 'storage': '10GB', 'price': {'Intel': 42, 'AMD': 83}},
-        'Basic': {'ram': '8GB', 'cpu': '1', 'storage': '10GB', 'price': {'Intel': 96, 'AMD': 164}},
-        'Standard': {'ram': '12GB', 'cpu': '2', 'storage': '10GB', 'price': {'Intel': 192, 'AMD': 320}},
-        'Pro': {'ram': '16GB', 'cpu': '2', 'storage': '10GB', 'price': {'Intel': 220, 'AMD': 340}}
-    }
+    user = g.user
+    settings = get_settings()
+    plans = VPS_PLANS
     
     if request.method == 'POST':
         plan = request.form.get('plan')
@@ -334,30 +3626,24 @@ def create_vps():
         
         cost = plans[plan]['price'][processor]
         
-        if user.credits < cost:
-            flash(f'Insufficient credits. You need {cost} credits but have {user.credits}', 'danger')
+        host = node_scheduler.place(plan)
+        if host is None:
+            flash('No capacity is available for this plan right now, please try again later', 'danger')
             return redirect(url_for('create_vps'))
         
         # Create VPS
-        vps_count = VPS.query.filter_by(user_id=user.id).count() + 1
-        container_name = f"vps-{user.id}-{vps_count}"
-        
-        plan_specs = plans[plan]
-        ram_mb = int(plan_specs['ram'].replace('GB', '')) * 1024
-        cpu = plan_specs['cpu']
+        container_name = next_container_name(user.id)
         
-        # Execute LXC command
-        lxc_cmd = f"lxc launch ubuntu:22.04 {container_name} --config limits.memory={ram_mb}MB --config limits.cpu={cpu} -s btrpool"
-        success, output = execute_lxc_sync(lxc_cmd)
-        
-        if not success:
-            flash(f'Failed to create VPS: {output}', 'danger')
+        # Hold the credits now; they are captured or refunded when the launch finishes
+        reservation = reserve_credits(user.id, cost, reference=f"vps:{container_name}")
+        if reservation is None:
+            db.session.rollback()
+            flash(f'Insufficient credits. You need {cost} credits but have {user.credits}', 'danger')
             return redirect(url_for('create_vps'))
         
-        # Deduct credits
-        user.credits -= cost
+        plan_specs = plans[plan]
+        memory_limit, cpu = plan_limits(plan)
         
-        # Save to database
         new_vps = VPS(
             user_id=user.id,
             container_name=container_name,
@@ -366,23 +3652,54 @@ def create_vps():
             cpu=cpu,
             storage=plan_specs['storage'],
             processor=processor,
-            status='running'
+            status='provisioning',
+            host=host
         )
-        
         db.session.add(new_vps)
+        db.session.flush()
+        
+        job = ProvisionJob(
+            user_id=user.id,
+            vps_id=new_vps.id,
+            container_name=container_name,
+            memory_limit=memory_limit,
+            cpu_limit=cpu,
+            cost=cost,
+            reservation_id=reservation.id
+        )
+        db.session.add(job)
         db.session.commit()
         
-        flash(f'VPS {container_name} created successfully!', 'success')
+        provision_queue.submit(job.id)
+        audit_log.record('vps.create', vps=new_vps, plan=plan, processor=processor, host=host, cost=cost)
+        
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'success': True, 'job_id': job.id, 'vps_id': new_vps.id,
+                            'status_url': url_for('provision_job_status', job_id=job.id)}), 202
+        
+        flash(f'VPS {container_name} is being provisioned (job #{job.id})', 'info')
         return redirect(url_for('dashboard'))
     
-    return render_template('create_vps.html', user=user, plans=plans, settings=settings)
+    return render_template('create_vps.html', user=user, plans=plans, settings=settings,
+                           hourly_billing=usage_meter.enabled)
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required
+def provision_job_status(job_id):
+    job = ProvisionJob.query.get_or_404(job_id)
+    user = g.user
+    
+    if job.user_id != user.id and user.role != 'admin':
+        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    
+    return jsonify({'success': True, 'job': job.to_dict()})
 
 @app.route('/vps/manage/<int:vps_id>')
 @login_required
 def manage_vps(vps_id):
     vps = VPS.query.get_or_404(vps_id)
-    user = User.query.get(session['user_id'])
-    settings = Settings.query.first()
+    user = g.user
+    settings = get_settings()
     
     # Check ownership or admin
     if vps.user_id != user.id and user.role != 'admin':
@@ -394,97 +3711,595 @@ def manage_vps(vps_id):
     
     return render_template('manage_vps.html', vps=vps, user=user, stats=stats, settings=settings)
 
-@app.route('/api/vps/<int:vps_id>/start', methods=['POST'])
+METRIC_RANGES = {'1h': 3600, '6h': 6 * 3600, '24h': 86400, '7d': 7 * 86400, '30d': 30 * 86400}
+
+@app.route('/api/vps/<int:vps_id>/metrics')
 @login_required
-def start_vps(vps_id):
+def vps_metrics(vps_id):
     vps = VPS.query.get_or_404(vps_id)
-    user = User.query.get(session['user_id'])
+    user = g.user
     
     if vps.user_id != user.id and user.role != 'admin':
         return jsonify({'success': False, 'message': 'Access denied'}), 403
     
-    success, output = execute_lxc_sync(f"lxc start {vps.container_name}")
+    range_name = request.args.get('range', '1h')
+    if range_name not in METRIC_RANGES:
+        return jsonify({'success': False, 'message': f"Invalid range, use one of: {', '.join(METRIC_RANGES)}"}), 400
+    
+    resolution, points = metrics_store.history(vps, METRIC_RANGES[range_name])
+    return jsonify({'success': True, 'range': range_name, 'resolution': resolution, 'points': points})
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/stream/stats')
+@login_required
+def stream_stats():
+    """Server-Sent Events stream of host stats and the user's container stats.
+
+    Streams end after STREAM_MAX_DURATION and the browser reconnects, so a
+    stream whose page is gone does not hold its thread for longer than that.
+    """
+    user = g.user
+    
+    vps_id = request.args.get('vps', type=int)
+    if vps_id is not None:
+        vps = VPS.query.get_or_404(vps_id)
+        if vps.user_id != user.id and user.role != 'admin':
+            return jsonify({'success': False, 'message': 'Access denied'}), 403
+        names = {vps.container_name}
+    elif request.args.get('all') and user.role == 'admin':
+        names = None
+    else:
+        names = {name for (name,) in db.session.query(VPS.container_name).filter_by(user_id=user.id)}
+    
+    keepalive = app.config['STREAM_KEEPALIVE']
+    max_duration = app.config['STREAM_MAX_DURATION']
+    
+    lease = rate_limiter.acquire(f"{user.id}:stream", app.config['STREAM_MAX_PER_USER'],
+                                 ttl=max_duration + keepalive + 60)
+    if lease is None:
+        return too_many_requests('Too many open stats streams', keepalive)
+    subscriber = stats_broadcaster.subscribe()
+    if subscriber is None:
+        rate_limiter.release(lease)
+        return jsonify({'success': False, 'message': 'Too many open stats streams, try again shortly'}), 503, \
+            {'Retry-After': str(keepalive)}
+    
+    def container_event(containers):
+        if names is not None:
+            containers = {name: stats for name, stats in containers.items() if name in names}
+        return format_sse('containers', containers)
+    
+    def stream():
+        deadline = time.monotonic() + max_duration
+        yield format_sse('host', host_sampler.latest())
+        yield container_event(container_inventory.containers)
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                event, data = subscriber.get(timeout=min(keepalive, remaining))
+            except queue.Empty:
+                # Also how a closed browser tab is noticed: the write fails
+                yield ': keepalive\n\n'
+                continue
+            yield container_event(data) if event == 'containers' else format_sse(event, data)
+    
+    def close():
+        stats_broadcaster.unsubscribe(subscriber)
+        with app.app_context():
+            rate_limiter.release(lease)
+    
+    response = Response(stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Runs when the server closes the response, even if the stream never started
+    response.call_on_close(close)
+    return response
+
+@app.route('/api/vps/bulk', methods=['POST'])
+@login_required
+@rate_limited('bulk')
+def bulk_vps_action():
+    data = request.get_json(silent=True) or {}
+    action = data.get('action')
+    ids = data.get('ids')
+    
+    if action not in POWER_ACTIONS:
+        return jsonify({'success': False, 'message': f"Invalid action, use one of: {', '.join(POWER_ACTIONS)}"}), 400
+    if not isinstance(ids, list) or not all(isinstance(i, int) for i in ids):
+        return jsonify({'success': False, 'message': 'ids must be a list of VPS ids'}), 400
+    if len(ids) > app.config['BULK_MAX_ITEMS']:
+        return jsonify({'success': False, 'message': f"At most {app.config['BULK_MAX_ITEMS']} VPS per request"}), 400
+    
+    user = g.user
+    if action != 'stop' and out_of_credits(user):
+        return jsonify({'success': False, 'message': 'You are out of credits'}), 402
+    ids = list(dict.fromkeys(ids))
+    vps_by_id = {vps.id: vps for vps in VPS.query.filter(VPS.id.in_(ids)).all()}
+    
+    results = {}
+    runnable = []
+    for vps_id in ids:
+        vps = vps_by_id.get(vps_id)
+        error = ('VPS not found', 404) if vps is None else check_vps_access(vps, user)
+        if error:
+            results[vps_id] = {'id': vps_id, 'success': False, 'message': error[0], 'status_code': error[1]}
+        else:
+            runnable.append((vps_id, vps.container_name, vps.host))
+    
+    new_status, lxc_status = POWER_ACTIONS[action]
+    outcomes = bulk_executor.map(action, runnable)
+    for vps_id, (success, output) in outcomes.items():
+        vps = vps_by_id[vps_id]
+        if success:
+            vps.status = new_status
+            vps.suspended_at = None
+            container_inventory.set_status(vps.container_name, lxc_status)
+            audit_log.record(f"vps.{action}", vps=vps, bulk=True)
+            results[vps_id] = {'id': vps_id, 'success': True, 'message': f'VPS {action} succeeded'}
+        else:
+            status_code = 409 if isinstance(output, ContainerBusy) else 500
+            results[vps_id] = {'id': vps_id, 'success': False, 'message': str(output), 'status_code': status_code}
+    db.session.commit()
+    
+    items = [results[vps_id] for vps_id in ids]
+    succeeded = sum(1 for item in items if item['success'])
+    return jsonify({'success': succeeded == len(items), 'succeeded': succeeded,
+                    'failed': len(items) - succeeded, 'results': items})
+
+@app.route('/api/vps/<int:vps_id>/start', methods=['POST'])
+@login_required
+@rate_limited('power')
+def start_vps(vps_id):
+    vps = VPS.query.get_or_404(vps_id)
+    user = g.user
+    
+    error = check_vps_access(vps, user)
+    if error:
+        return jsonify({'success': False, 'message': error[0]}), error[1]
+    if out_of_credits(user):
+        return jsonify({'success': False, 'message': 'You are out of credits'}), 402
+    
+    try:
+        success, output = lxc_power(vps.container_name, start_action(vps.container_name), vps.host)
+    except ContainerBusy as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
     
     if success:
         vps.status = 'running'
+        vps.suspended_at = None
         db.session.commit()
+        container_inventory.set_status(vps.container_name, 'Running')
+        audit_log.record('vps.start', vps=vps)
         return jsonify({'success': True, 'message': 'VPS started successfully'})
     else:
         return jsonify({'success': False, 'message': output}), 500
 
 @app.route('/api/vps/<int:vps_id>/stop', methods=['POST'])
 @login_required
+@rate_limited('power')
 def stop_vps(vps_id):
     vps = VPS.query.get_or_404(vps_id)
-    user = User.query.get(session['user_id'])
+    user = g.user
     
-    if vps.user_id != user.id and user.role != 'admin':
-        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    error = check_vps_access(vps, user)
+    if error:
+        return jsonify({'success': False, 'message': error[0]}), error[1]
     
-    success, output = execute_lxc_sync(f"lxc stop {vps.container_name}")
+    try:
+        success, output = lxc_power(vps.container_name, 'stop', vps.host)
+    except ContainerBusy as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
     
     if success:
         vps.status = 'stopped'
+        vps.suspended_at = None
         db.session.commit()
+        container_inventory.set_status(vps.container_name, 'Stopped')
+        audit_log.record('vps.stop', vps=vps)
         return jsonify({'success': True, 'message': 'VPS stopped successfully'})
     else:
         return jsonify({'success': False, 'message': output}), 500
 
 @app.route('/api/vps/<int:vps_id>/restart', methods=['POST'])
 @login_required
+@rate_limited('power')
 def restart_vps(vps_id):
     vps = VPS.query.get_or_404(vps_id)
-    user = User.query.get(session['user_id'])
+    user = g.user
     
-    if vps.user_id != user.id and user.role != 'admin':
-        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    error = check_vps_access(vps, user)
+    if error:
+        return jsonify({'success': False, 'message': error[0]}), error[1]
     
-    success, output = execute_lxc_sync(f"lxc restart {vps.container_name}")
+    try:
+        success, output = lxc_power(vps.container_name, 'restart', vps.host)
+    except ContainerBusy as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
     
     if success:
+        audit_log.record('vps.restart', vps=vps)
         return jsonify({'success': True, 'message': 'VPS restarted successfully'})
     else:
         return jsonify({'success': False, 'message': output}), 500
 
 @app.route('/api/vps/<int:vps_id>/delete', methods=['POST'])
 @login_required
+@rate_limited('delete')
 def delete_vps(vps_id):
     vps = VPS.query.get_or_404(vps_id)
-    user = User.query.get(session['user_id'])
+    user = g.user
     
-    if vps.user_id != user.id and user.role != 'admin':
-        return jsonify({'success': False, 'message': 'Access denied'}), 403
+    error = check_vps_access(vps, user)
+    if error:
+        return jsonify({'success': False, 'message': error[0]}), error[1]
     
-    success, output = execute_lxc_sync(f"lxc delete {vps.container_name} --force")
+    try:
+        success, output = lxc_delete(vps.container_name, vps.host)
+    except ContainerBusy as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
     
     if success:
+        backup_queue.purge(vps.id)
         db.session.delete(vps)
         db.session.commit()
+        container_inventory.discard(vps.container_name)
+        audit_log.record('vps.delete', vps=vps)
         return jsonify({'success': True, 'message': 'VPS deleted successfully'})
     else:
         return jsonify({'success': False, 'message': output}), 500
 
+@app.route('/api/vps/<int:vps_id>/snapshots')
+@login_required
+def list_snapshots(vps_id):
+    vps = VPS.query.get_or_404(vps_id)
+    error = check_vps_access(vps, g.user)
+    if error:
+        return jsonify({'success': False, 'message': error[0]}), error[1]
+    
+    success, output = lxc_snapshots(vps.container_name, vps.host)
+    if not success:
+        return jsonify({'success': False, 'message': output}), 500
+    for snapshot in output:
+        snapshot['backup'] = snapshot['name'].startswith('backup-')
+    return jsonify({'success': True, 'snapshots': output, 'limit': app.config['SNAPSHOT_LIMIT']})
+
+@app.route('/api/vps/<int:vps_id>/snapshots', methods=['POST'])
+@login_required
+@rate_limited('snapshot')
+def create_snapshot(vps_id):
+    vps = VPS.query.get_or_404(vps_id)
+    error = check_vps_access(vps, g.user)
+    if error:
+        return jsonify({'success': False, 'message': error[0]}), error[1]
+    
+    success, output = lxc_snapshots(vps.container_name, vps.host)
+    if not success:
+        return jsonify({'success': False, 'message': output}), 500
+    manual = [snapshot for snapshot in output if not snapshot['name'].startswith('backup-')]
+    if len(manual) >= app.config['SNAPSHOT_LIMIT']:
+        return jsonify({'success': False, 'message': f"Snapshot limit of {app.config['SNAPSHOT_LIMIT']} reached, delete one first"}), 409
+    
+    name = f"snap-{datetime.utcnow():%Y%m%d-%H%M%S}"
+    success, output = lxc_snapshot(vps.container_name, name, vps.host)
+    if success:
+        audit_log.record('snapshot.create', vps=vps, snapshot=name)
+        return jsonify({'success': True, 'message': f'Snapshot {name} created', 'name': name})
+    else:
+        return jsonify({'success': False, 'message': output}), 500
+
+@app.route('/api/vps/<int:vps_id>/snapshots/<name>/restore', methods=['POST'])
+@login_required
+@rate_limited('snapshot')
+def restore_snapshot(vps_id, name):
+    vps = VPS.query.get_or_404(vps_id)
+    error = check_vps_access(vps, g.user)
+    if error:
+        return jsonify({'success': False, 'message': error[0]}), error[1]
+    if not SNAPSHOT_NAME.match(name):
+        return jsonify({'success': False, 'message': 'Invalid snapshot name'}), 400
+    
+    try:
+        success, output = lxc_restore(vps.container_name, name, vps.host)
+    except ContainerBusy as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    
+    if success:
+        audit_log.record('snapshot.restore', vps=vps, snapshot=name)
+        return jsonify({'success': True, 'message': f'VPS restored to snapshot {name}'})
+    else:
+        return jsonify({'success': False, 'message': output}), 500
+
+@app.route('/api/vps/<int:vps_id>/snapshots/<name>/delete', methods=['POST'])
+@login_required
+@rate_limited('snapshot')
+def delete_snapshot(vps_id, name):
+    vps = VPS.query.get_or_404(vps_id)
+    error = check_vps_access(vps, g.user)
+    if error:
+        return jsonify({'success': False, 'message': error[0]}), error[1]
+    if not SNAPSHOT_NAME.match(name):
+        return jsonify({'success': False, 'message': 'Invalid snapshot name'}), 400
+    if name.startswith('backup-'):
+        return jsonify({'success': False, 'message': 'Backup snapshots are managed automatically'}), 400
+    
+    success, output = lxc_delete_snapshot(vps.container_name, name, vps.host)
+    if success:
+        audit_log.record('snapshot.delete', vps=vps, snapshot=name)
+        return jsonify({'success': True, 'message': f'Snapshot {name} deleted'})
+    else:
+        return jsonify({'success': False, 'message': output}), 500
+
+@app.route('/api/vps/<int:vps_id>/backups')
+@login_required
+def list_backups(vps_id):
+    vps = VPS.query.get_or_404(vps_id)
+    error = check_vps_access(vps, g.user)
+    if error:
+        return jsonify({'success': False, 'message': error[0]}), error[1]
+    
+    backups = Backup.query.filter_by(vps_id=vps.id).order_by(Backup.id.desc()).all()
+    return jsonify({'success': True, 'backups': [backup.to_dict() for backup in backups]})
+
+@app.route('/api/vps/<int:vps_id>/backups', methods=['POST'])
+@login_required
+@rate_limited('backup')
+def create_backup(vps_id):
+    vps = VPS.query.get_or_404(vps_id)
+    error = check_vps_access(vps, g.user)
+    if error:
+        return jsonify({'success': False, 'message': error[0]}), error[1]
+    
+    if not backup_queue.enqueue(vps):
+        return jsonify({'success': False, 'message': 'A backup of this VPS is already in progress'}), 409
+    audit_log.record('backup.create', vps=vps)
+    return jsonify({'success': True, 'message': 'Backup queued'}), 202
+
+# Web console
+def console_message(ws, message_type, **fields):
+    ws.send(json.dumps({'type': message_type, **fields}))
+
+def same_origin():
+    """Whether the request comes from a page served by this panel, per its Origin header.
+
+    Only the host is compared with request.host_url: behind a TLS-terminating
+    proxy the browser's origin is https:// while the panel sees http://.
+    """
+    return urlsplit(request.headers.get('Origin', '')).netloc == urlsplit(request.host_url).netloc
+
+@sock.route('/api/vps/<int:vps_id>/console')
+def vps_console(ws, vps_id):
+    """Interactive shell in a VPS over a WebSocket.
+
+    The browser sends JSON text frames: {"type": "input", "data": ...} and
+    {"type": "resize", "cols": ..., "rows": ...}. Terminal output comes back as
+    binary frames batched every CONSOLE_FLUSH_INTERVAL; errors and the end of
+    the session arrive as JSON text frames.
+    """
+    # Browsers send the session cookie with cross-site WebSockets too, and send Origin
+    # with every one; without this check any site the user visits could drive the shell
+    if not same_origin():
+        return ws.close(reason=1008, message='Origin not allowed')
+    # The handshake has already completed, so refusals are reported in-band
+    user = g.user
+    if user is None:
+        return console_message(ws, 'error', message='Please login to access this page')
+    vps = db.session.get(VPS, vps_id)
+    if vps is None:
+        return console_message(ws, 'error', message='VPS not found')
+    error = check_vps_access(vps, user)
+    if error:
+        return console_message(ws, 'error', message=error[0])
+    if vps.status != 'running':
+        return console_message(ws, 'error', message='Start the VPS to open a console')
+    try:
+        cols, rows = int(request.args.get('cols', 80)), int(request.args.get('rows', 24))
+    except ValueError:
+        cols, rows = 80, 24
+    
+    user_id, owner_id, container_name, host = user.id, vps.user_id, vps.container_name, vps.host
+    # Return the pooled connection; the socket can stay open for hours
+    db.session.close()
+    
+    try:
+        console, message = console_manager.open(user_id, vps_id, container_name, host, cols, rows)
+    except OSError as e:
+        logger.error(f"Error starting console for {container_name}: {e}")
+        return console_message(ws, 'error', message='Could not start the console')
+    if console is None:
+        return console_message(ws, 'error', message=message)
+    audit_log.record('console.open', user_id=owner_id, vps_id=vps_id, target=container_name, actor_id=user_id)
+    
+    flush_interval = app.config['CONSOLE_FLUSH_INTERVAL']
+    batch_size = app.config['CONSOLE_BATCH_SIZE']
+    reason = 'disconnected'
+    try:
+        while True:
+            # Waiting up to flush_interval for input also collects output into larger frames
+            message = ws.receive(timeout=flush_interval)
+            while message is not None:
+                if isinstance(message, bytes):
+                    console.write(message)
+                else:
+                    try:
+                        payload = json.loads(message)
+                        if payload.get('type') == 'input':
+                            console.write(str(payload.get('data', '')).encode())
+                        elif payload.get('type') == 'resize':
+                            console.resize(int(payload['cols']), int(payload['rows']))
+                    except (ValueError, KeyError, TypeError, AttributeError):
+                        pass
+                message = ws.receive(timeout=0)
+            console.flush_input()
+            
+            # A blocking send to a slow browser stops draining, which in turn pauses the shell
+            output = console.drain(batch_size)
+            if output:
+                ws.send(output)
+            elif console.closed:
+                reason = console.close_reason
+                console_message(ws, 'exit', reason=reason)
+                break
+            elif console.eof:
+                reason = 'exit'
+                console_message(ws, 'exit', reason=reason, code=console.process.wait(timeout=5))
+                break
+    except ConnectionClosed:
+        pass
+    except Exception as e:
+        reason = 'error'
+        logger.error(f"Error in console for {container_name}: {e}")
+    finally:
+        console_manager.close(console, reason)
+        audit_log.record('console.close', user_id=owner_id, vps_id=vps_id, target=container_name, actor_id=user_id,
+                         reason=console.close_reason, duration=round(time.time() - console.started_at))
+
+# Read API (v1)
+API_FIELDS = {
+    'vps': ['id', 'user_id', 'container_name', 'plan', 'ram', 'cpu', 'storage', 'processor', 'status', 'host',
+            'suspended_at', 'version', 'created_at'],
+    'users': ['id', 'username', 'email', 'role', 'credits', 'theme', 'status', 'version', 'created_at'],
+}
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        return int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError('Invalid cursor')
+
+def api_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def conditional_json(etag, build):
+    """Reply 304 when the client's If-None-Match already has `etag`, otherwise jsonify build()"""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    # Clients may keep the body but must revalidate it on every use
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def api_page(model, resource, filters):
+    """One cursor page of `model` rows matching `filters`, with ?fields= selection and an ETag.
+
+    The ETag is derived from the page's ids and row versions, so an unchanged
+    page is answered with 304 Not Modified without serializing anything.
+    """
+    allowed = API_FIELDS[resource]
+    fields = [field.strip() for field in request.args.get('fields', '').split(',') if field.strip()] or allowed
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        return jsonify({'success': False, 'message': f"Unknown fields: {', '.join(unknown)}"}), 400
+    if 'id' not in fields:
+        fields = ['id'] + fields
+    limit = request.args.get('limit', app.config['API_PAGE_SIZE'], type=int)
+    if limit < 1:
+        return jsonify({'success': False, 'message': 'limit must be at least 1'}), 400
+    limit = min(limit, app.config['API_MAX_PAGE_SIZE'])
+    columns = fields if 'version' in fields else fields + ['version']
+    query = db.select(*(getattr(model, column) for column in columns)).where(*filters)
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            query = query.where(model.id > decode_cursor(cursor))
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+    
+    rows = db.session.execute(query.order_by(model.id).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    fingerprint = ','.join(f"{row.id}:{row.version}" for row in rows)
+    etag = hashlib.sha1(f"{resource}|{','.join(fields)}|{has_more}|{fingerprint}".encode()).hexdigest()
+    
+    return conditional_json(etag, lambda: {
+        'success': True,
+        resource: [{field: api_value(getattr(row, field)) for field in fields} for row in rows],
+        'next_cursor': encode_cursor(rows[-1].id) if has_more else None
+    })
+
+@app.route('/api/v1/vps')
+@login_required
+def api_vps():
+    """The user's VPS; admins can list everyone's with ?all=1 or another user's with ?user_id="""
+    user = g.user
+    filters = []
+    user_id = request.args.get('user_id', type=int)
+    if user.role != 'admin' or not (request.args.get('all') or user_id):
+        user_id = user.id
+    if user_id:
+        filters.append(VPS.user_id == user_id)
+    for field in ('status', 'plan', 'host'):
+        if request.args.get(field):
+            filters.append(getattr(VPS, field) == request.args[field])
+    return api_page(VPS, 'vps', filters)
+
+@app.route('/api/v1/users')
+@login_required
+def api_users():
+    if g.user.role != 'admin':
+        return jsonify({'success': False, 'message': 'Admin access required'}), 403
+    filters = [getattr(User, field) == request.args[field] for field in ('role', 'status') if request.args.get(field)]
+    return api_page(User, 'users', filters)
+
+@app.route('/api/v1/usage')
+@login_required
+def api_usage():
+    """Metered usage per VPS over ?days= (default 30); admins can pass ?user_id="""
+    user = g.user
+    if user.role == 'admin' and request.args.get('user_id', type=int):
+        user = db.session.get(User, request.args.get('user_id', type=int))
+        if user is None:
+            return jsonify({'success': False, 'message': 'User not found'}), 404
+    days = request.args.get('days', 30, type=int)
+    if days < 1:
+        return jsonify({'success': False, 'message': 'days must be at least 1'}), 400
+    report = usage_meter.report(user.id, int(time.time()) - days * 86400)
+    return jsonify({'success': True, 'user_id': user.id, 'credits': user.credits,
+                    'unbilled': round(user.unbilled_usage or 0, 2), **report})
+
+@app.route('/api/v1/host')
+@login_required
+def api_host():
+    """Latest host sample (and node capacity for admins); the ETag changes with every new sample"""
+    host_sampler.start()
+    payload = {'success': True, 'host': host_sampler.latest()}
+    if g.user.role == 'admin':
+        payload['nodes'] = node_scheduler.status()
+    etag = hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+    return conditional_json(etag, lambda: payload)
+
 # Admin Routes
 @app.route('/admin')
 @admin_required
 def admin_panel():
-    users = User.query.all()
-    all_vps = VPS.query.all()
     system_resources = get_system_resources()
-    settings = Settings.query.first()
+    settings = get_settings()
+    
+    status_counts = dict(
+        db.session.query(VPS.status, db.func.count(VPS.id)).group_by(VPS.status).all()
+    )
     
     stats = {
-        'total_users': len(users),
-        'total_vps': len(all_vps),
-        'running_vps': len([v for v in all_vps if v.status == 'running']),
-        'stopped_vps': len([v for v in all_vps if v.status == 'stopped'])
+        'total_users': db.session.query(db.func.count(User.id)).scalar(),
+        'total_vps': sum(status_counts.values()),
+        'running_vps': status_counts.get('running', 0),
+        'stopped_vps': status_counts.get('stopped', 0),
+        'suspended_vps': status_counts.get('suspended', 0),
+        'reclaimed_ram_gb': round(idle_suspender.status()['reclaimed_ram_mb'] / 1024, 1)
     }
     
-    user = User.query.get(session['user_id'])
+    user = g.user
     
     return render_template('admin_panel.html', 
                          user=user,
-                         users=users, 
                          stats=stats, 
                          system_resources=system_resources,
                          settings=settings)
@@ -492,10 +4307,24 @@ def admin_panel():
 @app.route('/admin/users')
 @admin_required
 def admin_users():
-    users = User.query.all()
-    settings = Settings.query.first()
-    user = User.query.get(session['user_id'])
-    return render_template('admin_users.html', users=users, settings=settings, user=user)
+    vps_count = (
+        db.session.query(VPS.user_id, db.func.count(VPS.id).label('vps_count'))
+        .group_by(VPS.user_id)
+        .subquery()
+    )
+    query = (
+        db.session.query(User, db.func.coalesce(vps_count.c.vps_count, 0))
+        .outerjoin(vps_count, vps_count.c.user_id == User.id)
+    )
+    rows, prev_cursor, next_cursor = keyset_paginate(query, User.id, app.config['ADMIN_PAGE_SIZE'])
+    users = [usr for usr, _ in rows]
+    vps_counts = {usr.id: count for usr, count in rows}
+    
+    settings = get_settings()
+    user = g.user
+    return render_template('admin_users.html', users=users, vps_counts=vps_counts,
+                         prev_cursor=prev_cursor, next_cursor=next_cursor,
+                         settings=settings, user=user)
 
 @app.route('/admin/user/add', methods=['POST'])
 @admin_required
@@ -518,6 +4347,7 @@ def admin_add_user():
     
     db.session.add(new_user)
     db.session.commit()
+    audit_log.record('user.create', user_id=new_user.id, target=username, role=role)
     
     flash(f'User {username} created successfully', 'success')
     return redirect(url_for('admin_users'))
@@ -528,20 +4358,70 @@ def admin_delete_user(user_id):
     user = User.query.get_or_404(user_id)
     
     # Prevent deleting yourself
-    if user.id == session['user_id']:
+    if user.id == g.user.id:
         flash('Cannot delete your own account', 'danger')
         return redirect(url_for('admin_users'))
     
-    # Delete all VPS owned by this user
-    for vps in user.vps_instances:
-        execute_lxc_sync(f"lxc delete {vps.container_name} --force")
+    if any(vps.status == 'provisioning' for vps in user.vps_instances):
+        flash(f'User {user.username} has a VPS being provisioned, try again shortly', 'warning')
+        return redirect(url_for('admin_users'))
     
-    db.session.delete(user)
-    db.session.commit()
+    # Containers are deleted in the background; the user is purged once they are gone,
+    # possibly before enqueue_user() returns
+    deleted_id, username = user.id, user.username
+    tasks = teardown_queue.enqueue_user(user)
+    audit_log.record('user.delete', user_id=deleted_id, target=username, vps_count=len(tasks))
     
-    flash(f'User {user.username} deleted successfully', 'success')
+    if tasks:
+        flash(f'User {username} marked for deletion; removing {len(tasks)} VPS in the background', 'success')
+    else:
+        flash(f'User {username} deleted successfully', 'success')
     return redirect(url_for('admin_users'))
 
+@app.route('/admin/user/<int:user_id>/teardown')
+@admin_required
+def admin_user_teardown(user_id):
+    tasks = TeardownTask.query.filter_by(user_id=user_id).order_by(TeardownTask.id).all()
+    return jsonify({
+        'success': True,
+        'user_id': user_id,
+        'pending': db.session.query(User.id).filter_by(id=user_id).first() is not None,
+        'tasks': [{
+            'container_name': task.container_name,
+            'status': task.status,
+            'attempts': task.attempts,
+            'error': task.last_error,
+            'finished_at': task.finished_at.isoformat() if task.finished_at else None
+        } for task in tasks]
+    })
+
+@app.route('/admin/user/<int:user_id>/rate-limits', methods=['GET', 'POST'])
+@admin_required
+def admin_user_rate_limits(user_id):
+    user = User.query.get_or_404(user_id)
+    operations = sorted({operation for limits in app.config['RATE_LIMITS'].values() if limits for operation in limits})
+    
+    if request.method == 'POST':
+        overrides = (request.get_json(silent=True) or {}).get('overrides')
+        if not isinstance(overrides, dict):
+            return jsonify({'success': False, 'message': 'overrides must be an object'}), 400
+        for key, value in overrides.items():
+            if key == 'concurrent':
+                valid = value is None or (isinstance(value, int) and value >= 0)
+            elif key in operations:
+                valid = value is None or (isinstance(value, list) and len(value) == 2 and
+                                          all(isinstance(v, (int, float)) and v > 0 for v in value))
+            else:
+                return jsonify({'success': False, 'message': f"Unknown operation: {key}"}), 400
+            if not valid:
+                return jsonify({'success': False, 'message': f"Invalid limit for {key}"}), 400
+        user.rate_limit_overrides = json.dumps(overrides) if overrides else None
+        db.session.commit()
+        audit_log.record('user.rate_limits', user_id=user.id, target=user.username, overrides=overrides)
+    
+    return jsonify({'success': True, 'overrides': rate_limit_overrides(user),
+                    'limits': {operation: rate_limit_for(user, operation) for operation in operations}})
+
 @app.route('/admin/user/<int:user_id>/credits', methods=['POST'])
 @admin_required
 def admin_manage_credits(user_id):
@@ -549,23 +4429,88 @@ def admin_manage_credits(user_id):
     action = request.form.get('action')
     amount = int(request.form.get('amount', 0))
     
+    applied = None
     if action == 'add':
-        user.credits += amount
+        applied = adjust_credits(user.id, amount, 'admin_add', actor_id=g.user.id)
         flash(f'Added {amount} credits to {user.username}', 'success')
     elif action == 'remove':
-        user.credits = max(0, user.credits - amount)
-        flash(f'Removed {amount} credits from {user.username}', 'success')
+        applied = adjust_credits(user.id, -amount, 'admin_remove', actor_id=g.user.id)
+        flash(f'Removed {-applied} credits from {user.username}', 'success')
     
     db.session.commit()
+    if applied is not None:
+        audit_log.record(f'credits.{action}', user_id=user.id, target=user.username, amount=applied)
     return redirect(url_for('admin_users'))
 
 @app.route('/admin/vps')
 @admin_required
 def admin_vps_list():
-    all_vps = VPS.query.all()
-    settings = Settings.query.first()
-    user = User.query.get(session['user_id'])
-    return render_template('admin_vps_list.html', vps_list=all_vps, settings=settings, user=user)
+    query = VPS.query.options(joinedload(VPS.owner))
+    all_vps, prev_cursor, next_cursor = keyset_paginate(query, VPS.id, app.config['ADMIN_PAGE_SIZE'])
+    settings = get_settings()
+    user = g.user
+    return render_template('admin_vps_list.html', vps_list=all_vps, vps_stats=container_inventory.containers,
+                         prev_cursor=prev_cursor, next_cursor=next_cursor,
+                         settings=settings, user=user)
+
+@app.route('/admin/audit')
+@admin_required
+def admin_audit():
+    """Audit events, newest first, filtered by user, VPS, action and time range"""
+    args = {key: request.args.get(key, '').strip() for key in ('user', 'vps', 'action', 'since', 'until')}
+    filters = []
+    
+    if args['user']:
+        user_id = int(args['user']) if args['user'].isdigit() else \
+            db.session.query(User.id).filter_by(username=args['user']).scalar()
+        if user_id is not None:
+            filters.append(db.or_(AuditEvent.user_id == user_id, AuditEvent.actor_id == user_id))
+        else:
+            filters.append(AuditEvent.target == args['user'])  # a user that has since been deleted
+    if args['vps']:
+        filters.append(AuditEvent.vps_id == int(args['vps']) if args['vps'].isdigit()
+                       else AuditEvent.target == args['vps'])
+    if args['action']:
+        filters.append(AuditEvent.action.startswith(args['action']))
+    for key in ('since', 'until'):
+        if args[key]:
+            try:
+                moment = datetime.fromisoformat(args[key])
+                filters.append(AuditEvent.created_at >= moment if key == 'since' else AuditEvent.created_at < moment)
+            except ValueError:
+                flash(f"Invalid {key} time, use YYYY-MM-DD or YYYY-MM-DDTHH:MM", 'warning')
+                args[key] = ''
+    
+    page_size = app.config['ADMIN_PAGE_SIZE']
+    query = AuditEvent.query.filter(*filters)
+    before = request.args.get('before', type=int)
+    if before is not None:
+        query = query.filter(AuditEvent.id < before)
+    events = query.order_by(AuditEvent.id.desc()).limit(page_size + 1).all()
+    next_before = events[page_size - 1].id if len(events) > page_size else None
+    events = events[:page_size]
+    
+    user_ids = {event.actor_id for event in events} | {event.user_id for event in events}
+    usernames = dict(db.session.query(User.id, User.username).filter(User.id.in_(user_ids - {None})).all())
+    filter_args = {key: value for key, value in args.items() if value}
+    return render_template('admin_audit.html', events=events, usernames=usernames, filters=args,
+                           filter_args=filter_args, before=before, next_before=next_before,
+                           settings=get_settings(), user=g.user)
+
+@app.route('/admin/warm-pool')
+@admin_required
+def admin_warm_pool():
+    return jsonify({'success': True, 'pools': warm_pool.status()})
+
+@app.route('/admin/idle')
+@admin_required
+def admin_idle():
+    return jsonify({'success': True, **idle_suspender.status()})
+
+@app.route('/admin/nodes')
+@admin_required
+def admin_nodes():
+    return jsonify({'success': True, 'policy': node_scheduler.policy, 'nodes': node_scheduler.status()})
 
 @app.route('/admin/settings', methods=['GET', 'POST'])
 @admin_required
@@ -581,19 +4526,43 @@ def admin_settings():
         settings.logo_url = request.form.get('logo_url', settings.logo_url)
         settings.background_url = request.form.get('background_url', settings.background_url)
         settings.welcome_text = request.form.get('welcome_text', settings.welcome_text)
+        settings.version = (settings.version or 0) + 1
         
         db.session.commit()
+        audit_log.record('settings.update', panel_name=settings.panel_name)
+        settings_cache.invalidate()
         flash('Settings updated successfully', 'success')
         return redirect(url_for('admin_settings'))
     
-    user = User.query.get(session['user_id'])
+    user = g.user
     return render_template('admin_settings.html', settings=settings, user=user)
 
+@app.route('/metrics')
+def prometheus_metrics():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics_registry.render(), content_type=instrumentation.CONTENT_TYPE)
+
 # Initialize database
 def init_db():
     with app.app_context():
         db.create_all()
         
+        # create_all() skips existing tables, so add any columns and indexes they are missing
+        inspector = db.inspect(db.engine)
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=db.engine.dialect)
+                    default = f" DEFAULT {column.server_default.arg}" if column.server_default is not None else ''
+                    with db.engine.begin() as conn:
+                        conn.execute(db.text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}{default}'))
+                    logger.info(f"Added column {table.name}.{column.name}")
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
+        
         # Create default settings if not exists
         if not Settings.query.first():
             settings = Settings()
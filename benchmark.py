@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Load-testing benchmark for GVM Panel
+Runs the panel's routes in-process against a fake LXC backend with
+configurable latency, on a throwaway database seeded with users and VPS,
+and reports latency percentiles, throughput and SQL queries per request.
+
+Usage: python benchmark.py [--users 50] [--vps-per-user 4] [--requests 500]
+                           [--concurrency 8] [--lxc-latency 0.05]
+                           [--scenarios dashboard,power] [--output baseline.json]
+                           [--compare baseline.json]
+"""
+
+import argparse
+import json
+import os
+import random
+import shlex
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from werkzeug.security import generate_password_hash
+
+PASSWORD = 'benchmark'
+
+# The app reads DATABASE_URL and LXD_SOCKET when it is imported, so every function
+# below imports it lazily; main() sets up the environment first.
+
+
+class FakeLXC:
+    """In-memory stand-in for the lxc CLI that tracks container state.
+
+    Containers on other LXD nodes are addressed as `node:name`, like lxc remotes;
+    containers added without a host live on the default node.
+    """
+
+    def __init__(self, latency=0.05, jitter=0.2):
+        self.latency = latency
+        self.jitter = jitter
+        self.containers = {}
+        self.commands = 0
+        self._lock = threading.Lock()
+
+    def add(self, name, status='Running', host=None):
+        self.containers[name] = {'status': status, 'config': {}, 'host': host, 'snapshots': {}}
+
+    def _sleep(self):
+        if self.latency:
+            time.sleep(self.latency * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    @staticmethod
+    def _target(arg):
+        """Split an lxc target into (host, name); unprefixed targets are on the default node"""
+        host, _, name = arg.rpartition(':')
+        return host or None, name
+
+    def _listing(self, host=None):
+        return [{
+            'name': name,
+            'status': container['status'],
+            'config': container['config'],
+            'state': {
+                'status': container['status'],
+                'memory': {'usage': random.randint(64, 2048) * 1024 * 1024 if container['status'] == 'Running' else 0},
+                'cpu': {'usage': random.randint(10 ** 9, 10 ** 12)},
+            },
+        } for name, container in self.containers.items() if container['host'] == host]
+
+    def _query(self, target):
+        """`lxc query [node:]/1.0/instances/<name>/snapshots?recursion=1`"""
+        remote, _, path = target.partition('/')
+        parts = path.partition('?')[0].split('/')
+        if parts[:2] != ['1.0', 'instances'] or len(parts) != 4 or parts[3] != 'snapshots':
+            return False, f"Error: Unsupported query {target}"
+        container = self.containers.get(parts[2])
+        if container is None or container['host'] != (remote.rstrip(':') or None):
+            return False, 'Error: Instance not found'
+        return True, json.dumps([{'name': f"{parts[2]}/{snapshot}", 'created_at': created_at}
+                                 for snapshot, created_at in container['snapshots'].items()])
+
+    def execute(self, command, timeout=120):
+        """Drop-in replacement for app.execute_lxc_sync"""
+        args = shlex.split(command)
+        self._sleep()
+        with self._lock:
+            self.commands += 1
+            verb = args[1]
+            if verb == 'list':
+                host = args[2][:-1] if len(args) > 2 and args[2].endswith(':') else None
+                return True, json.dumps(self._listing(host))
+            if verb == 'query':
+                return self._query(args[2])
+            if verb in ('launch', 'init'):
+                host, name = self._target(args[3])
+                if name in self.containers:
+                    return False, f"Error: Instance {name} already exists"
+                self.add(name, 'Running' if verb == 'launch' else 'Stopped', host)
+                return True, ''
+            host, name = self._target(args[3] if verb == 'config' else args[2])
+            name, _, snapshot = name.partition('/')
+            container = self.containers.get(name)
+            if container is None or container['host'] != host:
+                return False, 'Error: Instance not found'
+            if verb in ('start', 'restart'):
+                container['status'] = 'Running'
+            elif verb == 'stop':
+                container['status'] = 'Stopped'
+            elif verb in ('freeze', 'unfreeze'):
+                expected = 'Running' if verb == 'freeze' else 'Frozen'
+                if container['status'] != expected:
+                    return False, f"Error: The instance is not {expected.lower()}"
+                container['status'] = 'Frozen' if verb == 'freeze' else 'Running'
+            elif verb == 'delete' and snapshot:
+                if container['snapshots'].pop(snapshot, None) is None:
+                    return False, 'Error: Snapshot not found'
+            elif verb == 'delete':
+                del self.containers[name]
+            elif verb == 'move':
+                self.containers[self._target(args[3])[1]] = self.containers.pop(name)
+            elif verb == 'config':
+                container['config'].update(arg.split('=', 1) for arg in args[4:])
+            elif verb == 'snapshot':
+                if args[3] in container['snapshots']:
+                    return False, f"Error: Snapshot {args[3]} already exists"
+                container['snapshots'][args[3]] = datetime.now(timezone.utc).isoformat()
+            elif verb == 'restore':
+                if args[3] not in container['snapshots']:
+                    return False, 'Error: Snapshot not found'
+            else:
+                return False, f"Error: Unsupported command {verb}"
+            return True, ''
+
+
+def install_fakes(fake):
+    """Swap the LXC command runner and host metric readers for deterministic fakes"""
+    import app as panel
+    panel.execute_lxc_sync = fake.execute
+    sampler = panel.host_sampler
+    sampler._read_cpu_usage = lambda: random.uniform(5, 60)
+    sampler._read_ram_usage = lambda: random.uniform(20, 80)
+    sampler._read_disk_usage = lambda: 42.0
+    # Keep the warm pool out of the numbers unless a scenario needs it
+    panel.warm_pool.targets = {}
+    # Measure the routes themselves, not the per-user throttling in front of them
+    panel.app.config['RATE_LIMITS'] = {'user': None, 'admin': None}
+    panel.app.config['OPERATION_QUOTAS'] = {}
+
+
+def seed(fake, users, vps_per_user):
+    """Create an admin plus `users` users with `vps_per_user` running VPS each"""
+    import app as panel
+    from app import app, db, User, VPS, init_db
+    init_db()
+    password = generate_password_hash(PASSWORD)
+    with app.app_context():
+        db.session.add(User(username='admin', email='admin@bench.local', password=password,
+                            role='admin', credits=10 ** 9))
+        for i in range(users):
+            db.session.add(User(username=f"user{i}", email=f"user{i}@bench.local", password=password,
+                                credits=10 ** 9))
+        db.session.commit()
+
+        user_ids = [user_id for (user_id,) in db.session.execute(
+            db.select(User.id).where(User.role == 'user').order_by(User.id))]
+        plan = panel.VPS_PLANS['Starter']
+        for user_id in user_ids:
+            for n in range(vps_per_user):
+                name = f"bench-{user_id}-{n}"
+                db.session.add(VPS(user_id=user_id, container_name=name, plan='Starter', ram=plan['ram'],
+                                   cpu=plan['cpu'], storage=plan['storage'], processor='Intel',
+                                   status='running', host=panel.DEFAULT_NODE))
+                fake.add(name)
+        db.session.commit()
+        vps_by_user = {}
+        for vps_id, user_id in db.session.execute(db.select(VPS.id, VPS.user_id)):
+            vps_by_user.setdefault(user_id, []).append(vps_id)
+    return user_ids, vps_by_user
+
+
+def count_queries(response):
+    import app as panel
+    response.headers['X-Bench-Queries'] = str(panel.g.get('db_queries', 0))
+    return response
+
+
+def logged_in_client(username):
+    from app import app
+    client = app.test_client()
+    response = client.post('/login', data={'username': username, 'password': PASSWORD})
+    if response.status_code != 302:
+        raise RuntimeError(f"Could not log in as {username}")
+    return client
+
+
+# Scenarios: setup(worker) returns per-thread state, request(state, i) returns a response
+def scenario_login(ctx):
+    from app import app
+    return (lambda worker: app.test_client(),
+            lambda client, i: client.post('/login', data={'username': f"user{i % ctx['users']}",
+                                                           'password': PASSWORD}))
+
+
+def scenario_dashboard(ctx):
+    return (lambda worker: logged_in_client(f"user{worker % ctx['users']}"),
+            lambda client, i: client.get('/dashboard'))
+
+
+def scenario_create(ctx):
+    return (lambda worker: logged_in_client(f"user{worker % ctx['users']}"),
+            lambda client, i: client.post('/vps/create', data={'plan': 'Starter', 'processor': 'Intel'},
+                                          headers={'Accept': 'application/json'}))
+
+
+def scenario_power(ctx):
+    def setup(worker):
+        user_index = worker % ctx['users']
+        return logged_in_client(f"user{user_index}"), ctx['vps_by_user'][ctx['user_ids'][user_index]]
+
+    def run(state, i):
+        client, vps_ids = state
+        action = 'stop' if (i // len(vps_ids)) % 2 == 0 else 'start'
+        return client.post(f"/api/vps/{vps_ids[i % len(vps_ids)]}/{action}")
+
+    return setup, run
+
+
+def scenario_admin(ctx):
+    pages = ['/admin', '/admin/users', '/admin/vps']
+    return (lambda worker: logged_in_client('admin'),
+            lambda client, i: client.get(pages[i % len(pages)]))
+
+
+SCENARIOS = {
+    'login': scenario_login,
+    'dashboard': scenario_dashboard,
+    'create': scenario_create,
+    'power': scenario_power,
+    'admin': scenario_admin,
+}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_scenario(name, ctx, total_requests, concurrency):
+    setup, request_fn = SCENARIOS[name](ctx)
+    latencies = []
+    queries = []
+    errors = [0]
+    counter = iter(range(total_requests))
+    counter_lock = threading.Lock()
+    results_lock = threading.Lock()
+
+    def worker(worker_id):
+        state = setup(worker_id)
+        while True:
+            with counter_lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            started = time.perf_counter()
+            response = request_fn(state, i)
+            elapsed = time.perf_counter() - started
+            with results_lock:
+                latencies.append(elapsed)
+                queries.append(int(response.headers.get('X-Bench-Queries', 0)))
+                if response.status_code >= 400:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughput': round(len(latencies) / wall, 1) if wall else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else 0.0,
+    }
+
+
+def wait_for_provisioning(timeout=120):
+    """Wait until queued launches finish; returns the number still pending"""
+    import app as panel
+    from app import app
+    deadline = time.time() + timeout
+    with app.app_context():
+        while True:
+            pending = panel.ProvisionJob.query.filter(panel.ProvisionJob.status.in_(['queued', 'running'])).count()
+            if not pending or time.time() > deadline:
+                return pending
+            time.sleep(0.2)
+
+
+def print_report(results, baseline=None):
+    header = f"{'scenario':<12}{'requests':>9}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'queries':>9}"
+    print(header)
+    print('-' * len(header))
+    for name, result in results.items():
+        print(f"{name:<12}{result['requests']:>9}{result['errors']:>8}{result['throughput']:>10}"
+              f"{result['p50_ms']:>10}{result['p99_ms']:>10}{result['queries_per_request']:>9}")
+        previous = (baseline or {}).get(name)
+        if previous:
+            deltas = []
+            for key in ('throughput', 'p50_ms', 'p99_ms', 'queries_per_request'):
+                if previous.get(key):
+                    change = 100.0 * (result[key] - previous[key]) / previous[key]
+                    deltas.append(f"{key} {change:+.1f}%")
+            print(f"{'':<12}vs baseline: {', '.join(deltas)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark GVM Panel routes against a fake LXC backend')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--vps-per-user', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=500, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--lxc-latency', type=float, default=0.05, help='seconds per fake lxc command')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--output', help='write results as JSON, e.g. to keep as a baseline')
+    parser.add_argument('--compare', help='baseline JSON from a previous --output run')
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(unknown)}")
+
+    # Unless told otherwise, run against a scratch database and an LXD socket that does
+    # not exist, so every LXC operation goes through the (faked) lxc CLI path
+    workdir = tempfile.mkdtemp(prefix='gvm-bench-')
+    os.environ.setdefault('DATABASE_URL', f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+    os.environ.setdefault('LXD_SOCKET', os.path.join(workdir, 'missing.socket'))
+    from app import app
+
+    fake = FakeLXC(latency=args.lxc_latency)
+    install_fakes(fake)
+    app.after_request(count_queries)
+    user_ids, vps_by_user = seed(fake, args.users, args.vps_per_user)
+    ctx = {'users': args.users, 'user_ids': user_ids, 'vps_by_user': vps_by_user}
+
+    print(f"Seeded {args.users} users with {args.users * args.vps_per_user} VPS into {os.environ['DATABASE_URL']}")
+    print(f"{args.requests} requests per scenario, concurrency {args.concurrency}, "
+          f"fake lxc latency {args.lxc_latency * 1000:.0f} ms\n")
+
+    results = {}
+    for name in names:
+        results[name] = run_scenario(name, ctx, args.requests, args.concurrency)
+        if name == 'create':
+            pending = wait_for_provisioning()
+            if pending:
+                print(f"⚠️  {pending} provision jobs still pending")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f).get('results')
+    print_report(results, baseline)
+    print(f"\nFake lxc commands executed: {fake.commands}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Static asset build for GVM Panel
+Minifies the CSS and JS under static/, writes content-hashed copies to
+static/dist/ with gzip (and brotli, when the `brotli` package is installed)
+variants next to them, and records source -> hashed name in
+static/dist/manifest.json. The panel rewrites url_for('static', ...) through
+the manifest and serves the hashed files with immutable cache headers.
+
+It also pins the third-party files the templates load from a CDN: each URL in
+CDN_ASSETS is fetched once and its subresource integrity hash recorded in
+static/dist/integrity.json, which the templates emit as integrity="...".
+
+Usage: python build_assets.py [--static-dir static] [--no-minify]
+Run it on every deploy, before starting the panel.
+"""
+
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import os
+import re
+import urllib.request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSET_EXTENSIONS = ('.css', '.js')
+DIST_DIR = 'dist'
+MANIFEST = 'manifest.json'
+INTEGRITY = 'integrity.json'
+HASH_LENGTH = 12
+
+# Versioned CDN files referenced by the templates. These are the files as published on npm;
+# the .min variants jsDelivr generates on request aren't guaranteed to stay byte-identical.
+CDN_ASSETS = (
+    'https://cdn.jsdelivr.net/npm/@xterm/xterm@5.5.0/css/xterm.css',
+    'https://cdn.jsdelivr.net/npm/@xterm/xterm@5.5.0/lib/xterm.js',
+    'https://cdn.jsdelivr.net/npm/@xterm/addon-fit@0.10.0/lib/addon-fit.js',
+)
+
+CSS_STRING_OR_COMMENT = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|/\*.*?\*/', re.S)
+
+
+def minify_css(source):
+    """Strip comments and insignificant whitespace, leaving quoted strings untouched"""
+    parts = []
+    for i, chunk in enumerate(CSS_STRING_OR_COMMENT.split(source)):
+        if chunk is None:
+            continue
+        if i % 2:  # a quoted string
+            parts.append(chunk)
+            continue
+        chunk = re.sub(r'\s+', ' ', chunk)
+        # Whitespace before ':' is a descendant combinator in selectors like `a ::before`, so keep it
+        chunk = re.sub(r'\s*([{};,>])\s*', r'\1', chunk)
+        chunk = re.sub(r':\s+', ':', chunk)
+        parts.append(chunk.replace(';}', '}'))
+    return ''.join(parts).strip()
+
+
+def minify_js(source):
+    """Conservative line-level minification: drop comment-only lines, blank lines and indentation.
+
+    Lines inside template literals are kept verbatim. Statements are never
+    joined, so automatic semicolon insertion behaves exactly as before.
+    """
+    lines = []
+    in_template = False
+    for line in source.splitlines():
+        stripped = line.strip()
+        if in_template:
+            lines.append(line)
+        elif stripped and not stripped.startswith('//'):
+            lines.append(stripped)
+        if line.replace('\\`', '').count('`') % 2:
+            in_template = not in_template
+    return '\n'.join(lines) + '\n'
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+
+def hashed_name(path, content):
+    root, ext = os.path.splitext(path)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def integrity(content):
+    """Subresource integrity value for a file's bytes"""
+    return f"sha384-{base64.b64encode(hashlib.sha384(content).digest()).decode('ascii')}"
+
+
+def fetch(url, timeout=30):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.read()
+
+
+def build_integrity(dist_dir, urls=CDN_ASSETS):
+    """Pin the integrity hash of every CDN file and return url -> hash
+
+    A URL pinned by an earlier build keeps its hash: the URLs are versioned, so
+    their bytes must never change, and refetching would trust the CDN again.
+    """
+    path = os.path.join(dist_dir, INTEGRITY)
+    try:
+        with open(path) as f:
+            pinned = json.load(f)
+    except FileNotFoundError:
+        pinned = {}
+
+    hashes = {}
+    for url in urls:
+        if url in pinned:
+            hashes[url] = pinned[url]
+            continue
+        try:
+            hashes[url] = integrity(fetch(url))
+        except OSError as e:
+            print(f"⚠️  Cannot fetch {url}, it will load without an integrity check: {e}")
+            continue
+        print(f"   {url} -> {hashes[url]}")
+
+    write_file(path, json.dumps(hashes, indent=2, sort_keys=True).encode('utf-8'))
+    return hashes
+
+
+def build(static_dir, minify=True):
+    """Build every asset and return the manifest"""
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    manifest = {}
+
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != dist_dir)
+        for filename in sorted(files):
+            ext = os.path.splitext(filename)[1]
+            if ext not in ASSET_EXTENSIONS:
+                continue
+            source_path = os.path.join(root, filename)
+            name = os.path.relpath(source_path, static_dir).replace(os.sep, '/')
+            with open(source_path, encoding='utf-8') as f:
+                text = f.read()
+            content = (MINIFIERS[ext](text) if minify else text).encode('utf-8')
+
+            target = hashed_name(name, content)
+            target_path = os.path.join(dist_dir, target)
+            write_file(target_path, content)
+            # mtime=0 keeps the gzip bytes identical across builds of the same content
+            write_file(f"{target_path}.gz", gzip.compress(content, compresslevel=9, mtime=0))
+            if brotli:
+                write_file(f"{target_path}.br", brotli.compress(content, quality=11))
+            manifest[name] = target
+            print(f"   {name} -> {DIST_DIR}/{target} ({len(text.encode('utf-8'))} -> {len(content)} bytes)")
+
+    # Hashed files from earlier builds are left in place for pages rendered before a restart;
+    # the manifest is replaced last and atomically
+    write_file(os.path.join(dist_dir, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build fingerprinted, precompressed static assets')
+    parser.add_argument('--static-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+    parser.add_argument('--no-minify', action='store_true', help='hash and compress the files as they are')
+    args = parser.parse_args()
+
+    manifest = build(args.static_dir, minify=not args.no_minify)
+    hashes = build_integrity(os.path.join(args.static_dir, DIST_DIR))
+    print(f"✅ Built {len(manifest)} assets into {os.path.join(args.static_dir, DIST_DIR)}, "
+          f"pinned {len(hashes)}/{len(CDN_ASSETS)} CDN files")
+    if brotli is None:
+        print("⚠️  brotli is not installed; only gzip variants were written (pip install brotli)")
+
+
+if __name__ == '__main__':
+    main()
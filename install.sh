@@ -52,6 +52,7 @@ python3 -m venv venv
 source venv/bin/activate
 pip install --upgrade pip
 pip install -r requirements.txt
+python build_assets.py
 
 # Create systemd service
 echo "[6/6] Creating systemd service..."
@@ -65,7 +66,12 @@ Type=simple
 User=root
 WorkingDirectory=$APP_DIR
 Environment="PATH=$APP_DIR/venv/bin"
-ExecStart=$APP_DIR/venv/bin/python $APP_DIR/app.py
+# Workers add up their metrics through files here; systemd empties it on every restart
+RuntimeDirectory=gvm-panel
+Environment="METRICS_DIR=/run/gvm-panel/metrics"
+ExecStartPre=$APP_DIR/venv/bin/python -c "from app import init_db; init_db()"
+# Threaded workers: live stats streams and web consoles each hold a thread while open
+ExecStart=$APP_DIR/venv/bin/gunicorn -k gthread --workers 4 --threads 64 --bind 0.0.0.0:5000 app:app
 Restart=always
 RestartSec=10
 
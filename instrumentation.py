@@ -0,0 +1,297 @@
+"""
+GVM Panel - Prometheus instrumentation
+Counters, gauges and histograms rendered in the Prometheus text exposition
+format. Counter and histogram series are pre-allocated per label set and
+updated without locks, so they are cheap enough to leave on in production; a
+rare lost increment under thread contention is acceptable for monitoring.
+Gauges moved with inc()/dec() take a lock, since a lost update there would
+leave the value wrong for good.
+
+Worker processes that share a metrics directory each dump their values there,
+and a scrape of any of them adds up counters and histograms of all processes,
+including ones that have exited, so totals never go backwards. Gauges are
+rendered per live process with a `pid` label.
+"""
+
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; covers fast page renders up to the 120 s LXC command timeout
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def values(self):
+        """{label_values: value} of this process"""
+        return {}
+
+    def merge(self, processes):
+        """Combine {pid: values} of several processes into the values to render"""
+        total = {}
+        for values in processes.values():
+            for key, value in values.items():
+                total[key] = total.get(key, 0) + value
+        return total
+
+    def samples(self, values=None, labels=None):
+        values = self.values() if values is None else values
+        labels = self.labels if labels is None else labels
+        return [f"{self.name}{_format_labels(labels, key)} {_format_value(value)}"
+                for key, value in values.items()]
+
+    def render(self):
+        return self.header() + self.samples()
+
+
+class Counter(Metric):
+    """Monotonic counter"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        values = self._values
+        if label_values not in values:
+            values.setdefault(label_values, 0)
+        values[label_values] += amount
+
+    def values(self):
+        return dict(list(self._values.items()))
+
+
+class Gauge(Metric):
+    """Value read at scrape time from `collect`, which returns {label_values: value}"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labels=(), collect=None):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, value, *label_values):
+        with self._lock:
+            self._values[label_values] = value
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+    def values(self):
+        if self.collect:
+            return self.collect()
+        with self._lock:
+            return dict(self._values)
+
+    def merge(self, processes):
+        # Adding up e.g. the inventory age of several processes means nothing
+        return {key + (str(pid),): value for pid, values in processes.items() for key, value in values.items()}
+
+    def samples(self, values=None, labels=None):
+        if values is not None and labels is None:
+            labels = self.labels + ('pid',)
+        return super().samples(values, labels)
+
+
+class Histogram(Metric):
+    """Bucketed distribution; each series is one pre-allocated list of bucket counts"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            # Bucket counts, then the +Inf count, then the sum
+            series = self._series.setdefault(label_values, [0] * (len(self.buckets) + 1) + [0.0])
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def values(self):
+        return {key: list(series) for key, series in list(self._series.items())}
+
+    def merge(self, processes):
+        total = {}
+        for values in processes.values():
+            for key, series in values.items():
+                if key in total:
+                    total[key] = [a + b for a, b in zip(total[key], series)]
+                else:
+                    total[key] = list(series)
+        return total
+
+    def samples(self, values=None, labels=None):
+        lines = []
+        for key, series in (self.values() if values is None else values).items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                labels = _format_labels(self.labels, key, f'le="{_format_value(float(bound))}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together on /metrics.
+
+    With a `directory`, start() dumps this process's values to its own file
+    there every `interval` seconds and when the process exits, and render()
+    merges them with the files of the other processes.
+    """
+
+    def __init__(self, directory=None, interval=5):
+        self.metrics = []
+        self.directory = directory
+        self.interval = interval
+        self._path = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=(), collect=None):
+        return self.register(Gauge(name, documentation, labels, collect))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def dump(self):
+        """Write this process's values to its file in `directory`"""
+        values = {metric.name: [[list(key), value] for key, value in metric.values().items()]
+                  for metric in self.metrics}
+        os.makedirs(self.directory, exist_ok=True)
+        # Replace the file whole so a scrape never reads half of it
+        with open(f"{self._path}.tmp", 'w') as f:
+            json.dump(values, f)
+        os.replace(f"{self._path}.tmp", self._path)
+
+    def _processes(self):
+        """{'<pid>-<id>': {metric name: values}} dumped by the other processes; exited ones keep their file"""
+        processes = {}
+        try:
+            filenames = os.listdir(self.directory)
+        except FileNotFoundError:
+            return processes
+        for filename in filenames:
+            path = os.path.join(self.directory, filename)
+            if not filename.endswith('.json') or path == self._path:
+                continue
+            try:
+                with open(path) as f:
+                    dumped = json.load(f)
+            except (OSError, ValueError):
+                continue
+            # Files are named <pid>-<random>.json, so a reused pid doesn't overwrite an exited process's counts
+            processes[filename[:-len('.json')]] = {
+                name: {tuple(key): value for key, value in series} for name, series in dumped.items()
+            }
+        return processes
+
+    def render(self):
+        lines = []
+        if not self.directory:
+            for metric in self.metrics:
+                lines.extend(metric.render())
+            return '\n'.join(lines) + '\n'
+        
+        processes = self._processes()
+        own = os.path.basename(self._path)[:-len('.json')] if self._path else str(os.getpid())
+        running = {process for process in list(processes) + [own] if _running(_pid(process))}
+        for metric in self.metrics:
+            values = {process: dumped.get(metric.name, {}) for process, dumped in processes.items()}
+            values[own] = metric.values()
+            if metric.kind == 'gauge':
+                values = {_pid(process): series for process, series in values.items() if process in running}
+            lines.extend(metric.header() + metric.samples(metric.merge(values)))
+        return '\n'.join(lines) + '\n'
+
+    def _save(self):
+        try:
+            self.dump()
+        except OSError:
+            # Scrapes show this process's last dump until the directory is writable again
+            pass
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self._save()
+
+    def start(self):
+        """Start dumping this process's values if metrics are shared through `directory`"""
+        if not self.directory:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._path = os.path.join(self.directory, f"{self._pid}-{uuid.uuid4().hex[:8]}.json")
+            self._save()
+            threading.Thread(target=self._run, name='metrics-dump', daemon=True).start()
+        atexit.register(self._save)
+
+
+def _pid(process):
+    return int(process.partition('-')[0])
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
@@ -0,0 +1,248 @@
+"""
+GVM Panel - LXD REST API client
+Talks to LXD daemons over the local unix socket (or HTTPS for remote nodes)
+with pooled keep-alive connections, instead of forking the lxc CLI for every
+operation.
+"""
+
+import http.client
+import json
+import os
+import queue
+import socket
+import ssl
+from urllib.parse import quote, urlparse
+
+# Socket locations for the deb and snap packages of LXD
+DEFAULT_SOCKET_PATHS = [
+    '/var/lib/lxd/unix.socket',
+    '/var/snap/lxd/common/lxd/unix.socket',
+]
+
+# Image remotes understood by `lxc launch <remote>:<alias>`
+IMAGE_REMOTES = {
+    'ubuntu': {'server': 'https://cloud-images.ubuntu.com/releases', 'protocol': 'simplestreams'},
+    'ubuntu-daily': {'server': 'https://cloud-images.ubuntu.com/daily', 'protocol': 'simplestreams'},
+    'images': {'server': 'https://images.linuxcontainers.org', 'protocol': 'simplestreams'},
+}
+
+
+class LXDError(Exception):
+    """LXD rejected a request or an operation failed"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LXDConnectionError(LXDError):
+    """The LXD socket could not be reached"""
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTPConnection that connects to a unix domain socket"""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+def find_socket_path():
+    """Return the first LXD socket that exists, or the default path"""
+    for path in DEFAULT_SOCKET_PATHS:
+        if os.path.exists(path):
+            return path
+    return DEFAULT_SOCKET_PATHS[0]
+
+
+def image_source(image):
+    """Translate an `lxc launch` image reference such as ubuntu:22.04 into an API source"""
+    remote, _, alias = image.rpartition(':')
+    source = {'type': 'image', 'alias': alias}
+    if remote:
+        if remote not in IMAGE_REMOTES:
+            raise LXDError(f"Unknown image remote: {remote}")
+        source.update(mode='pull', **IMAGE_REMOTES[remote])
+    return source
+
+
+class LXDClient:
+    """Minimal client for the LXD REST API.
+
+    Connects to the unix socket at `socket_path`, or to `url`
+    (https://host:8443) using the client certificate `cert` (a (cert, key)
+    pair of file paths) for remote nodes.
+    """
+
+    def __init__(self, socket_path=None, url=None, cert=None, verify=True, pool_size=4, timeout=120):
+        self.url = url
+        self.socket_path = None if url else (socket_path or find_socket_path())
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        self._ssl_context = None
+        if url:
+            self._ssl_context = ssl.create_default_context(cafile=verify if isinstance(verify, str) else None)
+            if verify is False:
+                self._ssl_context.check_hostname = False
+                self._ssl_context.verify_mode = ssl.CERT_NONE
+            if cert:
+                self._ssl_context.load_cert_chain(*cert)
+
+    @property
+    def endpoint(self):
+        return self.url or self.socket_path
+
+    def available(self):
+        return bool(self.url) or os.path.exists(self.socket_path)
+
+    def _get_connection(self):
+        try:
+            return self._pool.get_nowait(), True
+        except queue.Empty:
+            # Leave headroom over the operation wait timeout so the socket doesn't expire first
+            timeout = self.timeout + 10
+            if self.url:
+                parsed = urlparse(self.url)
+                return http.client.HTTPSConnection(parsed.hostname, parsed.port or 8443, timeout=timeout,
+                                                   context=self._ssl_context), False
+            return UnixHTTPConnection(self.socket_path, timeout=timeout), False
+
+    def _release_connection(self, conn):
+        try:
+            self._pool.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    def _send(self, method, path, body=None):
+        payload = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json'} if payload is not None else {}
+
+        for attempt in range(2):
+            conn, reused = self._get_connection()
+            try:
+                conn.request(method, path, body=payload, headers=headers)
+                response = conn.getresponse()
+                data = response.read()
+            except (ConnectionError, http.client.HTTPException, OSError) as e:
+                conn.close()
+                # A pooled connection may have been closed by the daemon; retry once on a fresh one
+                if reused and attempt == 0:
+                    continue
+                raise LXDConnectionError(f"Cannot reach LXD at {self.endpoint}: {e}")
+
+            if response.will_close:
+                conn.close()
+            else:
+                self._release_connection(conn)
+
+            try:
+                return json.loads(data) if data else {}
+            except ValueError:
+                raise LXDError(f"Invalid response from LXD: {data[:200]!r}", response.status)
+
+    def request(self, method, path, body=None, wait=True, timeout=None):
+        """Send a request and return its metadata, waiting for async operations"""
+        result = self._send(method, path, body)
+
+        if result.get('type') == 'error':
+            raise LXDError(result.get('error') or 'Request failed', result.get('error_code'))
+
+        if result.get('type') == 'async' and wait:
+            return self.wait_operation(result['operation'], timeout=timeout)
+
+        return result.get('metadata')
+
+    def wait_operation(self, operation, timeout=None):
+        """Block until an async operation finishes and raise if it failed"""
+        timeout = timeout or self.timeout
+        metadata = self.request('GET', f"{operation}/wait?timeout={int(timeout)}") or {}
+
+        if metadata.get('status_code') == 200:
+            return metadata
+        if metadata.get('status_code') in (100, 103, 105, 106):  # created, running, pending, starting
+            raise LXDError(f"Operation timed out after {timeout} seconds", 408)
+        raise LXDError(metadata.get('err') or metadata.get('status') or 'Operation failed',
+                       metadata.get('status_code'))
+
+    # Server
+    def resources(self):
+        """Host CPU, memory and disk resources"""
+        return self.request('GET', '/1.0/resources')
+
+    def storage_pool_resources(self, pool):
+        """Space and inode usage of a storage pool"""
+        return self.request('GET', f"/1.0/storage-pools/{quote(pool, safe='')}/resources")
+
+    # Instances
+    def _instance_path(self, name):
+        return f"/1.0/instances/{quote(name, safe='')}"
+
+    def list_instances(self):
+        """List every instance with its state, shaped like `lxc list --format json`"""
+        return self.request('GET', '/1.0/instances?recursion=2') or []
+
+    def get_state(self, name):
+        return self.request('GET', f"{self._instance_path(name)}/state")
+
+    def create_instance(self, name, image, config=None, storage_pool=None, start=True):
+        """Create an instance from an image, optionally starting it (like `lxc launch`)"""
+        body = {
+            'name': name,
+            'source': image_source(image),
+            'config': config or {},
+        }
+        if storage_pool:
+            body['devices'] = {'root': {'path': '/', 'pool': storage_pool, 'type': 'disk'}}
+
+        self.request('POST', '/1.0/instances', body)
+        if start:
+            self.change_state(name, 'start')
+
+    def update_config(self, name, config):
+        """Merge config keys into an instance's configuration"""
+        self.request('PATCH', self._instance_path(name), {'config': config})
+
+    def rename_instance(self, name, new_name):
+        self.request('POST', self._instance_path(name), {'name': new_name})
+
+    def change_state(self, name, action, force=False, timeout=30):
+        """Run a state action: start, stop, restart, freeze or unfreeze"""
+        body = {'action': action, 'timeout': timeout, 'force': force}
+        self.request('PUT', f"{self._instance_path(name)}/state", body)
+
+    # Snapshots
+    def list_snapshots(self, name):
+        """List an instance's snapshots with their creation times"""
+        return self.request('GET', f"{self._instance_path(name)}/snapshots?recursion=1") or []
+
+    def create_snapshot(self, name, snapshot):
+        self.request('POST', f"{self._instance_path(name)}/snapshots", {'name': snapshot, 'stateful': False})
+
+    def restore_snapshot(self, name, snapshot):
+        """Roll an instance back to a snapshot (like `lxc restore`)"""
+        self.request('PUT', self._instance_path(name), {'restore': snapshot})
+
+    def delete_snapshot(self, name, snapshot):
+        self.request('DELETE', f"{self._instance_path(name)}/snapshots/{quote(snapshot, safe='')}")
+
+    def delete_instance(self, name, force=False):
+        """Delete an instance, stopping it first when force is set (like `lxc delete --force`)"""
+        if force:
+            state = self.get_state(name) or {}
+            if state.get('status') not in (None, 'Stopped'):
+                self.change_state(name, 'stop', force=True)
+        self.request('DELETE', self._instance_path(name))
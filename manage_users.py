@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Bulk user import/export for GVM Panel
+Streams CSV or JSONL in and out with constant memory. Imports hash plain
+passwords in parallel worker processes and insert users in batched
+transactions; rows may carry a pre-hashed `password_hash` instead.
+
+Usage: python manage_users.py import users.csv [--format csv|jsonl] [--batch-size 1000]
+                                               [--workers 4] [--on-conflict skip|fail]
+       python manage_users.py export users.jsonl [--format csv|jsonl] [--batch-size 1000]
+                                                 [--include-password-hashes]
+Use - as the file to read from stdin or write to stdout.
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+from werkzeug.security import generate_password_hash
+
+FIELDS = ['username', 'email', 'role', 'credits', 'theme', 'status', 'created_at']
+ROLES = ('user', 'admin')
+THEMES = ('dark', 'light')
+STATUSES = ('active', 'deleting')
+EMAIL = re.compile(r'^[^@\s]+@[^@\s]+$')
+# Formats check_password_hash can verify: method, salt and hash separated by '$'
+PASSWORD_HASH = re.compile(r'^(scrypt|pbkdf2)(:[\w:]+)?\$[^$]+\$[0-9a-f]+$')
+
+
+def hash_password(password):
+    """Runs in a worker process"""
+    return generate_password_hash(password)
+
+
+def detect_format(path, fmt):
+    if fmt:
+        return fmt
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def open_input(path):
+    return sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+
+
+def open_output(path):
+    return sys.stdout if path == '-' else open(path, 'w', newline='', encoding='utf-8')
+
+
+def read_rows(f, fmt):
+    """Yield (line number, row dict) one record at a time"""
+    if fmt == 'csv':
+        reader = csv.DictReader(f)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line_num, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_num, ValueError(f"invalid JSON: {e}")
+            continue
+        yield line_num, row if isinstance(row, dict) else ValueError('expected a JSON object')
+
+
+def parse_row(row):
+    """Validate an input row; returns (user values, plain password or None)"""
+    if isinstance(row, Exception):
+        raise row
+    row = {key.strip().lower(): value for key, value in row.items() if key}
+
+    username = str(row.get('username') or '').strip()
+    email = str(row.get('email') or '').strip()
+    if not username or len(username) > 80:
+        raise ValueError('username is required (at most 80 characters)')
+    if not EMAIL.match(email) or len(email) > 120:
+        raise ValueError(f"invalid email: {email!r}")
+
+    values = {'username': username, 'email': email}
+    role = str(row.get('role') or 'user').strip().lower()
+    if role not in ROLES:
+        raise ValueError(f"invalid role: {role!r}")
+    values['role'] = role
+    theme = str(row.get('theme') or 'dark').strip().lower()
+    if theme not in THEMES:
+        raise ValueError(f"invalid theme: {theme!r}")
+    values['theme'] = theme
+    status = str(row.get('status') or 'active').strip().lower()
+    if status not in STATUSES:
+        raise ValueError(f"invalid status: {status!r}")
+    values['status'] = status
+    try:
+        values['credits'] = int(row.get('credits') or 0)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid credits: {row.get('credits')!r}")
+    if values['credits'] < 0:
+        raise ValueError('credits cannot be negative')
+    created_at = None
+    if row.get('created_at'):
+        try:
+            created_at = datetime.fromisoformat(str(row['created_at']).replace('Z', '+00:00')).replace(tzinfo=None)
+        except ValueError:
+            raise ValueError(f"invalid created_at: {row['created_at']!r}")
+    # Every row in a batch must have the same keys for the executemany insert
+    values['created_at'] = created_at or datetime.utcnow()
+
+    password_hash = str(row.get('password_hash') or '').strip()
+    if password_hash:
+        if not PASSWORD_HASH.match(password_hash):
+            raise ValueError('password_hash is not a werkzeug scrypt or pbkdf2 hash')
+        values['password'] = password_hash
+        return values, None
+    password = row.get('password')
+    if not password:
+        raise ValueError('password or password_hash is required')
+    return values, str(password)
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_users(args):
+    # Imported here so hashing workers don't load the panel when they start
+    from sqlalchemy.exc import IntegrityError
+    from app import app, db, User, init_db, sqlite_insert
+
+    init_db()
+    stats = {'inserted': 0, 'skipped': 0, 'invalid': 0}
+    statement = sqlite_insert(User)
+    if args.on_conflict == 'skip':
+        statement = statement.on_conflict_do_nothing()
+
+    def insert(first_line, records, hashes):
+        """Fill in the hashed passwords and insert one batch in its own transaction"""
+        hashes = iter(hashes)
+        for values, needs_hash in records:
+            if needs_hash:
+                values['password'] = next(hashes)
+        rows = [values for values, _ in records]
+        try:
+            with db.engine.begin() as conn:
+                inserted = conn.execute(statement, rows).rowcount
+        except IntegrityError as e:
+            raise SystemExit(f"❌ Batch starting at line {first_line} conflicts with existing users, "
+                             f"nothing from it was imported: {e.orig}")
+        stats['inserted'] += inserted
+        stats['skipped'] += len(rows) - inserted
+        print(f"   {stats['inserted']} inserted, {stats['skipped']} skipped, {stats['invalid']} invalid",
+              file=sys.stderr)
+
+    fmt = detect_format(args.file, args.format)
+    with app.app_context(), open_input(args.file) as f, ProcessPoolExecutor(max_workers=args.workers) as pool:
+        pending = None
+        for batch in batches(read_rows(f, fmt), args.batch_size):
+            records, passwords = [], []
+            for line_num, row in batch:
+                try:
+                    values, password = parse_row(row)
+                except ValueError as e:
+                    stats['invalid'] += 1
+                    print(f"⚠️  line {line_num}: {e}", file=sys.stderr)
+                    continue
+                records.append((values, password is not None))
+                if password is not None:
+                    passwords.append(password)
+            # Hash this batch in the workers while the previous one is being inserted
+            chunksize = max(1, len(passwords) // (args.workers * 4))
+            hashes = pool.map(hash_password, passwords, chunksize=chunksize)
+            if pending:
+                insert(*pending)
+            pending = (batch[0][0], records, hashes) if records else None
+        if pending:
+            insert(*pending)
+
+    print(f"✅ Imported {stats['inserted']} users ({stats['skipped']} already existed, "
+          f"{stats['invalid']} invalid rows)", file=sys.stderr)
+    return 1 if stats['invalid'] else 0
+
+
+def export_users(args):
+    from app import app, db, User
+
+    fields = FIELDS + (['password_hash'] if args.include_password_hashes else [])
+    columns = [User.id] + [getattr(User, field) for field in FIELDS]
+    if args.include_password_hashes:
+        columns.append(User.password)
+    fmt = detect_format(args.file, args.format)
+    exported = 0
+
+    with app.app_context(), open_output(args.file) as f:
+        writer = csv.DictWriter(f, fieldnames=fields) if fmt == 'csv' else None
+        if writer:
+            writer.writeheader()
+        last_id = 0
+        while True:
+            # Keyset pagination keeps each read short and memory flat
+            page = db.session.execute(db.select(*columns).where(User.id > last_id)
+                                      .order_by(User.id).limit(args.batch_size)).all()
+            db.session.rollback()
+            if not page:
+                break
+            for row in page:
+                record = dict(zip(fields, row[1:]))
+                if record['created_at']:
+                    record['created_at'] = record['created_at'].isoformat()
+                if writer:
+                    writer.writerow(record)
+                else:
+                    f.write(json.dumps(record) + '\n')
+            exported += len(page)
+            last_id = page[-1][0]
+        f.flush()
+
+    print(f"✅ Exported {exported} users", file=sys.stderr)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk import and export GVM Panel users')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    importer = subparsers.add_parser('import', help='create users from a CSV or JSONL file')
+    importer.add_argument('file', help="input file, or - for stdin")
+    importer.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                          help='processes used to hash plain passwords')
+    importer.add_argument('--on-conflict', choices=['skip', 'fail'], default='skip',
+                          help='skip rows whose username or email exists, or abort on the first one')
+    importer.set_defaults(handler=import_users)
+
+    exporter = subparsers.add_parser('export', help='write every user to a CSV or JSONL file')
+    exporter.add_argument('file', help="output file, or - for stdout")
+    exporter.add_argument('--include-password-hashes', action='store_true',
+                          help='add a password_hash column that import accepts as-is')
+    exporter.set_defaults(handler=export_users)
+
+    for subparser in (importer, exporter):
+        subparser.add_argument('--format', choices=['csv', 'jsonl'],
+                               help='defaults to jsonl for .jsonl/.ndjson files, otherwise csv')
+        subparser.add_argument('--batch-size', type=int, default=1000, help='rows per transaction or page')
+
+    args = parser.parse_args()
+    if args.batch_size < 1 or getattr(args, 'workers', 1) < 1:
+        parser.error('--batch-size and --workers must be at least 1')
+    sys.exit(args.handler(args))
+
+
+if __name__ == '__main__':
+    main()
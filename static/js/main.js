@@ -87,14 +87,123 @@ function hideLoading() {
     }
 }
 
-// Auto-refresh for system resources
-function refreshSystemResources() {
-    // This can be implemented to fetch updated system resources via AJAX
-    // For now, it's a placeholder for future enhancement
+// Live stats: update every [data-stat] text and [data-stat-bar] progress bar in place
+function updateStat(name, value) {
+    document.querySelectorAll(`[data-stat="${name}"]`).forEach(el => {
+        el.textContent = value + (el.dataset.statSuffix || '');
+    });
+    document.querySelectorAll(`[data-stat-bar="${name}"]`).forEach(el => {
+        el.style.width = Math.min(100, value) + '%';
+    });
+}
+
+// Subscribe to the Server-Sent Events stats stream
+function subscribeStats(params) {
+    if (!window.EventSource) return null;
+
+    const query = new URLSearchParams(params || {}).toString();
+    const source = new EventSource('/api/stream/stats' + (query ? '?' + query : ''));
+
+    source.addEventListener('host', event => {
+        const data = JSON.parse(event.data);
+        ['cpu', 'ram', 'disk'].forEach(key => updateStat(`host-${key}`, data[key]));
+    });
+
+    source.addEventListener('containers', event => {
+        const containers = JSON.parse(event.data);
+        Object.entries(containers).forEach(([name, stats]) => {
+            updateStat(`${name}-memory`, stats.memory_mb);
+            updateStat(`${name}-cpu`, stats.cpu_percent || 0);
+            updateStat(`${name}-status`, stats.status);
+        });
+    });
+
+    // The browser reconnects by itself when a stream ends, but not when the server refuses
+    // one (too many open streams), so try again later
+    source.addEventListener('error', () => {
+        if (source.readyState === EventSource.CLOSED) {
+            setTimeout(() => subscribeStats(params), 30000);
+        }
+    });
+
+    return source;
 }
 
-// Periodically refresh system resources every 30 seconds
-setInterval(refreshSystemResources, 30000);
+// Start live stats on pages that display them
+document.addEventListener('DOMContentLoaded', function() {
+    const root = document.querySelector('[data-live-stats]');
+    if (root) {
+        subscribeStats(JSON.parse(root.dataset.liveStats || '{}'));
+    }
+});
+
+// Fetch JSON with If-None-Match, reusing the cached body when the server answers 304 Not Modified
+const conditionalCache = {};
+
+function fetchConditional(url) {
+    const cached = conditionalCache[url];
+    const headers = cached ? {'If-None-Match': cached.etag} : {};
+    return fetch(url, {headers: headers, cache: 'no-store'}).then(response => {
+        if (response.status === 304 && cached) return cached.data;
+        if (!response.ok) throw new Error(`${url} returned ${response.status}`);
+        return response.json().then(data => {
+            const etag = response.headers.get('ETag');
+            if (etag) conditionalCache[url] = {etag: etag, data: data};
+            return data;
+        });
+    });
+}
+
+// Fetch every page of a cursor-paginated /api/v1 listing
+function fetchAllPages(url, key) {
+    const separator = url.includes('?') ? '&' : '?';
+    function fetchPage(cursor, items) {
+        const pageUrl = cursor ? `${url}${separator}cursor=${encodeURIComponent(cursor)}` : url;
+        return fetchConditional(pageUrl).then(data => {
+            items = items.concat(data[key]);
+            return data.next_cursor ? fetchPage(data.next_cursor, items) : items;
+        });
+    }
+    return fetchPage(null, []);
+}
+
+const VPS_STATUS_BADGES = {
+    running: '<span class="badge bg-success">Running</span>',
+    provisioning: '<span class="badge bg-warning text-dark">Provisioning</span>',
+    suspended: '<span class="badge bg-info text-dark" title="Suspended after inactivity, start it to resume">Suspended</span>',
+    deleting: '<span class="badge bg-secondary">Deleting</span>',
+    stopped: '<span class="badge bg-danger">Stopped</span>'
+};
+
+// Update [data-vps-status] badges in place and drop [data-vps-row] rows whose VPS no longer exists
+function refreshVpsStatuses() {
+    return fetchAllPages('/api/v1/vps?fields=id,status', 'vps').then(vpsList => {
+        const statuses = {};
+        vpsList.forEach(vps => { statuses[vps.id] = vps.status; });
+        document.querySelectorAll('[data-vps-status]').forEach(el => {
+            const status = statuses[el.dataset.vpsStatus];
+            if (status && el.dataset.status !== status) {
+                el.dataset.status = status;
+                el.innerHTML = VPS_STATUS_BADGES[status] || VPS_STATUS_BADGES.stopped;
+            }
+        });
+        document.querySelectorAll('[data-vps-row]').forEach(row => {
+            if (!(row.dataset.vpsRow in statuses)) row.remove();
+        });
+        return statuses;
+    });
+}
+
+// Poll VPS statuses on pages with a [data-vps-refresh="<seconds>"] table; unchanged polls cost a 304
+document.addEventListener('DOMContentLoaded', function() {
+    const table = document.querySelector('[data-vps-refresh]');
+    if (!table) return;
+    const interval = (parseInt(table.dataset.vpsRefresh, 10) || 15) * 1000;
+    (function poll() {
+        refreshVpsStatuses().catch(error => console.error('VPS refresh failed:', error))
+            .then(() => setTimeout(poll, interval));
+    })();
+});
 
 // Handle AJAX errors
 function handleAjaxError(error) {
@@ -0,0 +1,98 @@
+"""Shared fixtures: the panel on a scratch SQLite database, with the lxc CLI faked out"""
+
+import os
+import shutil
+import tempfile
+import time
+
+import pytest
+from werkzeug.security import generate_password_hash
+
+# The app reads these when it is imported. The LXD socket never exists, so every
+# LXC operation takes the lxc CLI path, which the fake_lxc fixture replaces.
+_workdir = tempfile.mkdtemp(prefix='gvm-test-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ['LXD_SOCKET'] = os.path.join(_workdir, 'missing.socket')
+os.environ['AUDIT_SPILL_DIR'] = os.path.join(_workdir, 'audit-spill')
+os.environ['BACKUP_DIR'] = os.path.join(_workdir, 'backups')
+
+import app as panel  # noqa: E402
+from benchmark import FakeLXC  # noqa: E402
+
+# scrypt, the default, takes most of a second per hash on a small CI box
+PASSWORD_HASH = generate_password_hash('secret', method='pbkdf2:sha256:1000')
+
+
+@pytest.fixture(autouse=True)
+def app(monkeypatch):
+    """A fresh schema per test; background threads only run where a test starts them"""
+    monkeypatch.setattr(panel, '_workers_pid', os.getpid())
+    config = dict(panel.app.config)
+    with panel.app.app_context():
+        panel.db.drop_all()
+    panel.init_db()
+    yield panel.app
+    panel.audit_log.stop()
+    shutil.rmtree(panel.audit_log.spill_dir, ignore_errors=True)
+    panel.app.config.clear()
+    panel.app.config.update(config)
+
+
+@pytest.fixture(autouse=True)
+def fake_lxc(monkeypatch):
+    fake = FakeLXC(latency=0)
+    monkeypatch.setattr(panel, 'execute_lxc_sync', fake.execute)
+    monkeypatch.setattr(panel.warm_pool, 'targets', {})
+    return fake
+
+
+@pytest.fixture
+def make_user(app):
+    def make_user(username='alice', role='user', credits=1000, **fields):
+        with app.app_context():
+            user = panel.User(username=username, email=f"{username}@test.local", password=PASSWORD_HASH,
+                              role=role, credits=credits, **fields)
+            panel.db.session.add(user)
+            panel.db.session.commit()
+            return user.id
+    return make_user
+
+
+@pytest.fixture
+def make_vps(app, fake_lxc):
+    def make_vps(user_id, name=None, plan='Starter', status='running', host=None, **fields):
+        specs = panel.VPS_PLANS[plan]
+        with app.app_context():
+            vps = panel.VPS(user_id=user_id, container_name=name or f"vps-{user_id}-{time.monotonic_ns()}",
+                            plan=plan, ram=specs['ram'], cpu=specs['cpu'], storage=specs['storage'],
+                            status=status, host=host or panel.DEFAULT_NODE, **fields)
+            panel.db.session.add(vps)
+            panel.db.session.commit()
+            fake_lxc.add(vps.container_name, 'Running' if status == 'running' else 'Stopped',
+                         None if vps.host == panel.DEFAULT_NODE else vps.host)
+            return vps.id
+    return make_vps
+
+
+@pytest.fixture
+def login(app):
+    """Test client with a user's session, skipping the password check"""
+    def login(user_id):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+        return client
+    return login
+
+
+@pytest.fixture
+def wait_until():
+    """Poll `condition` until it is truthy, for work done by background threads"""
+    def wait_until(condition, timeout=10):
+        deadline = time.time() + timeout
+        while True:
+            result = condition()
+            if result or time.time() > deadline:
+                return result
+            time.sleep(0.05)
+    return wait_until
@@ -0,0 +1,77 @@
+import re
+
+import pytest
+from sqlalchemy import event
+
+import app as panel
+
+
+@pytest.fixture
+def admin(make_user, login):
+    return login(make_user('admin', role='admin'))
+
+
+@pytest.fixture
+def count_queries(app):
+    """Count the SQL statements run while serving one request"""
+    def count_queries(client, path):
+        statements = []
+        listener = lambda *args: statements.append(args[2])  # noqa: E731
+        with app.app_context():
+            engine = panel.db.engine
+        event.listen(engine, 'before_cursor_execute', listener)
+        try:
+            response = client.get(path)
+        finally:
+            event.remove(engine, 'before_cursor_execute', listener)
+        assert response.status_code == 200
+        return len(statements)
+    return count_queries
+
+
+def add_customers(make_user, make_vps, start, count, vps_each=2):
+    for number in range(start, start + count):
+        user_id = make_user(f"customer{number:02d}")
+        for _ in range(vps_each):
+            make_vps(user_id)
+
+
+@pytest.mark.parametrize('path', ['/admin', '/admin/users', '/admin/vps'])
+def test_admin_views_run_a_fixed_number_of_queries(admin, make_user, make_vps, count_queries, path):
+    add_customers(make_user, make_vps, 0, 2)
+    count_queries(admin, path)  # settings and the sampler warm up on the first request
+    few = count_queries(admin, path)
+    add_customers(make_user, make_vps, 2, 10)
+    assert count_queries(admin, path) == few
+
+
+def usernames(response):
+    return re.findall(r'customer\d\d', response.get_data(as_text=True))
+
+
+def test_admin_users_pages_by_id(app, admin, make_user, make_vps):
+    app.config['ADMIN_PAGE_SIZE'] = 5
+    add_customers(make_user, make_vps, 0, 11, vps_each=0)  # ids 2 to 12 after the admin's 1
+
+    first = admin.get('/admin/users')
+    assert sorted(set(usernames(first))) == [f"customer{number:02d}" for number in range(4)]
+    assert 'after=5' in first.get_data(as_text=True)
+
+    second = admin.get('/admin/users?after=5')
+    assert sorted(set(usernames(second))) == [f"customer{number:02d}" for number in range(4, 9)]
+    page = second.get_data(as_text=True)
+    assert 'before=6' in page and 'after=10' in page
+
+    assert sorted(set(usernames(admin.get('/admin/users?before=6')))) == \
+        sorted(set(usernames(first)))
+    last = admin.get('/admin/users?after=10')
+    assert sorted(set(usernames(last))) == ['customer09', 'customer10']
+    assert 'after=' not in last.get_data(as_text=True)
+
+
+def test_admin_users_shows_vps_counts(app, admin, make_user, make_vps):
+    add_customers(make_user, make_vps, 0, 1, vps_each=3)
+    add_customers(make_user, make_vps, 1, 1, vps_each=0)
+    page = admin.get('/admin/users').get_data(as_text=True)
+    assert re.search(r'customer00@test\.local</td>.*?<td>1000</td>\s*<td>3</td>', page, re.S)
+    assert re.search(r'customer01@test\.local</td>.*?<td>1000</td>\s*<td>0</td>', page, re.S)
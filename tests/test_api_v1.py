@@ -0,0 +1,49 @@
+import app as panel
+
+
+def test_vps_pages_follow_the_cursor(app, make_user, make_vps, login):
+    user_id = make_user()
+    ids = [make_vps(user_id) for _ in range(5)]
+    client = login(user_id)
+
+    seen = []
+    url = '/api/v1/vps?limit=2&fields=container_name'
+    while url:
+        body = client.get(url).get_json()
+        assert all(set(item) == {'id', 'container_name'} for item in body['vps'])
+        seen.extend(item['id'] for item in body['vps'])
+        url = f"/api/v1/vps?limit=2&fields=container_name&cursor={body['next_cursor']}" if body['next_cursor'] else None
+    assert seen == ids
+
+
+def test_unchanged_page_is_not_modified_until_a_row_changes(app, make_user, make_vps, login):
+    user_id = make_user()
+    vps_id = make_vps(user_id)
+    client = login(user_id)
+
+    first = client.get('/api/v1/vps')
+    etag = first.headers['ETag']
+    assert client.get('/api/v1/vps', headers={'If-None-Match': etag}).status_code == 304
+
+    with app.app_context():
+        panel.db.session.get(panel.VPS, vps_id).status = 'stopped'
+        panel.db.session.commit()
+    changed = client.get('/api/v1/vps', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.get_json()['vps'][0]['status'] == 'stopped'
+
+
+def test_users_only_see_their_own_vps(app, make_user, make_vps, login):
+    alice = make_user('alice')
+    bob = make_user('bob')
+    make_vps(alice)
+    make_vps(bob)
+    body = login(alice).get(f"/api/v1/vps?all=1&user_id={bob}").get_json()
+    assert [item['user_id'] for item in body['vps']] == [alice]
+
+
+def test_bad_cursor_and_fields_are_rejected(app, make_user, login):
+    client = login(make_user())
+    assert client.get('/api/v1/vps?cursor=not-a-cursor').status_code == 400
+    assert client.get('/api/v1/vps?fields=password').status_code == 400
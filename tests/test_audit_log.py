@@ -0,0 +1,62 @@
+import os
+
+import app as panel
+
+
+def audit_rows(app):
+    with app.app_context():
+        return panel.AuditEvent.query.order_by(panel.AuditEvent.id).all()
+
+
+def test_events_are_written_in_the_background(app, monkeypatch, wait_until):
+    monkeypatch.setattr(panel.audit_log, 'flush_interval', 0.05)
+    for n in range(3):
+        panel.audit_log.record('vps.start', vps_id=n, target=f"vps-1-{n}", actor_id=1, reason='test')
+
+    rows = wait_until(lambda: len(audit_rows(app)) == 3 and audit_rows(app))
+    assert [row.target for row in rows] == ['vps-1-0', 'vps-1-1', 'vps-1-2']
+    assert rows[0].details == '{"reason": "test"}'
+
+
+def test_rejected_batches_are_spilled_and_replayed_once(app, monkeypatch):
+    def refuse(events):
+        raise RuntimeError('database is locked')
+
+    with monkeypatch.context() as patched:
+        patched.setattr(panel.audit_log, '_write', refuse)
+        patched.setattr(panel.audit_log, 'REPLAY_INTERVAL', 3600)
+        panel.audit_log.record('user.delete', user_id=7, target='bob')
+        panel.audit_log.record('user.delete', user_id=8, target='carol')
+        panel.audit_log.stop()
+
+    spilled = os.listdir(panel.audit_log.spill_dir)
+    assert len(spilled) == 1
+    assert audit_rows(app) == []
+
+    with app.app_context():
+        assert panel.audit_log.replay() == 2
+        assert panel.audit_log.replay() == 0
+    assert os.listdir(panel.audit_log.spill_dir) == []
+    assert [row.target for row in audit_rows(app)] == ['bob', 'carol']
+
+
+def test_admin_delete_of_a_user_with_vps_is_audited(app, make_user, make_vps, login, wait_until):
+    admin_id = make_user('admin', role='admin')
+    user_id = make_user('bob')
+    make_vps(user_id)
+    make_vps(user_id)
+
+    response = login(admin_id).post(f"/admin/user/{user_id}/delete")
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/admin/users')
+
+    def purged():
+        with app.app_context():
+            return panel.db.session.get(panel.User, user_id) is None
+
+    assert wait_until(purged)
+    panel.audit_log.stop()
+    with app.app_context():
+        event = panel.AuditEvent.query.filter_by(action='user.delete').one()
+    assert (event.actor_id, event.user_id, event.target) == (admin_id, user_id, 'bob')
+    assert event.details == '{"vps_count": 2}'
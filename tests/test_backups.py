@@ -0,0 +1,53 @@
+from datetime import datetime, timedelta
+
+import app as panel
+
+INTERVAL = 3600
+
+
+def backup_queue(tmp_path):
+    return panel.BackupQueue(str(tmp_path), interval=INTERVAL)
+
+
+def queued_vps(app):
+    with app.app_context():
+        return {backup.vps_id for backup in panel.Backup.query.filter_by(status='queued')}
+
+
+def test_new_vps_wait_an_interval_plus_their_offset(app, make_user, make_vps, tmp_path):
+    queue = backup_queue(tmp_path)
+    user_id = make_user()
+    new = make_vps(user_id)
+    old = make_vps(user_id, created_at=datetime.utcnow() - timedelta(seconds=2 * INTERVAL))
+    with app.app_context():
+        first_backup_at = queue.first_backup_at(panel.db.session.get(panel.VPS, new))
+        assert queue.schedule() == 1
+    assert queued_vps(app) == {old}
+    now = datetime.utcnow()
+    assert now + timedelta(seconds=INTERVAL - 5) <= first_backup_at < now + timedelta(seconds=2 * INTERVAL)
+
+
+def test_offsets_spread_vps_created_together_over_the_interval(app, tmp_path):
+    queue = backup_queue(tmp_path)
+    created_at = datetime(2026, 1, 1)
+    offsets = [(queue.first_backup_at(panel.VPS(id=vps_id, created_at=created_at)) - created_at).total_seconds()
+               - INTERVAL for vps_id in range(1, 201)]
+    assert all(0 <= offset < INTERVAL for offset in offsets)
+    # Every tenth of the interval gets some of them
+    assert {int(offset * 10 // INTERVAL) for offset in offsets} == set(range(10))
+
+
+def test_backed_up_vps_are_due_an_interval_after_their_last_backup(app, make_user, make_vps, tmp_path):
+    queue = backup_queue(tmp_path)
+    user_id = make_user()
+    stale = make_vps(user_id)
+    fresh = make_vps(user_id)
+    with app.app_context():
+        for vps_id, age in ((stale, INTERVAL + 60), (fresh, 60)):
+            vps = panel.db.session.get(panel.VPS, vps_id)
+            panel.db.session.add(panel.Backup(vps_id=vps_id, container_name=vps.container_name, host=vps.host,
+                                              status='done', snapshot_name=f"backup-{vps_id}",
+                                              created_at=datetime.utcnow() - timedelta(seconds=age)))
+        panel.db.session.commit()
+        assert queue.schedule() == 1
+    assert queued_vps(app) == {stale}
@@ -0,0 +1,95 @@
+import app as panel
+
+CYCLE = 3600
+INTERVAL = 60
+START = 1_700_000_000 // CYCLE * CYCLE
+
+
+def meter():
+    return panel.UsageMeter(panel.VPS_PLANS, interval=INTERVAL, cycle=CYCLE)
+
+
+def run(usage_meter, container_name, start, minutes):
+    """Sample a container as running for the first `minutes` of the cycle at `start`"""
+    for minute in range(minutes):
+        usage_meter.sample({container_name: {'status': 'Running', 'cpu_seconds': minute}}, start + minute * INTERVAL)
+
+
+def vps_name(vps_id):
+    return panel.db.session.get(panel.VPS, vps_id).container_name
+
+
+def test_running_hour_is_charged_at_the_plan_rate(app, make_user, make_vps):
+    user_id = make_user(credits=100)
+    vps_id = make_vps(user_id, plan='Pro', processor='AMD')
+    usage_meter = meter()
+    with app.app_context():
+        run(usage_meter, vps_name(vps_id), START, 60)
+        assert usage_meter.due_cycles(START + CYCLE + INTERVAL) == [START]
+        assert usage_meter.bill_cycle(START) == []
+
+        hourly = panel.VPS_PLANS['Pro']['hourly']['AMD']
+        user = panel.db.session.get(panel.User, user_id)
+        assert user.credits == 100 - hourly
+        assert user.unbilled_usage == 0
+        record = panel.UsageRecord.query.one()
+        assert (record.vps_id, record.running_seconds, record.cost) == (vps_id, CYCLE, hourly)
+        charge = panel.CreditTransaction.query.one()
+        assert (charge.kind, charge.amount, charge.reference) == ('usage', -hourly, f"cycle:{START}")
+
+
+def test_fractions_of_a_credit_are_carried_to_the_next_cycle(app, make_user, make_vps):
+    user_id = make_user(credits=100)
+    vps_id = make_vps(user_id, plan='Starter', processor='Intel')  # 1 credit per hour
+    usage_meter = meter()
+    with app.app_context():
+        name = vps_name(vps_id)
+        run(usage_meter, name, START, 30)
+        usage_meter.bill_cycle(START)
+        user = panel.db.session.get(panel.User, user_id)
+        assert (user.credits, user.unbilled_usage) == (100, 0.5)
+
+        run(usage_meter, name, START + CYCLE, 30)
+        usage_meter.bill_cycle(START + CYCLE)
+        panel.db.session.refresh(user)
+        assert (user.credits, user.unbilled_usage) == (99, 0)
+
+
+def test_a_cycle_is_billed_once(app, make_user, make_vps):
+    user_id = make_user(credits=100)
+    vps_id = make_vps(user_id, plan='Standard', processor='Intel')
+    usage_meter = meter()
+    with app.app_context():
+        run(usage_meter, vps_name(vps_id), START, 60)
+        assert usage_meter.bill_cycle(START) == []
+        # Another process, or this one after a restart, finds the cycle already claimed
+        assert usage_meter.bill_cycle(START) is None
+        assert meter().bill(START + CYCLE + INTERVAL) == 0
+
+        assert panel.db.session.get(panel.User, user_id).credits == 100 - panel.VPS_PLANS['Standard']['hourly']['Intel']
+        assert panel.CreditTransaction.query.count() == 1
+        assert panel.UsageRecord.query.count() == 1
+        assert panel.BillingCycle.query.one().debited == panel.VPS_PLANS['Standard']['hourly']['Intel']
+
+
+def test_user_left_without_credits_is_reported(app, make_user, make_vps):
+    user_id = make_user(credits=1)
+    vps_id = make_vps(user_id, plan='Pro', processor='Intel')
+    usage_meter = meter()
+    with app.app_context():
+        run(usage_meter, vps_name(vps_id), START, 60)
+        assert usage_meter.bill_cycle(START) == [user_id]
+        user = panel.db.session.get(panel.User, user_id)
+        # What the user couldn't pay stays owed
+        assert (user.credits, user.unbilled_usage) == (0, panel.VPS_PLANS['Pro']['hourly']['Intel'] - 1)
+
+
+def test_usage_billing_is_off_by_default(app, make_user, make_vps, login):
+    assert panel.app.config['BILLING_CYCLE'] is None
+    assert not panel.usage_meter.enabled
+    user_id = make_user(credits=0)
+    vps_id = make_vps(user_id, status='stopped')
+    client = login(user_id)
+    # Without metering, an empty balance doesn't keep a paid-for VPS from starting
+    assert client.post(f"/api/vps/{vps_id}/start").status_code == 200
+    assert '/hour' not in client.get('/vps/create').get_data(as_text=True)
@@ -0,0 +1,36 @@
+import json
+
+import build_assets
+
+
+def test_integrity_is_sha384_of_the_bytes():
+    # sha384 of b'abc', as published in FIPS 180-2
+    assert build_assets.integrity(b'abc') == (
+        'sha384-ywB1P0WjXou1oD1pmsZQBycsMqsO3tFjGotgWkP/W+2AhgcroefMI1i67KE0yCWn')
+
+
+def test_cdn_files_are_pinned_once(tmp_path, monkeypatch):
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        return url.encode()
+
+    monkeypatch.setattr(build_assets, 'fetch', fetch)
+    urls = ('https://cdn.example/a@1.0/a.js', 'https://cdn.example/b@2.0/b.css')
+    hashes = build_assets.build_integrity(str(tmp_path), urls)
+    assert hashes == {url: build_assets.integrity(url.encode()) for url in urls}
+    assert json.loads((tmp_path / 'integrity.json').read_text()) == hashes
+
+    # A later build keeps the pinned hashes instead of trusting the CDN again
+    assert build_assets.build_integrity(str(tmp_path), urls) == hashes
+    assert fetched == list(urls)
+
+
+def test_unreachable_cdn_file_is_left_unpinned(tmp_path, monkeypatch):
+    def fetch(url):
+        raise OSError('Name or service not known')
+
+    monkeypatch.setattr(build_assets, 'fetch', fetch)
+    assert build_assets.build_integrity(str(tmp_path), ('https://cdn.example/a@1.0/a.js',)) == {}
+
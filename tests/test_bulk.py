@@ -0,0 +1,55 @@
+import threading
+import time
+
+import app as panel
+
+
+def test_bulk_runs_in_parallel_within_the_per_host_limit(monkeypatch):
+    running = {}
+    peak = {'node-a': 0, 'node-b': 0, 'all': 0}
+    lock = threading.Lock()
+
+    def slow_power(container_name, action, host=None):
+        with lock:
+            running[host] = running.get(host, 0) + 1
+            peak[host] = max(peak[host], running[host])
+            peak['all'] = max(peak['all'], sum(running.values()))
+        time.sleep(0.05)
+        with lock:
+            running[host] -= 1
+        return True, f"{action} {container_name}"
+    monkeypatch.setattr(panel, 'lxc_power', slow_power)
+
+    executor = panel.BulkExecutor(max_workers=8, per_host=2)
+    items = [(index, f"vps-{index}", 'node-a' if index % 2 else 'node-b') for index in range(12)]
+    results = executor.map('stop', items)
+
+    assert results == {index: (True, f"stop vps-{index}") for index in range(12)}
+    assert peak['node-a'] == peak['node-b'] == 2
+    assert peak['all'] == 4
+
+
+def test_bulk_reports_each_vps_in_request_order(app, make_user, make_vps, login, fake_lxc):
+    user_id = make_user()
+    first = make_vps(user_id, status='running')
+    second = make_vps(user_id, status='running')
+    foreign = make_vps(make_user('bob'), status='running')
+    with app.app_context():
+        broken = panel.db.session.get(panel.VPS, second).container_name
+    del fake_lxc.containers[broken]
+
+    response = login(user_id).post('/api/vps/bulk', json={'action': 'stop', 'ids': [first, 999, foreign, second, first]})
+    data = response.get_json()
+    assert [(item['id'], item['success'], item.get('status_code')) for item in data['results']] == \
+        [(first, True, None), (999, False, 404), (foreign, False, 403), (second, False, 500)]
+    assert (data['succeeded'], data['failed']) == (1, 3)
+    with app.app_context():
+        assert {vps.id: vps.status for vps in panel.VPS.query} == \
+            {first: 'stopped', second: 'running', foreign: 'running'}
+
+
+def test_bulk_rejects_oversized_requests(app, make_user, login):
+    app.config['BULK_MAX_ITEMS'] = 3
+    response = login(make_user()).post('/api/vps/bulk', json={'action': 'stop', 'ids': [1, 2, 3, 4]})
+    assert response.status_code == 400
+    assert 'At most 3' in response.get_json()['message']
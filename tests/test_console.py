@@ -0,0 +1,141 @@
+import json
+import os
+import signal
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import simple_websocket
+from werkzeug.serving import make_server
+
+import app as panel
+
+XTERM_JS = 'https://cdn.jsdelivr.net/npm/@xterm/xterm@5.5.0/lib/xterm.js'
+
+FAKE_LXC = '''#!/bin/sh
+# lxc exec <target> [--env K=V ...] -- <command...>, run locally
+shift 2
+while [ "$1" != "--" ]; do shift; done
+shift
+exec "$@"
+'''
+
+
+@pytest.fixture
+def lxc_on_path(tmp_path, monkeypatch):
+    lxc = tmp_path / 'lxc'
+    lxc.write_text(FAKE_LXC)
+    lxc.chmod(0o755)
+    monkeypatch.setenv('PATH', f"{tmp_path}:{os.environ['PATH']}")
+
+
+def alive(pid):
+    """Whether a process exists and is not a zombie waiting to be reaped"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+def read_until(session, marker, timeout=5):
+    output = b''
+    deadline = time.time() + timeout
+    while marker not in output and time.time() < deadline:
+        output += session.drain(65536)
+        time.sleep(0.02)
+    return output
+
+
+def test_shell_gets_the_pty_as_its_controlling_terminal(lxc_on_path):
+    script = 'stty size; echo sid=$(ps -o sid= -p $$); read line; stty size; echo got=$line'
+    session = panel.ConsoleSession(1, 1, 'vps-1-1', None, ['sh', '-c', script], 65536, cols=100, rows=30)
+    try:
+        output = read_until(session, b'sid=')
+        assert b'30 100' in output
+        # The shell leads its own session, so close() can signal the whole group
+        assert f"sid={session.process.pid}".encode() in output.replace(b' ', b'')
+
+        session.resize(120, 40)
+        session.write(b'hello\n')
+        session.flush_input()
+        output = read_until(session, b'got=hello')
+        assert b'40 120' in output
+    finally:
+        session.close('test')
+
+
+def test_close_hangs_up_the_whole_session(lxc_on_path):
+    session = panel.ConsoleSession(1, 1, 'vps-1-1', None, ['sh', '-c', 'sleep 60 & echo child=$!; wait'], 65536)
+    output = read_until(session, b'\n', timeout=5)
+    child = int(output.split(b'child=')[1].split()[0])
+    session.close('test')
+    assert session.process.poll() is not None
+    deadline = time.time() + 5
+    while alive(child):
+        if time.time() > deadline:
+            os.kill(child, signal.SIGKILL)
+            pytest.fail('background job survived close()')
+        time.sleep(0.05)
+
+
+def test_consoles_are_capped_per_process(app, make_user, monkeypatch):
+    monkeypatch.setattr(panel, 'ConsoleSession', lambda *args: SimpleNamespace(id=object(), close=lambda reason: None))
+    manager = panel.ConsoleManager(['bash'], per_user=5, per_vps=5, max_sessions=2)
+    monkeypatch.setattr(manager, 'start', lambda: None)
+    alice, bob = make_user('alice'), make_user('bob')
+    with app.app_context():
+        first, _ = manager.open(alice, 1, 'vps-1-1', None)
+        second, _ = manager.open(bob, 2, 'vps-2-1', None)
+        refused, message = manager.open(bob, 3, 'vps-2-2', None)
+        assert first and second and refused is None
+        assert 'Too many consoles' in message
+        # Refusing at the process cap takes no per-user or per-VPS slot
+        assert panel.OperationLease.query.count() == 4
+
+        manager.close(first, 'closed')
+        assert manager.open(bob, 3, 'vps-2-2', None)[0] is not None
+
+
+def test_console_page_loads_xterm_with_integrity(make_user, make_vps, login, monkeypatch):
+    monkeypatch.setattr(panel, 'cdn_integrity_hashes', {XTERM_JS: 'sha384-pinned'})
+    user_id = make_user()
+    vps_id = make_vps(user_id)
+    page = login(user_id).get(f"/vps/manage/{vps_id}").get_data(as_text=True)
+    assert f'<script src="{XTERM_JS}" integrity="sha384-pinned" crossorigin="anonymous">' in page
+    # Files without a pinned hash still get the attribute, empty, which browsers don't check
+    assert 'addon-fit.js" integrity="" crossorigin="anonymous">' in page
+
+
+@pytest.fixture
+def server(app):
+    """The panel on a real socket, since WebSockets can't go through the test client"""
+    httpd = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=httpd.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield f"127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+
+
+@pytest.mark.parametrize('origin', ['https://evil.example', 'http://127.0.0.1.evil.example', None])
+def test_console_refuses_foreign_origins(server, origin):
+    ws = simple_websocket.Client(f"ws://{server}/api/vps/1/console", headers={'Origin': origin} if origin else {})
+    with pytest.raises(simple_websocket.ConnectionClosed) as closed:
+        ws.receive(timeout=5)
+    assert closed.value.reason == 1008
+
+
+# simple_websocket's client sends the Host header without the port; https is a page behind a TLS proxy
+@pytest.mark.parametrize('origin', ['http://127.0.0.1', 'https://127.0.0.1'])
+def test_console_accepts_its_own_origin(server, origin):
+    ws = simple_websocket.Client(f"ws://{server}/api/vps/1/console", headers={'Origin': origin})
+    # Past the origin check, to the login check
+    assert json.loads(ws.receive(timeout=5)) == {'type': 'error', 'message': 'Please login to access this page'}
+
+
+def test_session_cookie_is_same_site_lax(app, make_user):
+    make_user('alice')
+    response = app.test_client().post('/login', data={'username': 'alice', 'password': 'secret'})
+    assert response.status_code == 302
+    assert 'SameSite=Lax' in response.headers['Set-Cookie']
@@ -0,0 +1,103 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+import app as panel
+
+
+def test_conflicting_operation_gets_409(app, make_user, make_vps, login, fake_lxc, monkeypatch):
+    app.config['OPERATION_QUOTAS'] = {}  # let both requests reach the container
+    user_id = make_user()
+    vps_id = make_vps(user_id, status='running')
+    client = login(user_id)
+    stopping = threading.Event()
+    release = threading.Event()
+
+    def slow_stop(command, timeout=120):
+        if command.startswith('lxc stop'):
+            stopping.set()
+            release.wait(5)
+        return fake_lxc.execute(command, timeout)
+
+    monkeypatch.setattr(panel, 'execute_lxc_sync', slow_stop)
+    responses = {}
+    stop = threading.Thread(target=lambda: responses.update(stop=login(user_id).post(f"/api/vps/{vps_id}/stop")))
+    stop.start()
+    assert stopping.wait(5)
+
+    response = client.post(f"/api/vps/{vps_id}/start")
+    assert response.status_code == 409
+    assert 'busy with a stop' in response.get_json()['message']
+
+    release.set()
+    stop.join(5)
+    assert responses['stop'].status_code == 200
+
+
+def test_identical_operations_share_one_execution():
+    ops = panel.ContainerOperations()
+    entered = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def operation():
+        calls.append(1)
+        entered.set()
+        release.wait(5)
+        return True, 'done'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(ops.run('vps-1-1', 'start', operation)))
+    leader.start()
+    assert entered.wait(5)
+    follower = threading.Thread(target=lambda: results.append(ops.run('vps-1-1', 'start', operation)))
+    follower.start()
+    assert ops.busy('vps-1-1') == 'start'
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert calls == [1]
+    assert results == [(True, 'done'), (True, 'done')]
+    assert ops.busy('vps-1-1') is None
+
+
+HOLD_IN_ANOTHER_PROCESS = '''
+import sys
+import app as panel
+
+def operation():
+    print('holding', flush=True)
+    sys.stdin.readline()
+    return True, 'stopped'
+
+print(panel.container_ops.run('vps-1-1', 'stop', operation), flush=True)
+'''
+
+
+def test_operations_conflict_across_processes(app):
+    # Another worker process, on the same database, is stopping the container
+    other = subprocess.Popen([sys.executable, '-c', HOLD_IN_ANOTHER_PROCESS], stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, cwd=os.getcwd())
+    try:
+        assert other.stdout.readline().strip() == 'holding'
+        ops = panel.ContainerOperations()
+        assert ops.busy('vps-1-1') == 'stop'
+        for action in ('start', 'stop'):
+            # An identical request can't share the other process's result, so it is refused too
+            with pytest.raises(panel.ContainerBusy, match='busy with a stop'):
+                ops.run('vps-1-1', action, lambda: (True, 'ran'))
+        # Other containers are not affected
+        assert ops.run('vps-1-2', 'start', lambda: (True, 'ran')) == (True, 'ran')
+
+        other.stdin.write('\n')
+        other.stdin.flush()
+        assert other.stdout.readline().strip() == "(True, 'stopped')"
+        assert other.wait(10) == 0
+        assert ops.busy('vps-1-1') is None
+        assert ops.run('vps-1-1', 'start', lambda: (True, 'ran')) == (True, 'ran')
+    finally:
+        other.kill()
@@ -0,0 +1,76 @@
+import threading
+
+import app as panel
+
+
+def balance(user_id):
+    return panel.db.session.get(panel.User, user_id).credits
+
+
+def test_reserve_takes_credits_and_capture_keeps_them(app, make_user):
+    user_id = make_user(credits=100)
+    with app.app_context():
+        reservation = panel.reserve_credits(user_id, 30, reference='vps-1-1')
+        panel.db.session.commit()
+        assert balance(user_id) == 70
+
+        assert panel.settle_reservation(reservation.id, capture=True)
+        panel.db.session.commit()
+        assert balance(user_id) == 70
+        kinds = [tx.kind for tx in panel.CreditTransaction.query.order_by(panel.CreditTransaction.id)]
+        assert kinds == ['reserve', 'capture']
+
+
+def test_refund_returns_credits_once(app, make_user):
+    user_id = make_user(credits=100)
+    with app.app_context():
+        reservation = panel.reserve_credits(user_id, 30)
+        panel.db.session.commit()
+
+        assert panel.settle_reservation(reservation.id, capture=False)
+        panel.db.session.commit()
+        assert not panel.settle_reservation(reservation.id, capture=False)
+        assert not panel.settle_reservation(reservation.id, capture=True)
+        panel.db.session.commit()
+        assert balance(user_id) == 100
+        assert sum(tx.amount for tx in panel.CreditTransaction.query) == 0
+
+
+def test_reserve_fails_without_enough_credits(app, make_user):
+    user_id = make_user(credits=20)
+    with app.app_context():
+        assert panel.reserve_credits(user_id, 30) is None
+        assert balance(user_id) == 20
+        assert panel.CreditTransaction.query.count() == 0
+
+
+def test_concurrent_reservations_never_overdraw(app, make_user):
+    user_id = make_user(credits=100)
+    results = []
+
+    def reserve():
+        with app.app_context():
+            results.append(panel.reserve_credits(user_id, 30) is not None)
+            panel.db.session.commit()
+
+    threads = [threading.Thread(target=reserve) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count(True) == 3
+    with app.app_context():
+        assert balance(user_id) == 10
+
+
+def test_container_names_are_never_reused(app, make_user, make_vps):
+    user_id = make_user()
+    make_vps(user_id, name=f"vps-{user_id}-4")
+    with app.app_context():
+        # The counter starts after names that predate it
+        assert panel.next_container_name(user_id) == f"vps-{user_id}-5"
+        panel.db.session.commit()
+        panel.VPS.query.delete()
+        panel.db.session.commit()
+        assert panel.next_container_name(user_id) == f"vps-{user_id}-6"
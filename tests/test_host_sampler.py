@@ -0,0 +1,65 @@
+import io
+import os
+import subprocess
+from types import SimpleNamespace
+
+import pytest
+
+import app as panel
+
+MEMINFO = 'MemTotal:       1000 kB\nMemFree:         100 kB\nMemAvailable:    250 kB\n'
+
+
+@pytest.fixture
+def proc(monkeypatch):
+    """/proc/stat and /proc/meminfo contents the sampler reads, and a 4 KiB-block disk"""
+    files = {'/proc/stat': 'cpu  100 0 100 700 100 0 0 0 0 0\ncpu0 100 0 100 700 100 0 0 0 0 0\n',
+             '/proc/meminfo': MEMINFO}
+    monkeypatch.setattr(panel, 'open', lambda path, *args, **kwargs: io.StringIO(files[path]), raising=False)
+    monkeypatch.setattr(os, 'statvfs', lambda path: SimpleNamespace(f_blocks=100, f_bfree=40, f_bavail=30,
+                                                                     f_frsize=4096))
+    return files
+
+
+def test_sample_reads_proc_and_statvfs(proc):
+    sampler = panel.HostMetricsSampler()
+    # The first CPU reading is the average since boot: 800 of 1000 jiffies idle (idle + iowait)
+    assert {key: value for key, value in sampler.sample().items() if key != 'timestamp'} == \
+        {'cpu': 20.0, 'ram': 75.0, 'disk': 66.67}
+
+    # Later readings cover the interval since the previous one
+    proc['/proc/stat'] = 'cpu  200 0 200 1300 100 0 0 0 0 0\n'
+    assert sampler.sample()['cpu'] == 25.0
+    assert [sample['cpu'] for sample in sampler.history()] == [20.0, 25.0]
+
+
+def test_failed_reader_reports_zero(proc, monkeypatch):
+    def unmounted(path):
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(os, 'statvfs', unmounted)
+    sample = panel.HostMetricsSampler().sample()
+    assert sample['disk'] == 0
+    assert sample['ram'] == 75.0
+
+
+def test_history_keeps_the_newest_samples(proc):
+    sampler = panel.HostMetricsSampler(history=3)
+    for _ in range(5):
+        sampler.sample()
+    assert len(sampler.history()) == 3
+    assert sampler.latest() is sampler.history()[-1]
+
+
+def test_dashboard_renders_without_forking(proc, monkeypatch, make_user, login):
+    sampler = panel.HostMetricsSampler(interval=60)
+    monkeypatch.setattr(panel, 'host_sampler', sampler)
+
+    def no_fork(*args, **kwargs):
+        raise AssertionError(f"page render started a process: {args}")
+    monkeypatch.setattr(subprocess, 'Popen', no_fork)
+    try:
+        response = login(make_user()).get('/dashboard')
+    finally:
+        sampler.stop()
+    assert response.status_code == 200
+    assert b'75.0' in response.data
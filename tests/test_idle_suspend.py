@@ -0,0 +1,100 @@
+import time
+
+import pytest
+
+import app as panel
+
+
+@pytest.fixture
+def suspender(monkeypatch):
+    monkeypatch.setattr(panel.container_inventory, 'containers', {})
+    return panel.IdleSuspender({'Starter': 600, 'Pro': None}, cpu_percent=2.0, network_bytes=2048)
+
+
+def running(cpu_seconds=0, network_bytes=0):
+    return {'status': 'Running', 'cpu_seconds': cpu_seconds * 1e9, 'network_bytes': network_bytes}
+
+
+def observe_idle(suspender, names, seconds):
+    """Two snapshots `seconds` apart with no CPU or network use in between"""
+    now = time.time()
+    for timestamp in (now - seconds, now):
+        suspender.observe({name: running() for name in names}, timestamp)
+
+
+def vps_row(app, vps_id):
+    with app.app_context():
+        vps = panel.db.session.get(panel.VPS, vps_id)
+        return vps.status, vps.suspended_at
+
+
+def test_activity_resets_the_idle_clock(suspender):
+    suspender.observe({'vps-a': running(), 'vps-b': running()}, 1000)
+    suspender.observe({'vps-a': running(1), 'vps-b': running(0, 1000)}, 1100)
+    assert suspender.idle_since == {'vps-a': 1000, 'vps-b': 1000}
+    # 5% CPU on vps-a and 5 KB/s of traffic on vps-b
+    suspender.observe({'vps-a': running(6), 'vps-b': running(0, 501000)}, 1200)
+    assert suspender.idle_since == {}
+    suspender.observe({'vps-a': running(6), 'vps-b': running(0, 501000), 'vps-c': running()}, 1300)
+    assert suspender.idle_since == {'vps-a': 1200, 'vps-b': 1200}
+
+
+def test_idle_vps_is_suspended_and_resumed_by_start(app, suspender, make_user, make_vps, login, fake_lxc):
+    user_id = make_user()
+    idle = make_vps(user_id, name='vps-idle')
+    recent = make_vps(user_id, name='vps-recent')
+    exempt = make_vps(user_id, name='vps-pro', plan='Pro')
+    observe_idle(suspender, ['vps-idle', 'vps-pro'], 900)
+    suspender.observe({'vps-idle': running(), 'vps-pro': running(), 'vps-recent': running()}, time.time())
+    with app.app_context():
+        assert suspender.suspend_idle() == 1
+
+    status, suspended_at = vps_row(app, idle)
+    assert status == 'suspended' and suspended_at is not None
+    assert fake_lxc.containers['vps-idle']['status'] == 'Stopped'
+    assert vps_row(app, recent)[0] == vps_row(app, exempt)[0] == 'running'
+    with app.app_context():
+        assert suspender.status()['reclaimed_ram_mb'] == 4 * 1024
+
+    response = login(user_id).post(f"/api/vps/{idle}/start")
+    assert response.status_code == 200
+    assert vps_row(app, idle) == ('running', None)
+    assert fake_lxc.containers['vps-idle']['status'] == 'Running'
+
+
+def test_frozen_vps_is_resumed_with_unfreeze(app, suspender, make_user, make_vps, login, fake_lxc):
+    suspender.mode = 'freeze'
+    user_id = make_user()
+    vps_id = make_vps(user_id, name='vps-idle')
+    observe_idle(suspender, ['vps-idle'], 900)
+    with app.app_context():
+        assert suspender.suspend_idle() == 1
+    assert fake_lxc.containers['vps-idle']['status'] == 'Frozen'
+
+    assert login(user_id).post(f"/api/vps/{vps_id}/start").status_code == 200
+    assert fake_lxc.containers['vps-idle']['status'] == 'Running'
+    assert vps_row(app, vps_id)[0] == 'running'
+
+
+def test_vps_with_an_open_console_or_operation_is_not_suspended(app, suspender, make_user, make_vps):
+    user_id = make_user()
+    console = make_vps(user_id, name='vps-console')
+    busy = make_vps(user_id, name='vps-busy')
+    observe_idle(suspender, ['vps-console', 'vps-busy'], 900)
+    with app.app_context():
+        lease = panel.rate_limiter.acquire('console:vps-console', 1)
+        operation = panel.rate_limiter.acquire(panel.container_ops.lease_key('vps-busy', panel.DEFAULT_NODE), 1,
+                                               action='stop')
+        assert suspender.suspend_idle() == 0
+        panel.rate_limiter.release(lease)
+        panel.rate_limiter.release(operation)
+    assert vps_row(app, console)[0] == vps_row(app, busy)[0] == 'running'
+
+
+def test_failed_suspend_puts_the_vps_back(app, suspender, make_user, make_vps, fake_lxc):
+    vps_id = make_vps(make_user(), name='vps-idle')
+    del fake_lxc.containers['vps-idle']
+    observe_idle(suspender, ['vps-idle'], 900)
+    with app.app_context():
+        assert suspender.suspend_idle() == 0
+    assert vps_row(app, vps_id) == ('running', None)
@@ -0,0 +1,85 @@
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from instrumentation import Gauge, Registry
+
+
+@pytest.fixture
+def busy_switching():
+    # Switch threads as often as possible so unlocked read-modify-writes would interleave
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    yield
+    sys.setswitchinterval(interval)
+
+
+def test_concurrent_inc_and_dec_leave_the_gauge_balanced(busy_switching):
+    gauge = Gauge('in_flight', 'Requests in flight')
+
+    def request_cycle():
+        for _ in range(20000):
+            gauge.inc()
+            gauge.dec()
+
+    threads = [threading.Thread(target=request_cycle) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert gauge.samples() == ['in_flight 0']
+
+
+def test_labelled_gauge_renders_each_series():
+    gauge = Gauge('queued', 'Queued jobs', ('pool',))
+    gauge.inc('provision', amount=3)
+    gauge.dec('provision')
+    gauge.set(5, 'backup')
+    assert gauge.render() == ['# HELP queued Queued jobs', '# TYPE queued gauge',
+                              'queued{pool="provision"} 2', 'queued{pool="backup"} 5']
+
+
+OTHER_WORKER = '''
+import sys
+from instrumentation import Registry
+
+registry = Registry(directory=sys.argv[1])
+registry.counter('requests_total', 'Requests served', ('status',)).inc('200', amount=3)
+registry.histogram('latency_seconds', 'Request latency', buckets=(0.1, 1)).observe(0.5)
+registry.gauge('in_flight', 'Requests in flight', collect=lambda: {(): 2})
+registry.start()
+print('dumped', flush=True)
+sys.stdin.readline()
+'''
+
+
+def test_workers_sharing_a_directory_add_up(tmp_path):
+    registry = Registry(directory=str(tmp_path))
+    registry.counter('requests_total', 'Requests served', ('status',)).inc('200')
+    registry.histogram('latency_seconds', 'Request latency', buckets=(0.1, 1)).observe(2)
+    registry.gauge('in_flight', 'Requests in flight', collect=lambda: {(): 1})
+    other = subprocess.Popen([sys.executable, '-c', OTHER_WORKER, str(tmp_path)], stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, text=True, cwd=os.getcwd())
+    try:
+        assert other.stdout.readline().strip() == 'dumped'
+        lines = registry.render().splitlines()
+        assert 'requests_total{status="200"} 4' in lines
+        assert 'latency_seconds_bucket{le="1"} 1' in lines
+        assert 'latency_seconds_bucket{le="+Inf"} 2' in lines
+        assert 'latency_seconds_sum 2.5' in lines
+        assert f'in_flight{{pid="{os.getpid()}"}} 1' in lines
+        assert f'in_flight{{pid="{other.pid}"}} 2' in lines
+
+        other.stdin.write('\n')
+        other.stdin.flush()
+        assert other.wait(10) == 0
+        lines = registry.render().splitlines()
+        # An exited worker's requests still count, so the total doesn't drop; its gauges are gone
+        assert 'requests_total{status="200"} 4' in lines
+        assert 'latency_seconds_count 2' in lines
+        assert [line for line in lines if line.startswith('in_flight')] == [f'in_flight{{pid="{os.getpid()}"}} 1']
+    finally:
+        other.kill()
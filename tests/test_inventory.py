@@ -0,0 +1,171 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import app as panel
+from lxd_client import LXDClient
+
+
+@pytest.fixture(autouse=True)
+def leadership(monkeypatch):
+    """A fresh election per test, given up afterwards"""
+    election = panel.Leadership(ttl=30)
+    monkeypatch.setattr(panel, 'leadership', election)
+    yield election
+    election.stop()
+
+
+def stats(status, host=panel.DEFAULT_NODE):
+    return {'status': status, 'host': host, 'memory_mb': 64, 'cpu_seconds': 0, 'network_bytes': 0}
+
+
+def vps_status(app, vps_id):
+    with app.app_context():
+        return panel.db.session.get(panel.VPS, vps_id).status
+
+
+LEAD_IN_ANOTHER_PROCESS = '''
+import sys
+import app as panel
+
+with panel.app.app_context():
+    print(panel.leadership.elect(), flush=True)
+sys.stdin.readline()
+'''
+
+
+def test_one_process_leads(app, leadership):
+    other = subprocess.Popen([sys.executable, '-c', LEAD_IN_ANOTHER_PROCESS], stdin=subprocess.PIPE,
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, cwd=os.getcwd())
+    try:
+        assert other.stdout.readline().strip() == 'True'
+        with app.app_context():
+            assert not leadership.elect()
+        assert not leadership.is_leader()
+
+        other.stdin.write('\n')
+        other.stdin.flush()
+        assert other.wait(10) == 0
+        # The leader gave its lease up on exit, so nobody waits for it to expire
+        with app.app_context():
+            assert leadership.elect()
+        assert leadership.is_leader()
+    finally:
+        other.kill()
+
+
+def test_leadership_moves_when_the_lease_expires(app, leadership):
+    stalled = panel.Leadership(ttl=0.1)
+    with app.app_context():
+        assert stalled.elect()
+        assert not leadership.elect()
+        time.sleep(0.2)
+        assert not stalled.is_leader()
+        assert leadership.elect()
+        # The old leader finds its lease taken and stays a follower
+        assert not stalled.elect()
+    assert leadership.is_leader()
+
+
+def test_followers_read_the_leaders_inventory(app, leadership, make_user, make_vps, fake_lxc):
+    user_id = make_user()
+    make_vps(user_id, name='vps-a')
+    leader = panel.ContainerInventory()
+    follower = panel.ContainerInventory()
+    with app.app_context():
+        assert leadership.elect()
+        assert leader.refresh()
+        commands = fake_lxc.commands
+
+        assert follower.get('vps-a')['status'] == 'Running'
+        assert follower.updated_at == leader.updated_at
+        assert not follower.load()
+
+        fake_lxc.containers['vps-a']['status'] = 'Stopped'
+        assert leader.refresh()
+        commands = fake_lxc.commands - commands
+        assert follower.load()
+        assert follower.get('vps-a')['status'] == 'Stopped'
+    # Only the leader listed containers
+    assert commands == 1
+
+
+def test_unreachable_node_is_marked_stale_for_followers(app, leadership, monkeypatch):
+    monkeypatch.setitem(panel.lxd_nodes, 'node2', LXDClient(os.environ['LXD_SOCKET']))
+    follower = panel.ContainerInventory()
+    with app.app_context():
+        leadership.publish({f"inventory:{panel.DEFAULT_NODE}": {'vps-a': stats('Running')},
+                            'inventory:node2': {'vps-b': stats('Running', 'node2')}}, 100)
+        # node2 could not be listed in the leader's next pass
+        leadership.publish({f"inventory:{panel.DEFAULT_NODE}": {'vps-a': stats('Stopped')}}, 110)
+        assert follower.load()
+    assert follower.updated_at == 110
+    assert follower.containers['vps-a'] == stats('Stopped')
+    assert follower.containers['vps-b']['status'] == 'Running'
+    assert follower.containers['vps-b']['stale']
+
+
+def test_only_the_leader_reconciles(app, leadership, make_user, make_vps, fake_lxc, wait_until):
+    user_id = make_user()
+    vps_id = make_vps(user_id, name='vps-a', status='stopped')
+    fake_lxc.containers['vps-a']['status'] = 'Running'
+    with app.app_context():
+        other = panel.rate_limiter.acquire('leader', 1, ttl=30, action='other')
+        leadership.publish({f"inventory:{panel.DEFAULT_NODE}": {'vps-a': stats('Running')}}, time.time())
+    commands = fake_lxc.commands
+    inventory = panel.ContainerInventory(interval=0.05)
+    inventory.start()
+    try:
+        assert wait_until(lambda: inventory.containers.get('vps-a'))
+        time.sleep(0.2)
+        assert fake_lxc.commands == commands
+        assert vps_status(app, vps_id) == 'stopped'
+
+        # The other process exits; this one takes over and corrects the drifted row
+        with app.app_context():
+            panel.rate_limiter.release(other)
+            assert leadership.elect()
+        assert wait_until(lambda: vps_status(app, vps_id) == 'running')
+        assert fake_lxc.commands > commands
+    finally:
+        inventory.stop()
+
+
+def test_followers_place_vps_on_the_leaders_capacity(app, leadership, monkeypatch):
+    monkeypatch.setattr(panel.NodeScheduler, '_probe', lambda self, host, client: pytest.fail('a follower probed a node'))
+    scheduler = panel.NodeScheduler()
+    with app.app_context():
+        leadership.publish({'capacity': {panel.DEFAULT_NODE: {'online': True, 'capacity_known': False,
+                                                              'updated_at': 100}}}, 100)
+        assert scheduler.place('Starter') == panel.DEFAULT_NODE
+        assert not scheduler.load()
+
+
+def test_reconcile_corrects_drifted_status(app, make_user, make_vps, fake_lxc):
+    user_id = make_user()
+    drifted = make_vps(user_id, name='vps-drifted', status='running')
+    in_sync = make_vps(user_id, name='vps-in-sync', status='running')
+    suspended = make_vps(user_id, name='vps-suspended', status='suspended')
+    resumed = make_vps(user_id, name='vps-resumed', status='suspended')
+    missing = make_vps(user_id, name='vps-missing', status='stopped')
+    fake_lxc.containers['vps-drifted']['status'] = 'Stopped'
+    fake_lxc.containers['vps-suspended']['status'] = 'Stopped'
+    fake_lxc.containers['vps-resumed']['status'] = 'Running'
+    del fake_lxc.containers['vps-missing']
+    inventory = panel.ContainerInventory()
+    with app.app_context():
+        versions = dict(panel.db.session.execute(panel.db.select(panel.VPS.id, panel.VPS.version)).all())
+        commands = fake_lxc.commands
+        assert inventory.refresh()
+        # One listing covers every container on the node
+        assert fake_lxc.commands - commands == 1
+        assert inventory.reconcile() == 2
+        assert inventory.reconcile() == 0
+        rows = {vps.id: (vps.status, vps.version) for vps in panel.VPS.query}
+    assert rows[drifted] == ('stopped', versions[drifted] + 1)
+    assert rows[resumed] == ('running', versions[resumed] + 1)
+    for vps_id, status in ((in_sync, 'running'), (suspended, 'suspended'), (missing, 'stopped')):
+        assert rows[vps_id] == (status, versions[vps_id])
@@ -0,0 +1,160 @@
+import json
+import os
+import shutil
+import socket
+import socketserver
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+
+import app as panel
+from lxd_client import LXDClient, LXDConnectionError, LXDError
+
+
+class FakeLXDHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, like LXD
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+        self.server.requests.append((self.command, self.path, body))
+        reply = self.server.routes.get((self.command, self.path), {'type': 'error', 'error': 'not found',
+                                                                   'error_code': 404})
+        payload = json.dumps(reply).encode()
+        self.send_response(reply.get('error_code') or 200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        if self.server.drop_idle:
+            # Close without saying so, like a daemon dropping an idle keep-alive connection
+            self.close_connection = True
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeLXDServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path):
+        super().__init__(path, FakeLXDHandler)
+        self.routes = {}
+        self.requests = []
+        self.connections = 0
+        self.drop_idle = False
+
+
+def sync(metadata=None):
+    return {'type': 'sync', 'status_code': 200, 'metadata': metadata}
+
+
+@pytest.fixture
+def lxd():
+    # Unix socket paths are limited to about 100 characters, too few for pytest's tmp_path
+    workdir = tempfile.mkdtemp(prefix='lxd-')
+    server = FakeLXDServer(os.path.join(workdir, 'unix.socket'))
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+@pytest.fixture
+def client(lxd):
+    client = LXDClient(lxd.server_address, timeout=30)
+    yield client
+    client.close()
+
+
+def test_requests_reuse_one_pooled_connection(lxd, client):
+    lxd.routes[('GET', '/1.0/resources')] = sync({'cpu': {'total': 8}})
+    for _ in range(3):
+        assert client.resources() == {'cpu': {'total': 8}}
+    assert lxd.connections == 1
+
+
+def test_stale_pooled_connection_is_retried_once_on_a_fresh_one(lxd, client):
+    lxd.routes[('GET', '/1.0/resources')] = sync({'cpu': {'total': 8}})
+    lxd.drop_idle = True
+    assert client.resources() == {'cpu': {'total': 8}}
+    assert client.resources() == {'cpu': {'total': 8}}
+    assert lxd.connections == 2
+    assert len(lxd.requests) == 2
+
+
+def test_unreachable_socket_raises_connection_error(lxd):
+    client = LXDClient(lxd.server_address + '.missing')
+    with pytest.raises(LXDConnectionError):
+        client.resources()
+
+
+def test_async_operations_are_waited_for(lxd, client):
+    lxd.routes[('PUT', '/1.0/instances/vps-1-1/state')] = {'type': 'async', 'operation': '/1.0/operations/abc'}
+    lxd.routes[('GET', '/1.0/operations/abc/wait?timeout=30')] = sync({'status_code': 200, 'status': 'Success'})
+    client.change_state('vps-1-1', 'start')
+    assert lxd.requests[0] == ('PUT', '/1.0/instances/vps-1-1/state',
+                               {'action': 'start', 'timeout': 30, 'force': False})
+    assert lxd.requests[1][:2] == ('GET', '/1.0/operations/abc/wait?timeout=30')
+
+
+@pytest.mark.parametrize('status_code', [100, 103, 105, 106])
+def test_operations_still_running_after_the_wait_time_out(lxd, client, status_code):
+    lxd.routes[('GET', '/1.0/operations/abc/wait?timeout=5')] = sync({'status_code': status_code})
+    with pytest.raises(LXDError) as error:
+        client.wait_operation('/1.0/operations/abc', timeout=5)
+    assert error.value.status_code == 408
+
+
+def test_failed_operations_raise_their_error(lxd, client):
+    lxd.routes[('GET', '/1.0/operations/abc/wait?timeout=5')] = sync({'status_code': 400, 'err': 'no space left'})
+    with pytest.raises(LXDError, match='no space left') as error:
+        client.wait_operation('/1.0/operations/abc', timeout=5)
+    assert error.value.status_code == 400
+
+
+def test_error_responses_raise(lxd, client):
+    with pytest.raises(LXDError) as error:
+        client.get_state('missing')
+    assert error.value.status_code == 404
+
+
+def test_lxc_call_uses_the_api_when_the_socket_exists(lxd, client, fake_lxc, monkeypatch):
+    monkeypatch.setitem(panel.lxd_nodes, panel.DEFAULT_NODE, client)
+    lxd.routes[('PUT', '/1.0/instances/vps-1-1/state')] = sync()
+    fake_lxc.add('vps-1-1')
+    assert panel.lxc_power('vps-1-1', 'stop') == (True, None)
+    assert fake_lxc.commands == 0
+
+
+def test_lxc_call_falls_back_to_the_cli_without_a_socket(app, fake_lxc):
+    assert not panel.lxd_nodes[panel.DEFAULT_NODE].available()
+    fake_lxc.add('vps-1-1')
+    assert panel.lxc_power('vps-1-1', 'stop') == (True, '')
+    assert fake_lxc.containers['vps-1-1']['status'] == 'Stopped'
+
+
+def test_lxc_call_falls_back_to_the_cli_when_the_socket_refuses(fake_lxc, monkeypatch):
+    # A socket file left behind by a daemon that is no longer listening
+    workdir = tempfile.mkdtemp(prefix='lxd-')
+    path = os.path.join(workdir, 'unix.socket')
+    stale = socket.socket(socket.AF_UNIX)
+    stale.bind(path)
+    stale.close()
+    monkeypatch.setitem(panel.lxd_nodes, panel.DEFAULT_NODE, LXDClient(path))
+    fake_lxc.add('vps-1-1')
+    try:
+        assert panel.lxc_power('vps-1-1', 'stop') == (True, '')
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    assert fake_lxc.containers['vps-1-1']['status'] == 'Stopped'
@@ -0,0 +1,72 @@
+import argparse
+import csv
+
+import pytest
+
+import app as panel
+import manage_users
+from conftest import PASSWORD_HASH
+
+
+def run_import(path, **options):
+    args = argparse.Namespace(file=str(path), format=None, batch_size=1000, workers=1, on_conflict='skip')
+    vars(args).update(options)
+    return manage_users.import_users(args)
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['username', 'email', 'password_hash', 'status', 'created_at'])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def test_batch_mixing_dated_and_undated_rows_imports(app, tmp_path):
+    path = tmp_path / 'users.csv'
+    write_csv(path, [
+        {'username': 'dated', 'email': 'dated@test.local', 'password_hash': PASSWORD_HASH,
+         'created_at': '2024-01-02T03:04:05Z'},
+        {'username': 'undated', 'email': 'undated@test.local', 'password_hash': PASSWORD_HASH},
+    ])
+    assert run_import(path) == 0
+    with app.app_context():
+        users = {user.username: user for user in panel.User.query}
+    assert users['dated'].created_at.isoformat() == '2024-01-02T03:04:05'
+    assert users['undated'].created_at is not None
+
+
+def test_status_is_imported_and_validated(app, tmp_path):
+    path = tmp_path / 'users.csv'
+    write_csv(path, [
+        {'username': 'leaving', 'email': 'leaving@test.local', 'password_hash': PASSWORD_HASH, 'status': 'deleting'},
+        {'username': 'default', 'email': 'default@test.local', 'password_hash': PASSWORD_HASH},
+        {'username': 'bogus', 'email': 'bogus@test.local', 'password_hash': PASSWORD_HASH, 'status': 'banned'},
+    ])
+    assert run_import(path) == 1  # the invalid row is reported
+    with app.app_context():
+        statuses = dict(panel.db.session.query(panel.User.username, panel.User.status))
+    assert statuses == {'leaving': 'deleting', 'default': 'active'}
+
+
+def test_export_round_trips_through_import(app, make_user, tmp_path):
+    make_user('alice', status='deleting')
+    path = tmp_path / 'users.jsonl'
+    args = argparse.Namespace(file=str(path), format=None, batch_size=10, include_password_hashes=True)
+    assert manage_users.export_users(args) == 0
+    with app.app_context():
+        panel.User.query.delete()
+        panel.db.session.commit()
+
+    assert run_import(path) == 0
+    with app.app_context():
+        user = panel.User.query.one()
+    assert (user.username, user.status, user.password) == ('alice', 'deleting', PASSWORD_HASH)
+
+
+@pytest.mark.parametrize('row, message', [
+    ({'username': 'a', 'email': 'a@test.local', 'password': 'x', 'status': 'banned'}, 'invalid status'),
+    ({'username': 'a', 'email': 'a@test.local', 'password': 'x', 'created_at': 'yesterday'}, 'invalid created_at'),
+])
+def test_parse_row_rejects_bad_values(row, message):
+    with pytest.raises(ValueError, match=message):
+        manage_users.parse_row(row)
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+import app as panel
+
+# Two hours ago, on the hour, so every bucket of the test has ended
+HOUR = int(time.time() // 3600) * 3600 - 2 * 3600
+
+
+@pytest.fixture
+def vps(app, make_user, make_vps):
+    vps_id = make_vps(make_user(), name='vps-a')
+    with app.app_context():
+        yield panel.db.session.get(panel.VPS, vps_id)
+
+
+def new_store():
+    store = panel.MetricsStore(raw_points=1000, retention={60: 2 * 86400, 3600: 30 * 86400})
+    store.minute_flushed = store.hour_flushed = HOUR
+    return store
+
+
+def record_two_minutes(store):
+    """A sample every 10 s from HOUR to HOUR + 120 at 50% CPU; 100 MB in the first minute, 300 MB after"""
+    for offset in range(0, 130, 10):
+        store.record({'vps-a': {'status': 'Running', 'cpu_seconds': offset * 0.5e9,
+                                'memory_mb': 100 if offset < 60 else 300}}, HOUR + offset)
+
+
+def rollups(resolution):
+    return [(row.bucket_start - HOUR, row.cpu_avg, row.cpu_max, row.memory_avg, row.memory_max, row.samples)
+            for row in panel.VPSMetric.query.filter_by(resolution=resolution).order_by(panel.VPSMetric.bucket_start)]
+
+
+def test_flush_rolls_raw_samples_up_per_minute(vps):
+    store = new_store()
+    record_two_minutes(store)
+    store.flush(now=HOUR + 125)
+    # The first sample has no previous CPU reading; the one at +120 s is in a minute still running
+    assert rollups(60) == [(0, 41.67, 50, 100, 100, 6), (60, 50, 50, 300, 300, 6)]
+    assert rollups(3600) == []
+
+    # Another worker process flushing the same buckets adds nothing
+    other = new_store()
+    record_two_minutes(other)
+    other.flush(now=HOUR + 125)
+    assert len(rollups(60)) == 2
+
+
+def test_flush_rolls_minutes_up_per_hour_and_prunes(vps):
+    store = new_store()
+    record_two_minutes(store)
+    store.flush(now=HOUR + 125)
+    store.retention[60] = 3000
+    store.flush(now=HOUR + 3605)
+
+    [(start, cpu_avg, cpu_max, memory_avg, memory_max, samples)] = rollups(3600)
+    assert (start, cpu_max, memory_max, samples) == (0, 50, 300, 13)
+    # Averages are weighted by the samples behind each minute
+    assert cpu_avg == pytest.approx(600 / 13, abs=0.01)
+    assert memory_avg == pytest.approx(2700 / 13, abs=0.01)
+    # Minute rollups older than their retention are gone
+    assert rollups(60) == []
+
+
+def test_history_picks_the_resolution_for_the_range(vps):
+    store = new_store()
+    record_two_minutes(store)
+    store.flush(now=HOUR + 3605)
+    now = time.time()
+    store.record({'vps-a': {'status': 'Running', 'cpu_seconds': 0, 'memory_mb': 50}}, now - 20)
+    store.record({'vps-a': {'status': 'Running', 'cpu_seconds': 2e9, 'memory_mb': 70}}, now - 10)
+
+    resolution, points = store.history(vps, 3600)
+    assert resolution == 0
+    assert [(point['cpu'], point['memory_mb']) for point in points] == [(0, 50), (20, 70)]
+
+    resolution, points = store.history(vps, 6 * 3600)
+    assert resolution == 60
+    assert [point['t'] - HOUR for point in points] == [0, 60, 120]
+
+    resolution, points = store.history(vps, 7 * 86400)
+    assert resolution == 3600
+    assert [(point['t'], point['cpu_max'], point['memory_max']) for point in points] == [(HOUR, 50, 300)]
+
+
+def test_stopped_containers_leave_the_raw_series(app):
+    store = new_store()
+    store.record({'vps-a': {'status': 'Running', 'cpu_seconds': 0, 'memory_mb': 10}}, HOUR)
+    assert store.raw_points_for('vps-a')
+    store.record({'vps-a': {'status': 'Stopped', 'cpu_seconds': 0, 'memory_mb': 0}}, HOUR + 10)
+    assert store.raw_points_for('vps-a') == []
@@ -0,0 +1,51 @@
+import app as panel
+
+
+def create(client, plan='Starter'):
+    return client.post('/vps/create', data={'plan': plan, 'processor': 'Intel'},
+                       headers={'Accept': 'application/json'})
+
+
+def job(app, job_id):
+    with app.app_context():
+        return panel.db.session.get(panel.ProvisionJob, job_id).to_dict()
+
+
+def test_create_returns_a_job_that_launches_in_the_background(app, make_user, login, fake_lxc, wait_until):
+    user_id = make_user(credits=1000)
+    response = create(login(user_id))
+    assert response.status_code == 202
+    body = response.get_json()
+
+    assert wait_until(lambda: job(app, body['job_id'])['status'] == 'completed')
+    with app.app_context():
+        vps = panel.db.session.get(panel.VPS, body['vps_id'])
+        assert vps.status == 'running'
+        assert fake_lxc.containers[vps.container_name]['status'] == 'Running'
+        # The reserved price is captured
+        assert panel.db.session.get(panel.User, user_id).credits == 1000 - panel.VPS_PLANS['Starter']['price']['Intel']
+
+
+def test_failed_launch_removes_the_vps_and_refunds(app, make_user, login, monkeypatch, wait_until):
+    monkeypatch.setattr(panel, 'provision_container', lambda *args: (False, 'no space left on device'))
+    user_id = make_user(credits=1000)
+    body = create(login(user_id)).get_json()
+
+    assert wait_until(lambda: job(app, body['job_id'])['status'] == 'failed')
+    assert job(app, body['job_id'])['error'] == 'no space left on device'
+    with app.app_context():
+        assert panel.db.session.get(panel.VPS, body['vps_id']) is None
+        assert panel.db.session.get(panel.User, user_id).credits == 1000
+
+
+def test_a_job_is_claimed_once(app, make_user, make_vps):
+    user_id = make_user()
+    vps_id = make_vps(user_id, status='provisioning')
+    with app.app_context():
+        job = panel.ProvisionJob(user_id=user_id, vps_id=vps_id, container_name='vps-claimed',
+                                 memory_limit='1024MB', cpu_limit='1')
+        panel.db.session.add(job)
+        panel.db.session.commit()
+        # Worker processes recovering the same queued row race for it
+        assert panel.provision_queue._claim(job.id)
+        assert not panel.provision_queue._claim(job.id)
@@ -0,0 +1,103 @@
+import json
+
+import app as panel
+
+
+def test_token_bucket_refuses_once_empty_and_reports_retry_after(app):
+    limiter = panel.RateLimiter(backend='sqlite')
+    with app.app_context():
+        assert limiter.take('1:power', 2, 60) == 0
+        assert limiter.take('1:power', 2, 60) == 0
+        retry_after = limiter.take('1:power', 2, 60)
+        assert 0 < retry_after <= 30
+        # Buckets are per key
+        assert limiter.take('2:power', 2, 60) == 0
+
+
+def test_memory_backend_matches_sqlite_backend():
+    limiter = panel.RateLimiter(backend='memory')
+    assert limiter.take('1:power', 1, 60) == 0
+    assert limiter.take('1:power', 1, 60) > 0
+
+
+def test_leases_cap_concurrent_operations(app):
+    limiter = panel.RateLimiter(backend='sqlite')
+    with app.app_context():
+        first = limiter.acquire('1:Starter', 2)
+        second = limiter.acquire('1:Starter', 2)
+        assert first and second
+        assert limiter.acquire('1:Starter', 2) is None
+        assert limiter.held('1:Starter')
+        limiter.release(first)
+        assert limiter.acquire('1:Starter', 2) is not None
+
+
+def test_power_requests_return_429_with_retry_after(app, make_user, make_vps, login):
+    app.config['RATE_LIMITS'] = {'user': {'power': (2, 60)}, 'admin': None}
+    user_id = make_user()
+    vps_id = make_vps(user_id)
+    client = login(user_id)
+
+    assert client.post(f"/api/vps/{vps_id}/restart").status_code == 200
+    assert client.post(f"/api/vps/{vps_id}/restart").status_code == 200
+    response = client.post(f"/api/vps/{vps_id}/restart")
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+
+
+def test_create_quota_counts_vps_still_provisioning(app, make_user, make_vps, login):
+    app.config['OPERATION_QUOTAS'] = {'Starter': 1}
+    user_id = make_user()
+    make_vps(user_id, plan='Starter', status='provisioning')
+    response = login(user_id).post('/vps/create', data={'plan': 'Starter', 'processor': 'Intel'},
+                                   headers={'Accept': 'application/json'})
+    assert response.status_code == 429
+    assert 'Only 1 Starter VPS' in response.get_json()['message']
+
+
+def test_browser_form_posts_get_a_429_page(app, make_user, make_vps, login):
+    app.config['OPERATION_QUOTAS'] = {'Starter': 1}
+    user_id = make_user()
+    make_vps(user_id, plan='Starter', status='provisioning')
+    client = login(user_id)
+    response = client.post('/vps/create', data={'plan': 'Starter', 'processor': 'Intel'},
+                           headers={'Accept': 'text/html'})
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '30'
+    page = response.get_data(as_text=True)
+    assert 'Only 1 Starter VPS can be provisioned at a time. Try again in 30 seconds.' in page
+    # The message was shown on the 429 page, not left for the next one
+    assert 'Only 1 Starter VPS' not in client.get('/dashboard').get_data(as_text=True)
+
+def test_admin_override_lifts_a_users_limit(app, make_user, make_vps, login):
+    app.config['RATE_LIMITS'] = {'user': {'power': (1, 60)}, 'admin': None}
+    user_id = make_user(rate_limit_overrides=json.dumps({'power': None}))
+    vps_id = make_vps(user_id)
+    client = login(user_id)
+    for _ in range(3):
+        assert client.post(f"/api/vps/{vps_id}/restart").status_code == 200
+
+
+def test_users_are_throttled_and_admins_are_not(app, make_user, make_vps, login):
+    app.config['RATE_LIMITS'] = {'user': {'power': (1, 60)}, 'admin': None}
+    user_id = make_user('alice')
+    admin_id = make_user('root', role='admin')
+    vps_id = make_vps(user_id)
+    user, admin = login(user_id), login(admin_id)
+
+    assert user.post(f"/api/vps/{vps_id}/restart").status_code == 200
+    assert user.post(f"/api/vps/{vps_id}/restart").status_code == 429
+    for _ in range(3):
+        assert admin.post(f"/api/vps/{vps_id}/restart").status_code == 200
+
+
+def test_benchmark_fakes_lift_every_limit(app, make_user, make_vps, login, fake_lxc, monkeypatch):
+    import benchmark
+    for reader in ('_read_cpu_usage', '_read_ram_usage', '_read_disk_usage'):
+        monkeypatch.setattr(panel.host_sampler, reader, getattr(panel.host_sampler, reader))
+    benchmark.install_fakes(fake_lxc)
+    user_id = make_user()
+    vps_id = make_vps(user_id)
+    client = login(user_id)
+    for _ in range(15):
+        assert client.post(f"/api/vps/{vps_id}/restart").status_code == 200
@@ -0,0 +1,66 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+import app as panel
+
+
+@contextmanager
+def statements():
+    """SQL statements run inside the block; needs an app context"""
+    executed = []
+    listener = lambda conn, cursor, statement, *args: executed.append(statement)  # noqa: E731
+    event.listen(panel.db.engine, 'before_cursor_execute', listener)
+    try:
+        yield executed
+    finally:
+        event.remove(panel.db.engine, 'before_cursor_execute', listener)
+
+
+def test_settings_are_revalidated_by_version(app):
+    cache = panel.SettingsCache(ttl=60)
+    with app.app_context():
+        settings = cache.get()
+        with statements() as sql:
+            assert cache.get() is settings
+        assert sql == []
+
+        # Once the TTL has passed, an unchanged version costs one small query
+        cache._checked_at = 0
+        with statements() as sql:
+            assert cache.get() is settings
+        assert len(sql) == 1 and 'settings.version' in sql[0]
+
+        # Saved by another worker process
+        panel.db.session.execute(panel.db.update(panel.Settings)
+                                 .values(panel_name='Renamed', version=panel.Settings.version + 1))
+        panel.db.session.commit()
+        assert cache.get().panel_name == 'GVM Panel'
+        cache._checked_at = 0
+        assert cache.get().panel_name == 'Renamed'
+
+
+def test_saved_settings_show_on_the_next_page(app, make_user, login):
+    admin = login(make_user('admin', role='admin'))
+    assert b'GVM Panel' in admin.get('/dashboard').data
+    admin.post('/admin/settings', data={'panel_name': 'Hosting Co', 'logo_url': '', 'background_url': '',
+                                        'welcome_text': 'Hi'})
+    assert b'Hosting Co' in admin.get('/dashboard').data
+
+
+def test_user_is_loaded_once_per_request(app, make_user, make_vps, login):
+    user_id = make_user()
+    make_vps(user_id)
+    client = login(user_id)
+    client.get('/dashboard')
+    with app.app_context(), statements() as sql:
+        assert client.get('/dashboard').status_code == 200
+    assert len([statement for statement in sql
+                if statement.startswith('SELECT user.id') and 'WHERE user.id = ?' in statement]) == 1
+
+
+def test_session_of_a_user_being_deleted_is_refused(app, make_user, login):
+    user_id = make_user(status='deleting')
+    response = login(user_id).get('/dashboard')
+    assert response.status_code == 302
+    assert '/login' in response.headers['Location']
@@ -0,0 +1,53 @@
+import app as panel
+
+
+def open_stream(client):
+    return client.get('/api/stream/stats', buffered=False)
+
+
+def test_streams_are_capped_per_user(app, make_user, login):
+    app.config['STREAM_MAX_PER_USER'] = 2
+    client = login(make_user())
+    streams = [open_stream(client) for _ in range(2)]
+    assert [stream.status_code for stream in streams] == [200, 200]
+
+    refused = open_stream(client)
+    assert refused.status_code == 429
+    assert refused.headers['Retry-After']
+
+    streams.pop().close()
+    reopened = open_stream(client)
+    assert reopened.status_code == 200
+    for stream in streams + [reopened]:
+        stream.close()
+
+
+def test_streams_are_capped_per_process(app, make_user, login, monkeypatch):
+    monkeypatch.setattr(panel.stats_broadcaster, 'max_subscribers', 1)
+    monkeypatch.setattr(panel.stats_broadcaster, 'subscribers', set())
+    first = open_stream(login(make_user('alice')))
+    assert first.status_code == 200
+
+    bob = make_user('bob')
+    refused = open_stream(login(bob))
+    assert refused.status_code == 503
+    with app.app_context():
+        # The refused stream gave its per-user slot back
+        assert not panel.rate_limiter.held(f"{bob}:stream")
+
+    first.close()
+    assert panel.stats_broadcaster.subscribers == set()
+    with app.app_context():
+        assert panel.OperationLease.query.count() == 0
+
+
+def test_streams_end_after_the_max_duration(app, make_user, login):
+    app.config['STREAM_MAX_DURATION'] = 0.3
+    app.config['STREAM_KEEPALIVE'] = 0.1
+    stream = open_stream(login(make_user()))
+    body = b''.join(stream.response)
+    stream.close()
+    assert body.startswith(b'event: host\n')
+    assert b': keepalive' in body
+    assert panel.stats_broadcaster.subscribers == set()
+
@@ -0,0 +1,80 @@
+import threading
+import warnings
+
+from sqlalchemy.exc import SAWarning
+
+import app as panel
+
+
+def test_deleting_a_user_tears_down_their_vps_in_the_background(app, make_user, make_vps, fake_lxc, wait_until):
+    user_id = make_user('bob')
+    names = []
+    for n in range(3):
+        make_vps(user_id, name=f"vps-{user_id}-{n}")
+        names.append(f"vps-{user_id}-{n}")
+
+    with app.app_context():
+        tasks = panel.teardown_queue.enqueue_user(panel.db.session.get(panel.User, user_id))
+        assert len(tasks) == 3
+
+    def purged():
+        with app.app_context():
+            return panel.db.session.get(panel.User, user_id) is None
+
+    assert wait_until(purged)
+    assert not any(name in fake_lxc.containers for name in names)
+    with app.app_context():
+        assert panel.VPS.query.count() == 0
+        assert {task.status for task in panel.TeardownTask.query} == {'done'}
+
+
+def test_failed_deletes_are_retried_then_given_up(app, make_user, make_vps, fake_lxc, monkeypatch, wait_until):
+    monkeypatch.setattr(panel.teardown_queue, 'max_attempts', 2)
+    monkeypatch.setattr(panel.time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(panel, 'execute_lxc_sync', lambda command, timeout=120: (False, 'Error: device busy'))
+    user_id = make_user('bob')
+    make_vps(user_id)
+
+    with app.app_context():
+        panel.teardown_queue.enqueue_user(panel.db.session.get(panel.User, user_id))
+
+    def failed():
+        with app.app_context():
+            return panel.TeardownTask.query.filter_by(status='failed').first()
+
+    task = wait_until(failed)
+    assert task is not None
+    assert task.attempts == 2
+    with app.app_context():
+        user = panel.db.session.get(panel.User, user_id)
+        assert user.status == 'deleting'
+        assert panel.VPS.query.count() == 1
+
+
+def test_parallel_purges_delete_a_user_once(app, make_user):
+    user_ids = [make_user(f"user{n}", status='deleting') for n in range(5)]
+    barrier = threading.Barrier(8)
+    errors = []
+
+    def purge():
+        with app.app_context():
+            barrier.wait()
+            try:
+                panel.teardown_queue.purge_users()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                panel.db.session.remove()
+
+    # The last teardown tasks of a user finish together and all purge
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', SAWarning)
+        threads = [threading.Thread(target=purge) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert errors == []
+    with app.app_context():
+        assert not any(panel.db.session.get(panel.User, user_id) for user_id in user_ids)
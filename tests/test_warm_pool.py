@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+import app as panel
+from lxd_client import LXDClient
+
+
+@pytest.fixture
+def nodes(monkeypatch):
+    """A second, CLI-only node next to the default one, with a bigger pool"""
+    monkeypatch.setitem(panel.app.config['LXD_NODES'], 'node2', {'warm_pool': {'Starter/Intel': 3}})
+    monkeypatch.setitem(panel.lxd_nodes, 'node2', LXDClient(os.environ['LXD_SOCKET']))
+    monkeypatch.setattr(panel.warm_pool, 'targets', {'Starter/Intel': 1, 'Basic/AMD': 1})
+    monkeypatch.setattr(panel.warm_pool, 'hits', {})
+    monkeypatch.setattr(panel.warm_pool, 'misses', {})
+    monkeypatch.setattr(panel.node_scheduler, 'nodes', {})
+    return panel.DEFAULT_NODE, 'node2'
+
+
+def ready(app, host):
+    with app.app_context():
+        return sorted(warm.pool_key for warm in panel.WarmContainer.query.filter_by(host=host, status='ready'))
+
+
+def fake_hosts(fake_lxc, prefix='pool-'):
+    return sorted(container['host'] or panel.DEFAULT_NODE
+                  for name, container in fake_lxc.containers.items() if name.startswith(prefix))
+
+
+def test_every_node_fills_its_own_pool(app, nodes, fake_lxc):
+    default, node2 = nodes
+    with app.app_context():
+        panel.warm_pool.replenish()
+    assert ready(app, default) == ['Basic/AMD', 'Starter/Intel']
+    assert ready(app, node2) == ['Starter/Intel'] * 3
+    assert fake_hosts(fake_lxc) == sorted([default] * 2 + [node2] * 3)
+
+
+def test_claims_come_from_the_chosen_nodes_pool(app, nodes, fake_lxc):
+    default, node2 = nodes
+    with app.app_context():
+        panel.warm_pool.replenish()
+        assert panel.warm_pool.claim('Starter', 'Intel', node2) in fake_lxc.containers
+        assert panel.warm_pool.claim('Basic', 'AMD', node2) is None
+    assert ready(app, node2) == ['Starter/Intel'] * 2
+    assert ready(app, default) == ['Basic/AMD', 'Starter/Intel']
+
+    with app.app_context():
+        status = panel.warm_pool.status()
+    assert status[node2]['Starter/Intel'] == {'target': 3, 'ready': 2, 'hits': 1, 'misses': 0}
+    assert status[node2]['Basic/AMD'] == {'target': 0, 'ready': 0, 'hits': 0, 'misses': 1}
+    assert status[default]['Starter/Intel'] == {'target': 1, 'ready': 1, 'hits': 0, 'misses': 0}
+
+
+def test_vps_placed_on_another_node_is_served_from_its_pool(app, nodes, fake_lxc):
+    default, node2 = nodes
+    with app.app_context():
+        panel.warm_pool.replenish()
+        assert panel.provision_container('vps-1-1', 'Starter', 'Intel', node2) == (True, '')
+    container = fake_lxc.containers['vps-1-1']
+    assert (container['host'], container['status']) == (node2, 'Running')
+    assert container['config']['limits.cpu'] == panel.VPS_PLANS['Starter']['cpu']
+    assert ready(app, node2) == ['Starter/Intel'] * 2
+    assert ready(app, default) == ['Basic/AMD', 'Starter/Intel']
+
+
+def test_offline_and_failing_nodes_do_not_block_the_others(app, nodes, fake_lxc, monkeypatch):
+    default, node2 = nodes
+    monkeypatch.setattr(panel.node_scheduler, 'nodes', {default: {'online': False}})
+    with app.app_context():
+        panel.warm_pool.replenish()
+    assert ready(app, default) == []
+    assert ready(app, node2) == ['Starter/Intel'] * 3
+
+    monkeypatch.setattr(panel.node_scheduler, 'nodes', {})
+
+    def node2_down(command, timeout=120):
+        if 'node2:' in command:
+            return False, 'Error: node2 is unreachable'
+        return fake_lxc.execute(command, timeout)
+
+    monkeypatch.setattr(panel, 'execute_lxc_sync', node2_down)
+    with app.app_context():
+        panel.WarmContainer.query.filter_by(host=node2).delete()
+        panel.db.session.commit()
+        panel.warm_pool.replenish()
+    assert ready(app, default) == ['Basic/AMD', 'Starter/Intel']
+    assert ready(app, node2) == []